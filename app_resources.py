@@ -0,0 +1,94 @@
+"""Process-wide resources and static UI content for ``streamlit_app.py``.
+
+Streamlit runs ``streamlit_app.py`` again from the top on every interaction, but
+a module it imports is loaded only once per server process. Everything here is
+therefore built once: the ``st.cache_resource`` getters are decorated once
+(decorating hashes the function's source, which isn't free), and the static
+sidebar text is formatted once. The routing profile is also read once, at
+startup, so a newly tuned profile takes effect when the server restarts.
+Nothing here imports the Gemini SDK up front, so the first page can be drawn
+before an API key is entered.
+"""
+import streamlit as st
+
+from chatbot.cache import ResponseCache
+from chatbot.memory import SessionMemoryManager
+from chatbot.metrics import MetricsRecorder
+from chatbot.routing import TIER_PARAMETERS, load_routing_profile
+from chatbot.scheduler import RequestScheduler
+from chatbot.singleflight import SingleFlight
+
+
+@st.cache_resource
+def get_response_cache():
+    """One response cache per server process, shared by every browser session."""
+    return ResponseCache()
+
+
+@st.cache_resource
+def get_client_registry():
+    """Pooled Gemini clients shared by every session in the server process."""
+    # The SDK is only imported once the first API key is entered
+    from chatbot.clients import ClientRegistry
+    return ClientRegistry()
+
+
+@st.cache_resource
+def get_metrics_recorder():
+    """Per-stage turn latencies from every session, exported to .metrics/ (JSONL + Prometheus)."""
+    return MetricsRecorder()
+
+
+@st.cache_resource
+def get_request_scheduler():
+    """Per-model rate limits and fair queuing for every Gemini request in the server process."""
+    return RequestScheduler()
+
+
+@st.cache_resource
+def get_single_flight():
+    """Identical requests in flight from different sessions share one upstream call."""
+    return SingleFlight()
+
+
+@st.cache_resource
+def get_memory_manager():
+    """Per-session and global memory budgets; spills cold history of every session to .cache/history.sqlite3."""
+    return SessionMemoryManager()
+
+
+# Weights and thresholds every turn is routed with (routing_profile.json if present, see chatbot/tuning.py)
+ROUTING_PROFILE = load_routing_profile()
+
+
+def _sampling(model_name: str) -> str:
+    temperature, top_p, top_k, description = TIER_PARAMETERS[model_name]
+    return f"*Temperature: {temperature}, Top-p: {top_p}, Top-k: {top_k} ({description})*"
+
+
+# "Smart Model Routing" guide in the sidebar, with the numbers taken from the routing profile
+ROUTING_GUIDE = f"""
+**Gemini-2.5-Pro** is used for:
+- Very complex mathematical problems
+- Advanced algorithms and data structures
+- Research-level technical analysis
+- Long conversations (>{ROUTING_PROFILE.token_threshold_pro} tokens)
+- {_sampling("gemini-2.5-pro")}
+
+**Gemini-2.5-Flash** is used for:
+- Programming and code analysis
+- Technical explanations
+- Medium complexity problems
+- {_sampling("gemini-2.5-flash")}
+
+**Gemini-2.5-Flash-Lite** is used for:
+- Simple questions
+- General conversations
+- Basic information requests
+- Short conversations
+- {_sampling("gemini-2.5-flash-lite")}
+
+*Routing considers both content complexity and conversation length*
+
+*Routing profile: {ROUTING_PROFILE.version} (flash from score {ROUTING_PROFILE.medium_tier_threshold}, pro from {ROUTING_PROFILE.top_tier_threshold})*
+"""
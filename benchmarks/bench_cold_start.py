@@ -0,0 +1,137 @@
+"""First-paint time and per-rerun overhead of streamlit_app.py.
+
+Streamlit runs the whole script again on every interaction, so whatever it
+does at the top level is paid on every click. Three things are measured with
+Streamlit's AppTest, timing only the script's execution (AppTest's own
+bookkeeping is left out by wrapping Streamlit's script runner):
+
+* first paint: the first run of the script in a fresh Python process (with
+  ``streamlit`` itself already imported), before an API key is entered; each
+  sample is its own subprocess, and whether ``google.genai`` got imported is
+  reported too
+* key entry: the run right after the key is typed in, in the same process
+* rerun overhead: a rerun with nothing to do, without a key and with a key and
+  a few turns of history (sent to ``fake_gemini``)
+
+Run it on two checkouts (e.g. ``git worktree add``) to compare a change. No
+network access is needed.
+
+Usage:
+    python benchmarks/bench_cold_start.py
+    python benchmarks/bench_cold_start.py --processes 10 --reruns 50
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+BENCH_DIR = Path(__file__).resolve().parent
+APP_PATH = str(ROOT / "streamlit_app.py")
+
+
+def time_script_runs():
+    """Record how long each run of the script itself takes; returns the list the times go to."""
+    from streamlit.runtime.scriptrunner import script_runner
+
+    times = []
+    run_script = script_runner.exec_func_with_error_handling
+
+    def timed_run(func, ctx):
+        def timed_func():
+            started = time.perf_counter()
+            try:
+                return func()
+            finally:
+                times.append(time.perf_counter() - started)
+        return run_script(timed_func, ctx)
+
+    script_runner.exec_func_with_error_handling = timed_run
+    return times
+
+
+def cold_start() -> dict:
+    """First paint and key entry in this (fresh) process; run with ``--child``."""
+    import streamlit  # noqa: F401  (its own import time isn't the app's)
+    from streamlit.testing.v1 import AppTest
+
+    times = time_script_runs()
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    at.run()
+    genai_loaded = "google.genai" in sys.modules
+    at.text_input[0].set_value("offline-benchmark-key").run()
+    if at.exception:
+        sys.exit(f"App failed: {at.exception[0].value}")
+    return {"first_paint": times[0], "genai_at_first_paint": genai_loaded, "key_entry": times[1]}
+
+
+def rerun_overhead(reruns: int, turns: int) -> dict:
+    """Median idle rerun times of the app without a key and with a key and some history."""
+    sys.path.insert(0, str(BENCH_DIR))
+    from streamlit.testing.v1 import AppTest
+
+    times = time_script_runs()
+
+    def median_rerun(at) -> float:
+        at.run()
+        del times[:]
+        for _ in range(reruns):
+            at.run()
+        return statistics.median(times)
+
+    results = {"no_key": median_rerun(AppTest.from_file(APP_PATH, default_timeout=120))}
+
+    from fake_gemini import FakeBackendConfig, install
+    install(FakeBackendConfig(first_token_latency=0.0, chunk_latency=0.0, count_tokens_latency=0.0))
+    keyed = AppTest.from_file(APP_PATH, default_timeout=120)
+    keyed.run()
+    keyed.text_input[0].set_value("offline-benchmark-key").run()
+    for turn in range(turns):
+        keyed.chat_input[0].set_value(f"halo, ini pertanyaan nomor {turn}").run()
+    if keyed.exception:
+        sys.exit(f"App failed: {keyed.exception[0].value}")
+    results["with_history"] = median_rerun(keyed)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, default=5, help="fresh processes for the first-paint samples")
+    parser.add_argument("--reruns", type=int, default=30, help="idle reruns per rerun measurement")
+    parser.add_argument("--turns", type=int, default=6, help="chat turns before the keyed reruns")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    workdir = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)  # Keep the response cache and metrics files out of the repository
+        try:
+            if args.child:
+                print(json.dumps(cold_start()))
+                return
+            samples = []
+            for _ in range(args.processes):
+                child = subprocess.run([sys.executable, __file__, "--child"], capture_output=True, text=True)
+                if child.returncode:
+                    sys.exit(child.stderr or child.stdout)
+                samples.append(json.loads(child.stdout.strip().splitlines()[-1]))
+            reruns = rerun_overhead(args.reruns, args.turns)
+        finally:
+            os.chdir(workdir)
+
+    print(f"cold start, median of {args.processes} fresh processes (streamlit already imported)")
+    print(f"  first paint (no key)    {statistics.median(s['first_paint'] for s in samples) * 1000:8.1f} ms"
+          f"   google.genai imported: {'yes' if any(s['genai_at_first_paint'] for s in samples) else 'no'}")
+    print(f"  first run with a key    {statistics.median(s['key_entry'] for s in samples) * 1000:8.1f} ms")
+    print(f"idle rerun, median of {args.reruns}")
+    print(f"  no key                  {reruns['no_key'] * 1000:8.1f} ms")
+    print(f"  {args.turns:>2} turns of history     {reruns['with_history'] * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
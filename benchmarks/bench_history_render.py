@@ -0,0 +1,76 @@
+"""Measure Streamlit rerun time as the conversation grows, full history vs. windowed.
+
+Drives streamlit_app.py through Streamlit's AppTest; no network access is needed
+(the Gemini client is created but never called).
+
+Usage: python benchmarks/bench_history_render.py [--repeat N]
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from streamlit.testing.v1 import AppTest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from chatbot.messages import Message  # noqa: E402
+
+APP_PATH = str(ROOT / "streamlit_app.py")
+SIZES = [10, 100, 1000]
+
+ASSISTANT_TEXT = (
+    "Here is a short explanation with an example:\n\n"
+    "```python\ndef fib(n):\n    a, b = 0, 1\n    for _ in range(n):\n        a, b = b, a + b\n    return a\n```\n\n"
+    "The loop keeps only the last two values, so it runs in O(n) time and O(1) memory."
+)
+ASSISTANT_CITATIONS = ((1, "https://example.com/fibonacci"), (2, "https://example.com/complexity"))
+
+
+def make_messages(count: int) -> list:
+    messages = []
+    for i in range(count):
+        if i % 2 == 0:
+            messages.append(Message("user", f"Question {i}: jelaskan fibonacci dengan kode?"))
+        else:
+            messages.append(Message("assistant", ASSISTANT_TEXT, citations=ASSISTANT_CITATIONS, model="gemini-2.5-flash"))
+    return messages
+
+
+def time_reruns(count: int, show_all: bool, repeat: int) -> float:
+    """Median rerun time with ``count`` stored messages."""
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    at.run()
+    at.text_input[0].set_value("bench-key").run()
+    at.session_state["messages"] = make_messages(count)
+    # Rendering every page reproduces the old "draw the whole history" loop
+    at.session_state["history_pages"] = 10 ** 6 if show_all else 0
+
+    at.run()  # Warm-up
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        at.run()
+        times.append(time.perf_counter() - started)
+        if at.exception:
+            sys.exit(f"App raised: {at.exception}")
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="reruns per measurement (median is reported)")
+    args = parser.parse_args()
+
+    print(f"{'messages':>8} | {'full history':>12} | {'windowed':>10} | speedup")
+    print("-" * 48)
+    for count in SIZES:
+        full = time_reruns(count, show_all=True, repeat=args.repeat)
+        windowed = time_reruns(count, show_all=False, repeat=args.repeat)
+        print(f"{count:>8} | {full * 1e3:>10.1f}ms | {windowed * 1e3:>8.1f}ms | {full / windowed:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
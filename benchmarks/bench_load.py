@@ -0,0 +1,532 @@
+"""Concurrent multi-session load test of the Streamlit server against a fake Gemini backend.
+
+Starts ``streamlit run streamlit_app.py`` in a subprocess with ``fake_gemini``
+in place of the Gemini SDK (first-token latency, streaming speed, reply length,
+``count_tokens`` latency and error rate are flags), then drives simulated
+browser tabs over Streamlit's websocket the way a browser does: each tab
+enters an API key, sets its sidebar toggles and plays the multi-turn
+conversations in ``--conversations`` (the default file mixes simple and complex
+prompts, so tabs switch tiers mid-conversation and rebuild their chats), with
+``--think`` seconds between turns. Tabs connect over ``--ramp`` seconds.
+
+Each concurrency level in ``--sessions`` gets a fresh server and reports:
+
+* throughput (turns/s) and the tabs' turn latency percentiles: from sending
+  the prompt to Streamlit's "script finished", i.e. what the user waits for
+* session setup time (first page, key entry, toggles) and failed turns
+* server CPU (100% = one core), RSS and thread count, sampled from /proc
+* the server's own per-stage p50/p95 from its ``.metrics/turns.jsonl``
+  (queue wait, ``count_tokens``, first token, ...), model switches and retries
+
+Every run writes a JSON report (git commit, settings, results) to
+``--report-dir``. ``--compare`` prints the change against an earlier report, so
+runs can be tracked across versions. The load generator runs in its own
+process, so its CPU isn't counted as the server's. No network access is needed.
+
+Usage:
+    python benchmarks/bench_load.py
+    python benchmarks/bench_load.py --sessions 1,8,32,64 --turns 6 --think 2 --verify-tokens
+    python benchmarks/bench_load.py --latency 1.0 --error-rate 0.05 --compare .loadtest/<earlier report>.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from dataclasses import asdict
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(BENCH_DIR))
+
+from fake_gemini import FakeBackendConfig  # noqa: E402
+
+APP_PATH = str(ROOT / "streamlit_app.py")
+REPORT_VERSION = 1
+API_KEY = "offline-load-test-key"
+SAMPLE_INTERVAL = 0.5  # Seconds between server CPU / RSS samples
+STAGES = ("queue_wait", "count_tokens", "chat_session", "first_token", "send_message", "rendering", "turn")
+
+
+def quantile(sorted_values: list, q: float) -> float:
+    """Nearest-rank quantile of an already sorted list (same as chatbot/metrics.py)."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(q * len(sorted_values)) - 1)]
+
+
+def latency_summary(seconds: list) -> dict:
+    values = sorted(seconds)
+    summary = {f"p{round(q * 100)}_ms": quantile(values, q) * 1000 for q in (0.5, 0.95, 0.99)}
+    summary["max_ms"] = (values[-1] if values else 0.0) * 1000
+    return summary
+
+
+def load_conversations(path: str) -> list:
+    """User prompts per conversation; same JSONL format as ``bench_pipeline.py --replay``."""
+    conversations = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "prompts" in record:
+                conversations.append(list(record["prompts"]))
+            else:
+                conversations.append([m["content"] for m in record["messages"] if m["role"] == "user"])
+    return conversations
+
+
+# --- Server side ---
+
+def serve(port: int, fake_config: dict):
+    """Run the app on ``port`` with the fake backend installed; used with ``--serve``."""
+    from fake_gemini import install
+    from streamlit.web import cli
+
+    install(FakeBackendConfig(**fake_config))
+    sys.argv = ["streamlit", "run", APP_PATH, f"--server.port={port}", "--server.address=127.0.0.1",
+                "--server.headless=true", "--server.fileWatcherType=none", "--browser.gatherUsageStats=false"]
+    cli.main()
+
+
+class ServerProcess:
+    """``streamlit run`` in a subprocess, with its working files (caches, metrics) in ``workdir``."""
+
+    def __init__(self, workdir: str, fake_config: dict):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+        self.workdir = workdir
+        self.log_path = os.path.join(workdir, "server.log")
+        with open(self.log_path, "w") as log:
+            self.process = subprocess.Popen(
+                [sys.executable, __file__, "--serve", json.dumps(fake_config), "--port", str(self.port)],
+                cwd=workdir, stdout=log, stderr=subprocess.STDOUT,
+            )
+        self.pid = self.process.pid
+        self.url = f"ws://127.0.0.1:{self.port}/_stcore/stream"
+
+    def wait_ready(self, timeout: float = 60.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                break
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{self.port}/_stcore/health", timeout=1) as response:
+                    if response.status == 200:
+                        return
+            except OSError:
+                time.sleep(0.2)
+        self.stop()
+        with open(self.log_path) as log:
+            sys.exit(f"Server didn't start:\n{log.read()[-2000:]}")
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    def turn_records(self) -> list:
+        """The server's per-turn metric records (``.metrics/turns.jsonl`` and its rotated files)."""
+        records = []
+        for path in sorted(Path(self.workdir, ".metrics").glob("turns.jsonl*")):
+            with open(path, encoding="utf-8") as f:
+                records.extend(json.loads(line) for line in f if line.strip())
+        return records
+
+
+class ProcSampler:
+    """Samples a process's CPU time, RSS and thread count from /proc in a background thread.
+
+    Linux only; elsewhere ``available`` is False and the server columns stay empty.
+    """
+
+    def __init__(self, pid: int, interval: float = SAMPLE_INTERVAL):
+        self.pid = pid
+        self.interval = interval
+        self.available = os.path.exists(f"/proc/{pid}/stat")
+        self.samples = []  # (monotonic time, cpu seconds, rss bytes, threads)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def sample(self):
+        if not self.available:
+            return None
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                stat = f.read()
+            with open(f"/proc/{self.pid}/status") as f:
+                status = dict(line.split(":", 1) for line in f if ":" in line)
+        except OSError:
+            return None
+        fields = stat[stat.rindex(")") + 2:].split()  # The command name may contain spaces
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")  # utime + stime
+        rss = int(status["VmRSS"].split()[0]) * 1024
+        sample = (time.monotonic(), cpu, rss, int(status["Threads"]))
+        self.samples.append(sample)
+        return sample
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self.samples.clear()
+        self.sample()
+        self._thread.start()
+
+    def stop(self) -> dict:
+        """Stop sampling; returns CPU (mean / peak percent of one core), RSS and thread numbers."""
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+        if len(self.samples) < 2:
+            return {}
+        first, last = self.samples[0], self.samples[-1]
+        peaks = [(b[1] - a[1]) / (b[0] - a[0]) for a, b in zip(self.samples, self.samples[1:]) if b[0] > a[0]]
+        return {
+            "cpu_seconds": last[1] - first[1],
+            "cpu_percent_mean": (last[1] - first[1]) / (last[0] - first[0]) * 100,
+            "cpu_percent_peak": max(peaks) * 100,
+            "rss_mb_start": first[2] / 2**20,
+            "rss_mb_peak": max(s[2] for s in self.samples) / 2**20,
+            "rss_mb_end": last[2] / 2**20,
+            "threads_peak": max(s[3] for s in self.samples),
+        }
+
+
+# --- Client side ---
+
+class BrowserTab:
+    """One simulated browser tab talking to Streamlit's websocket (``/_stcore/stream``).
+
+    Like the browser, it sends every widget value it has set with each rerun, and
+    learns widget ids by label from the elements the server sends.
+    """
+
+    def __init__(self, url: str, toggles: dict):
+        self.url = url
+        self.toggles = toggles  # toggle label -> on/off
+        self.widgets = {}  # label (or element type) -> widget id
+        self.states = {}   # widget id -> WidgetState sent with every rerun
+        self.ws = None
+
+    async def open(self):
+        import websockets
+
+        self.ws = await websockets.connect(self.url, subprotocols=["streamlit"], max_size=None)
+        await self.rerun()
+        self.set_value("Google AI API Key", string_value=API_KEY)
+        await self.rerun()
+        if self.toggles:
+            for label, on in self.toggles.items():
+                self.set_value(label, bool_value=on)
+            await self.rerun()
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+
+    def set_value(self, label: str, **value):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        if label not in self.widgets:
+            raise KeyError(f"No widget labelled {label!r} on the page")
+        widget_id = self.widgets[label]
+        self.states[widget_id] = WidgetState(id=widget_id, **value)
+
+    async def send(self, prompt: str) -> bool:
+        """Send one chat prompt and wait for the rerun to finish; returns whether the script raised."""
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        trigger = WidgetState(id=self.widgets["chat_input"])
+        trigger.chat_input_value.data = prompt
+        return await self.rerun(trigger)
+
+    async def rerun(self, trigger=None) -> bool:
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        message = BackMsg()
+        message.rerun_script.query_string = ""
+        message.rerun_script.widget_states.widgets.extend(self.states.values())
+        if trigger is not None:
+            message.rerun_script.widget_states.widgets.append(trigger)
+        await self.ws.send(message.SerializeToString())
+        raised = False
+        while True:
+            forward = ForwardMsg()
+            forward.ParseFromString(await self.ws.recv())
+            kind = forward.WhichOneof("type")
+            if kind == "delta" and forward.delta.WhichOneof("type") == "new_element":
+                element = forward.delta.new_element
+                element_type = element.WhichOneof("type")
+                widget = getattr(element, element_type)
+                if getattr(widget, "id", ""):
+                    self.widgets[getattr(widget, "label", "") or element_type] = widget.id
+                raised = raised or element_type == "exception"
+            elif kind == "script_finished" and forward.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                return raised or forward.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR
+
+
+async def run_tab(index: int, sessions: int, url: str, prompts: list, args, toggles: dict, results: dict):
+    """One tab: connect after its ramp delay, then play its prompts with think time in between."""
+    rng = random.Random(args.seed + index)
+    await asyncio.sleep(args.ramp * index / sessions)
+    tab = BrowserTab(url, toggles)
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(tab.open(), args.timeout)
+        results["setup"].append(time.perf_counter() - started)
+        for turn, prompt in enumerate(prompts):
+            if turn:
+                await asyncio.sleep(args.think * rng.uniform(0.5, 1.5))
+            sent = time.perf_counter()
+            raised = await asyncio.wait_for(tab.send(prompt), args.timeout)
+            results["turns"].append(time.perf_counter() - sent)
+            results["finished"].append(time.perf_counter())
+            if raised:
+                results["errors"].append("exception")
+    except Exception as e:  # Timeouts, dropped connections: the tab gives up like a user would
+        results["errors"].append(type(e).__name__)
+    finally:
+        await tab.close()
+
+
+def tab_prompts(conversations: list, index: int, turns: int) -> list:
+    """``turns`` prompts for tab ``index``: whole conversations in a row, starting at a different one per tab."""
+    order = conversations[index % len(conversations):] + conversations[:index % len(conversations)]
+    return list(itertools.islice(itertools.chain.from_iterable(itertools.cycle(order)), turns))
+
+
+async def drive(url: str, sessions: int, conversations: list, args, toggles: dict) -> dict:
+    results = {"setup": [], "turns": [], "finished": [], "errors": []}
+    results["started"] = time.perf_counter()
+    await asyncio.gather(*(
+        run_tab(index, sessions, url, tab_prompts(conversations, index, args.turns), args, toggles, results)
+        for index in range(sessions)
+    ))
+    results["ended"] = time.perf_counter()
+    return results
+
+
+def server_summary(records: list) -> dict:
+    """Per-stage p50/p95, models, switches, retries and failures from the server's turn records."""
+    ok = [r for r in records if not r.get("failed")]
+    stages = {}
+    for stage in STAGES:
+        values = sorted(r["spans"][stage] for r in ok if stage in r["spans"])
+        if values:
+            stages[stage] = {"p50_ms": quantile(values, 0.5) * 1000, "p95_ms": quantile(values, 0.95) * 1000}
+    models = {}
+    for r in records:
+        models[r.get("model") or "unknown"] = models.get(r.get("model") or "unknown", 0) + 1
+    return {
+        "turns": len(records),
+        "failed": len(records) - len(ok),
+        "switched": sum(1 for r in records if r.get("switched")),
+        "retries": sum(r.get("retries", 0) for r in records),
+        "coalesced": sum(1 for r in records if r.get("coalesced")),
+        "models": models,
+        "stages": stages,
+    }
+
+
+def run_level(sessions: int, conversations: list, args, fake_config: dict, toggles: dict) -> dict:
+    """One concurrency level on a fresh server; returns its part of the report."""
+    with tempfile.TemporaryDirectory() as workdir:
+        server = ServerProcess(workdir, fake_config)
+        try:
+            server.wait_ready()
+            sampler = ProcSampler(server.pid)
+            sampler.start()
+            results = asyncio.run(drive(server.url, sessions, conversations, args, toggles))
+            usage = sampler.stop()
+            # The last turn's record is written right after its rerun finishes
+            time.sleep(SAMPLE_INTERVAL)
+            records = server.turn_records()
+        finally:
+            server.stop()
+    # Throughput over the window in which turns were being answered
+    window = (max(results["finished"]) - results["started"]) if results["finished"] else 0.0
+    return {
+        "sessions": sessions,
+        "turns": len(results["turns"]),
+        "errors": len(results["errors"]),
+        "error_kinds": sorted(set(results["errors"])),
+        "duration_s": results["ended"] - results["started"],
+        "throughput_turns_per_s": len(results["turns"]) / window if window else 0.0,
+        "turn_latency": {**latency_summary(results["turns"]),
+                         "mean_ms": sum(results["turns"]) / len(results["turns"]) * 1000 if results["turns"] else 0.0},
+        "setup_latency": latency_summary(results["setup"]),
+        "server": usage,
+        "server_turns": server_summary(records),
+    }
+
+
+# --- Reports ---
+
+def git_info() -> dict:
+    def git(*command):
+        return subprocess.run(["git", *command], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    try:
+        return {"commit": git("rev-parse", "HEAD"), "describe": git("describe", "--always", "--dirty"),
+                "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "describe": None, "dirty": None}
+
+
+def fmt(value, spec: str = ".0f") -> str:
+    return "-" if value is None else format(value, spec)
+
+
+def print_levels(levels: list):
+    print(f"{'sessions':>8} | {'turns':>5} | {'failed':>6} | {'turns/s':>7} | {'p50':>7} | {'p95':>7} | {'p99':>7} | "
+          f"{'setup p95':>9} | {'CPU mean/peak':>13} | {'RSS peak':>8} | {'threads':>7}")
+    print("-" * 112)
+    for level in levels:
+        latency, server = level["turn_latency"], level["server"]
+        failed = level["server_turns"]["failed"] + level["errors"]
+        print(f"{level['sessions']:>8} | {level['turns']:>5} | {failed:>6} | {level['throughput_turns_per_s']:>7.2f} | "
+              f"{latency['p50_ms']:>5.0f}ms | {latency['p95_ms']:>5.0f}ms | {latency['p99_ms']:>5.0f}ms | "
+              f"{level['setup_latency']['p95_ms']:>7.0f}ms | "
+              f"{fmt(server.get('cpu_percent_mean')):>5}% /{fmt(server.get('cpu_percent_peak')):>4}% | "
+              f"{fmt(server.get('rss_mb_peak')):>5} MB | {fmt(server.get('threads_peak')):>7}")
+    print()
+    print("server stages, p95 ms (from .metrics/turns.jsonl)")
+    print(f"{'stage':<14}" + "".join(f" | {level['sessions']:>4} tabs" for level in levels))
+    for stage in STAGES:
+        row = [level["server_turns"]["stages"].get(stage, {}).get("p95_ms") for level in levels]
+        if any(value is not None for value in row):
+            print(f"{stage:<14}" + "".join(f" | {fmt(value):>9}" for value in row))
+    print(f"{'switches':<14}" + "".join(f" | {level['server_turns']['switched']:>9}" for level in levels))
+    print(f"{'retries':<14}" + "".join(f" | {level['server_turns']['retries']:>9}" for level in levels))
+
+
+def print_comparison(report: dict, baseline: dict):
+    def change(new, old) -> str:
+        if new is None or old is None:
+            return "-"
+        return f"{new:.1f} ({(new - old) / old * 100:+.0f}%)" if old else f"{new:.1f}"
+
+    old_levels = {level["sessions"]: level for level in baseline["levels"]}
+    print(f"compared with {baseline['git'].get('describe') or '?'} ({baseline['created']}):")
+    print(f"{'sessions':>8} | {'turns/s':>16} | {'p95 ms':>18} | {'CPU mean %':>16} | {'RSS peak MB':>16}")
+    for level in report["levels"]:
+        old = old_levels.get(level["sessions"])
+        if old is None:
+            continue
+        print(f"{level['sessions']:>8} | "
+              f"{change(level['throughput_turns_per_s'], old['throughput_turns_per_s']):>16} | "
+              f"{change(level['turn_latency']['p95_ms'], old['turn_latency']['p95_ms']):>18} | "
+              f"{change(level['server'].get('cpu_percent_mean'), old['server'].get('cpu_percent_mean')):>16} | "
+              f"{change(level['server'].get('rss_mb_peak'), old['server'].get('rss_mb_peak')):>16}")
+    if baseline["config"] != report["config"]:
+        print("note: the two runs used different settings (see \"config\" in the reports)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", default="1,4,16", help="comma-separated concurrency levels (simultaneous tabs)")
+    parser.add_argument("--turns", type=int, default=6, help="turns per tab")
+    parser.add_argument("--think", type=float, default=1.0, help="mean seconds between a tab's turns (jittered ±50%%)")
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds over which the tabs connect")
+    parser.add_argument("--conversations", default=str(BENCH_DIR / "conversations.jsonl"), help="JSONL conversations to play")
+    parser.add_argument("--latency", type=float, default=0.5, help="fake first-token latency in seconds")
+    parser.add_argument("--chunk-latency", type=float, default=0.02, help="fake seconds between streamed chunks")
+    parser.add_argument("--count-tokens-latency", type=float, default=0.1, help="fake seconds per count_tokens call")
+    parser.add_argument("--reply-chars", type=int, default=800, help="length of each fake reply")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake generation calls that fail with 503")
+    parser.add_argument("--no-stream", action="store_true", help="turn Stream Responses off (blocking send_message)")
+    parser.add_argument("--verify-tokens", action="store_true", help="turn on Verify Token Counts with API")
+    parser.add_argument("--keep-cache", action="store_true", help="leave Reuse Cached Answers on (off by default, since "
+                                                                     "tabs replay the same prompts)")
+    parser.add_argument("--toggle", action="append", default=[], metavar="LABEL=on|off", help="set any other sidebar toggle")
+    parser.add_argument("--timeout", type=float, default=300.0, help="seconds before a tab gives up on a turn")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report-dir", default=".loadtest", help="where the JSON report is written")
+    parser.add_argument("--compare", help="an earlier report to compare with")
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, json.loads(args.serve))
+        return
+    try:
+        import websockets  # noqa: F401
+    except ImportError:
+        sys.exit("The load test needs the websockets package: pip install websockets")
+
+    toggles = {"Reuse Cached Answers": args.keep_cache}
+    if args.no_stream:
+        toggles["Stream Responses"] = False
+    if args.verify_tokens:
+        toggles["Verify Token Counts with API"] = True
+    for item in args.toggle:
+        label, _, value = item.rpartition("=")
+        toggles[label] = value.lower() in ("on", "true", "1", "yes")
+    fake_config = asdict(FakeBackendConfig(
+        first_token_latency=args.latency,
+        chunk_latency=args.chunk_latency,
+        count_tokens_latency=args.count_tokens_latency,
+        reply_chars=args.reply_chars,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    ))
+    conversations = load_conversations(args.conversations)
+    levels = [int(value) for value in args.sessions.split(",")]
+
+    report = {
+        "version": REPORT_VERSION,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "git": git_info(),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count(), "streamlit": __import__("streamlit").__version__},
+        "config": {"turns": args.turns, "think": args.think, "ramp": args.ramp, "toggles": toggles,
+                   "conversations": os.path.relpath(args.conversations, ROOT), "timeout": args.timeout,
+                   "fake_backend": fake_config},
+        "levels": [],
+    }
+    for sessions in levels:
+        print(f"{sessions} tab(s) x {args.turns} turns ...", flush=True)
+        report["levels"].append(run_level(sessions, conversations, args, fake_config, toggles))
+
+    os.makedirs(args.report_dir, exist_ok=True)
+    commit = (report["git"]["describe"] or "nogit").replace("/", "-")
+    report_path = os.path.join(args.report_dir, f"{datetime.now():%Y%m%d-%H%M%S}-{commit}.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print()
+    print(f"fake backend: {args.latency}s first token, {args.chunk_latency}s/chunk, {args.count_tokens_latency}s "
+          f"count_tokens, {args.error_rate:.0%} errors; {os.cpu_count()} CPU(s) shared with the load generator")
+    print_levels(report["levels"])
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print()
+        print_comparison(report, baseline)
+    print()
+    print(f"report written to {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Compare per-session memory and context tokens: Message records vs. the old dict messages.
+
+Builds the same conversation twice from fake Gemini responses (text, executed
+code, its output and citations): once the way messages used to be stored (one
+markdown string per reply in a dict, citations appended to it) and once as
+``chatbot.messages.Message`` records. Memory is what ``tracemalloc`` sees still
+allocated once the responses are gone (the app drops them after each turn).
+Context tokens are what the models get sent as history (the whole string
+before, only the text now). The old path kept only ``response.text``, so with
+tool parts on the records also hold code and output that used to be lost. No
+network access is needed.
+
+Usage: python benchmarks/bench_message_storage.py [--turns N] [--citations N] [--no-tools]
+"""
+import argparse
+import gc
+import re
+import sys
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from chatbot.messages import Message  # noqa: E402
+from chatbot.responses import ReplyParser  # noqa: E402
+from chatbot.tokens import default_estimator  # noqa: E402
+from fake_gemini import FakeBackendConfig, FakeBackendStats, _Backend  # noqa: E402
+from google.genai import types  # noqa: E402
+
+MODEL = "gemini-2.5-flash"
+PROMPT = "jelaskan fibonacci dan jalankan kodenya?"
+
+
+def baseline_reply(response) -> str:
+    """The stored reply as it used to be built: ``response.text`` plus a citation list."""
+    text = response.text or ""
+    text = re.sub(r"```(\w*)\s*\n", r"```\1\n", text)
+    text = re.sub(r"```\s*$", "```", text, flags=re.MULTILINE)
+    metadata = response.candidates[0].grounding_metadata
+    if metadata and metadata.grounding_supports and metadata.grounding_chunks:
+        uris = [f"[{i + 1}] {chunk.web.uri}" for i, chunk in enumerate(metadata.grounding_chunks) if chunk.web]
+        if uris:
+            text += ("\n\n Referensi:\n" + "\n".join(uris)).strip()
+    return text
+
+
+def baseline_messages(responses: list) -> list:
+    messages = []
+    for response in responses:
+        messages.append({"role": "user", "content": PROMPT})
+        messages.append({
+            "role": "assistant",
+            "content": baseline_reply(response),
+            "model": MODEL,
+            "first_token_time": 0.3,
+            "generation_time": 1.2,
+            "context_tokens": 1000,
+            "saved_tokens": 0,
+        })
+    return messages
+
+
+def record_messages(responses: list) -> list:
+    messages = []
+    for response in responses:
+        messages.append(Message("user", PROMPT))
+        parser = ReplyParser()
+        parser.feed(response)
+        messages.append(Message.from_reply(
+            parser, model=MODEL, first_token_time=0.3, generation_time=1.2, context_tokens=1000,
+        ))
+    return messages
+
+
+def make_responses(backend: _Backend, turns: int) -> list:
+    responses = []
+    for _ in range(turns):
+        parts = [types.Part(text=backend.reply_text(MODEL))] + backend.tool_parts()
+        responses.append(backend.response(parts, types.FinishReason.STOP, backend.grounding()))
+    return responses
+
+
+def measure(build, backend: _Backend, turns: int) -> tuple:
+    """``(messages, bytes they keep alive)``; the responses are built and dropped while tracing."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    messages = build(make_responses(backend, turns))
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return messages, retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=100, help="assistant replies in the session")
+    parser.add_argument("--reply-chars", type=int, default=800, help="length of each reply's text part")
+    parser.add_argument("--citations", type=int, default=3, help="grounding citations per reply")
+    parser.add_argument("--no-tools", action="store_true", help="omit executable code / execution result parts")
+    args = parser.parse_args()
+
+    backend = _Backend(FakeBackendConfig(
+        reply_chars=args.reply_chars, citations=args.citations, tool_parts=not args.no_tools,
+    ), FakeBackendStats())
+    make_responses(backend, 1)  # Warm up the SDK's lazy imports and caches outside the measurement
+
+    old, old_bytes = measure(baseline_messages, backend, args.turns)
+    new, new_bytes = measure(record_messages, backend, args.turns)
+    old_tokens = sum(default_estimator.estimate(msg["content"]) for msg in old)
+    new_tokens = sum(default_estimator.estimate(msg.text) for msg in new)
+    shown = sum(len(msg.content) for msg in new if msg.role == "assistant")
+    old_shown = sum(len(msg["content"]) for msg in old if msg["role"] == "assistant")
+
+    print(f"{args.turns} turns, {args.reply_chars}-char replies, {args.citations} citations, "
+          f"tool parts {'off' if args.no_tools else 'on'}")
+    print(f"{'':<22} | {'dict + string':>13} | {'Message':>10} | change")
+    print("-" * 60)
+    print(f"{'session memory':<22} | {old_bytes / 1024:>10.1f}KiB | {new_bytes / 1024:>7.1f}KiB | "
+          f"{new_bytes / old_bytes - 1:>+6.1%}")
+    print(f"{'context tokens':<22} | {old_tokens:>13} | {new_tokens:>10} | {new_tokens / old_tokens - 1:>+6.1%}")
+    print(f"{'displayed chars/reply':<22} | {old_shown / args.turns:>13.0f} | {shown / args.turns:>10.0f} |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""Offline per-stage breakdown of a full chat turn against a fake Gemini backend.
+
+Drives the real streamlit_app.py turn flow through Streamlit's AppTest with
+``fake_gemini.FakeClient`` in place of ``genai.Client``, so no network or API key
+is needed. Each turn is split into: routing, token estimation, context building,
+network wait, response part parsing, reply assembly (building the message record
+and its markdown: code blocks, tool output, citations) and rendering (everything
+else Streamlit and the script do during the rerun).
+
+Usage:
+    python benchmarks/bench_pipeline.py                        # synthetic conversations
+    python benchmarks/bench_pipeline.py --replay benchmarks/conversations.jsonl
+    python benchmarks/bench_pipeline.py --latency 0.5 --no-stream --verify-tokens --json out.json
+
+Replay files hold one conversation per line, either ``{"prompts": [...]}`` or
+``{"messages": [{"role": "user", "content": ...}, ...]}`` (only user turns are sent).
+"""
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import streamlit as st  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+import chatbot.routing  # noqa: E402
+from chatbot.context import ContextManager  # noqa: E402
+from chatbot.messages import Message  # noqa: E402
+from chatbot.responses import ReplyParser  # noqa: E402
+from chatbot.sessions import ChatSessionPool  # noqa: E402
+from chatbot.tokens import TokenLedger  # noqa: E402
+from fake_gemini import FakeBackendConfig, install  # noqa: E402
+
+APP_PATH = str(ROOT / "streamlit_app.py")
+
+STAGES = ["routing", "token estimation", "context building", "network wait",
+          "response parsing", "reply assembly", "rendering"]
+
+# (owner, attribute, stage) for every function timed by the harness
+TIMED_FUNCTIONS = [
+    (chatbot.routing, "route", "routing"),
+    (TokenLedger, "sync", "token estimation"),
+    (ContextManager, "update", "context building"),
+    (ContextManager, "view", "context building"),
+    (ChatSessionPool, "get", "context building"),
+    (ReplyParser, "feed", "response parsing"),
+    (Message, "from_reply", "reply assembly"),
+    (Message, "content", "reply assembly"),
+]
+
+SYNTHETIC_PROMPTS = {
+    "simple": ["halo!", "terima kasih", "hi, how are you", "ok", "selamat pagi"],
+    "medium": ["jelaskan apa itu REST API", "bagaimana cara membuat virtual environment?",
+               "kenapa kode saya error?", "apa itu list comprehension"],
+    "hard": ["jelaskan algoritma dynamic programming dan kompleksitas big-o nya?",
+             "buktikan teorema ini dengan induksi matematika", "fix this traceback from my sql query recursion",
+             "hitung integral dan turunan dari fungsi ini?"],
+}
+
+
+class Stopwatch:
+    """Wraps functions so the time spent in them is added to a stage.
+
+    AppTest runs the script in its own thread, so every thread is counted; the
+    only background work (context summaries) calls none of the timed functions.
+    """
+
+    def __init__(self):
+        self.totals = dict.fromkeys(STAGES, 0.0)
+        self._originals = []
+
+    def install(self):
+        for owner, name, stage in TIMED_FUNCTIONS:
+            original = owner.__dict__.get(name) if isinstance(owner, type) else None
+            if isinstance(original, property):
+                timed = property(self._wrap(original.fget, stage))
+            else:
+                original = getattr(owner, name)
+                timed = self._wrap(original, stage)
+            self._originals.append((owner, name, original))
+            setattr(owner, name, timed)
+
+    def uninstall(self):
+        for owner, name, original in reversed(self._originals):
+            setattr(owner, name, original)
+        self._originals = []
+
+    def _wrap(self, func, stage):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.totals[stage] += time.perf_counter() - started
+        return timed
+
+    def reset(self):
+        self.totals = dict.fromkeys(STAGES, 0.0)
+
+
+def synthetic_conversations(count: int, turns: int, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    conversations = []
+    for _ in range(count):
+        prompts = []
+        for _ in range(turns):
+            kind = rng.choices(["simple", "medium", "hard"], weights=[3, 4, 3])[0]
+            prompts.append(rng.choice(SYNTHETIC_PROMPTS[kind]))
+        conversations.append(prompts)
+    return conversations
+
+
+def load_replay(path: str) -> list:
+    conversations = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "prompts" in record:
+                conversations.append(list(record["prompts"]))
+            else:
+                conversations.append([m["content"] for m in record["messages"] if m["role"] == "user"])
+    return conversations
+
+
+def run_conversation(prompts: list, args, stopwatch: Stopwatch, backend_stats) -> list:
+    """Send every prompt through the app; returns one stage breakdown per turn."""
+    st.cache_resource.clear()  # Fresh client registry and response cache per conversation
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    at.run()
+    at.text_input[0].set_value("offline-benchmark-key").run()
+    toggles = {t.label: t for t in at.toggle}
+    toggles["Show Model Thinking Process"].set_value(args.thinking)
+    toggles["Stream Responses"].set_value(not args.no_stream)
+    toggles["Reuse Cached Answers"].set_value(False)
+    toggles["Verify Token Counts with API"].set_value(args.verify_tokens)
+    at.run()
+
+    turns = []
+    for prompt in prompts:
+        stopwatch.reset()
+        backend_stats.reset()
+        at.chat_input[0].set_value(prompt)
+        started = time.perf_counter()
+        at.run()
+        total = time.perf_counter() - started
+        if at.exception:
+            sys.exit(f"App raised: {at.exception}")
+
+        stages = dict(stopwatch.totals)
+        stages["network wait"] = backend_stats.wait_for("send_message", "send_message_stream", "stream_chunk")
+        stages["token estimation"] += backend_stats.wait_for("count_tokens")
+        stages["rendering"] = max(0.0, total - sum(stages.values()))
+        stages["total"] = total
+        stages["model"] = at.session_state.messages[-1].model
+        turns.append(stages)
+    return turns
+
+
+def summarize_turns(turns: list) -> dict:
+    summary = {}
+    for stage in STAGES + ["total"]:
+        values = [turn[stage] for turn in turns]
+        summary[stage] = {
+            "mean_ms": statistics.mean(values) * 1e3,
+            "p95_ms": sorted(values)[math.ceil(len(values) * 0.95) - 1] * 1e3,
+            "share": sum(values) / max(1e-9, sum(turn["total"] for turn in turns)),
+        }
+    return summary
+
+
+def print_report(name: str, turns: list, summary: dict):
+    models = {}
+    for turn in turns:
+        models[turn["model"]] = models.get(turn["model"], 0) + 1
+    print(f"\n== {name}: {len(turns)} turns ({', '.join(f'{m}: {n}' for m, n in sorted(models.items()))})")
+    print(f"{'stage':<18} | {'mean/turn':>10} | {'p95/turn':>10} | share")
+    print("-" * 52)
+    for stage in STAGES + ["total"]:
+        row = summary[stage]
+        print(f"{stage:<18} | {row['mean_ms']:>8.2f}ms | {row['p95_ms']:>8.2f}ms | {row['share']:>5.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--replay", help="JSONL file of conversations to replay")
+    parser.add_argument("--conversations", type=int, default=3, help="synthetic conversations to run")
+    parser.add_argument("--turns", type=int, default=8, help="turns per synthetic conversation")
+    parser.add_argument("--latency", type=float, default=0.3, help="fake first-token latency in seconds")
+    parser.add_argument("--chunk-latency", type=float, default=0.01, help="fake delay between streamed chunks")
+    parser.add_argument("--chunk-size", type=int, default=40, help="characters per streamed chunk")
+    parser.add_argument("--reply-chars", type=int, default=800, help="length of each fake reply")
+    parser.add_argument("--citations", type=int, default=3, help="grounding citations per reply")
+    parser.add_argument("--no-tools", action="store_true", help="omit executable code / execution result parts")
+    parser.add_argument("--count-tokens-latency", type=float, default=0.1, help="fake count_tokens latency")
+    parser.add_argument("--no-stream", action="store_true", help="use send_message instead of streaming")
+    parser.add_argument("--verify-tokens", action="store_true", help="turn on the count_tokens verification mode")
+    parser.add_argument("--thinking", action="store_true", help="render the model thinking display")
+    parser.add_argument("--json", help="also write the raw per-turn numbers to this file")
+    args = parser.parse_args()
+
+    backend_stats = install(FakeBackendConfig(
+        first_token_latency=args.latency,
+        chunk_latency=args.chunk_latency,
+        chunk_size=args.chunk_size,
+        reply_chars=args.reply_chars,
+        tool_parts=not args.no_tools,
+        citations=args.citations,
+        count_tokens_latency=args.count_tokens_latency,
+    ))
+
+    scenarios = {"synthetic": synthetic_conversations(args.conversations, args.turns)}
+    if args.replay:
+        scenarios["replay"] = load_replay(args.replay)
+
+    stopwatch = Stopwatch()
+    stopwatch.install()
+    results = {}
+    workdir = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)  # Keep the response cache file out of the repository
+            for name, conversations in scenarios.items():
+                turns = []
+                for prompts in conversations:
+                    turns.extend(run_conversation(prompts, args, stopwatch, backend_stats))
+                summary = summarize_turns(turns)
+                print_report(name, turns, summary)
+                results[name] = {"summary": summary, "turns": turns}
+            os.chdir(workdir)
+    finally:
+        stopwatch.uninstall()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
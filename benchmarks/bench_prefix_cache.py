@@ -0,0 +1,121 @@
+"""Input tokens and first-token latency of a long conversation, with and without context caching.
+
+Drives streamlit_app.py through Streamlit's AppTest against ``fake_gemini``, whose
+``client.caches`` stands in for Gemini's cached-content API: a chat referencing a
+cache skips prompt processing for the cached tokens (``--prefill-ms`` per 1k
+uncached input tokens is added to every first token). The same hard prompts are
+sent with "Cache Conversation Prefix" on and off, so the conversation goes to
+gemini-2.5-pro and grows past its minimum cacheable size.
+
+Usage:
+    python benchmarks/bench_prefix_cache.py
+    python benchmarks/bench_prefix_cache.py --turns 30 --reply-chars 4000 --prefill-ms 150
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import streamlit as st  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+from fake_gemini import FakeBackendConfig, install  # noqa: E402
+
+APP_PATH = str(ROOT / "streamlit_app.py")
+PROMPTS = [
+    "buktikan teorema ini dengan induksi matematika dan jelaskan kompleksitas algoritma nya?",
+    "jelaskan algoritma dynamic programming dan kompleksitas big-o nya?",
+    "hitung integral dan turunan dari fungsi ini, lalu buktikan hasilnya?",
+]
+
+
+def run(turns: int, caching: bool, think_time: float, backend_stats) -> list:
+    """One conversation; returns per-turn ``{"model", "prompt_tokens", "cached_tokens", "first_token"}``."""
+    st.cache_resource.clear()
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    at.run()
+    at.text_input[0].set_value("offline-benchmark-key").run()
+    toggles = {t.label: t for t in at.toggle}
+    toggles["Show Model Thinking Process"].set_value(False)
+    toggles["Reuse Cached Answers"].set_value(False)
+    toggles["Cache Conversation Prefix"].set_value(caching)
+    at.run()
+
+    rows = []
+    for turn in range(turns):
+        before = dict(backend_stats.tokens)
+        at.chat_input[0].set_value(PROMPTS[turn % len(PROMPTS)]).run()
+        if at.exception:
+            sys.exit(f"App raised: {at.exception}")
+        reply = at.session_state.messages[-1]
+        if reply.failed:
+            sys.exit(f"Turn {turn} failed: {reply.text}")
+        rows.append({
+            "model": reply.model,
+            "prompt_tokens": backend_stats.tokens.get("prompt", 0) - before.get("prompt", 0),
+            "cached_tokens": backend_stats.tokens.get("cached", 0) - before.get("cached", 0),
+            "first_token": reply.first_token_time,
+        })
+        # Cache uploads run in the background between turns, as they would while the user reads
+        time.sleep(think_time)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=20, help="turns in the conversation")
+    parser.add_argument("--reply-chars", type=int, default=3000, help="length of each fake reply")
+    parser.add_argument("--latency", type=float, default=0.1, help="fake first-token latency before prompt processing")
+    parser.add_argument("--prefill-ms", type=float, default=100.0, help="fake prompt processing per 1k uncached input tokens")
+    parser.add_argument("--think-time", type=float, default=0.5, help="pause between turns")
+    args = parser.parse_args()
+
+    backend_stats = install(FakeBackendConfig(
+        first_token_latency=args.latency,
+        prefill_per_1k_tokens=args.prefill_ms / 1000,
+        reply_chars=args.reply_chars,
+        chunk_latency=0.0,
+        count_tokens_latency=0.0,
+        citations=0,
+        tool_parts=False,
+    ))
+
+    results = {}
+    workdir = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)  # Keep the response cache and metrics files out of the repository
+        try:
+            for caching in (False, True):
+                results[caching] = run(args.turns, caching, args.think_time, backend_stats)
+        finally:
+            os.chdir(workdir)
+
+    print(f"{args.turns} turns, {args.reply_chars}-char replies, {args.prefill_ms:.0f}ms prompt processing per 1k tokens")
+    print(f"{'turn':>4} | {'model':<22} | {'input (off)':>11} | {'input (on)':>10} | {'cached':>6} | "
+          f"{'1st token off':>13} | {'1st token on':>12}")
+    print("-" * 98)
+    for turn, (off, on) in enumerate(zip(results[False], results[True]), start=1):
+        print(f"{turn:>4} | {on['model']:<22} | {off['prompt_tokens']:>11} | {on['prompt_tokens']:>10} | "
+              f"{on['cached_tokens']:>6} | {off['first_token']:>12.2f}s | {on['first_token']:>11.2f}s")
+
+    print()
+    for caching, rows in results.items():
+        prompt = sum(row["prompt_tokens"] for row in rows)
+        cached = sum(row["cached_tokens"] for row in rows)
+        first_tokens = [row["first_token"] for row in rows]
+        print(f"caching {'on ' if caching else 'off'}: {prompt} input tokens, {cached} ({cached / max(1, prompt):.0%}) "
+              f"from the cache, first token mean {statistics.mean(first_tokens):.2f}s / max {max(first_tokens):.2f}s")
+    creates = backend_stats.calls.get("caches.create", 0)
+    print(f"caches created: {creates}, deleted: {backend_stats.calls.get('caches.delete', 0)}, "
+          f"renewed: {backend_stats.calls.get('caches.update', 0)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Compare the single-pass routing engine with the original per-turn regex scoring.
+
+Usage: python benchmarks/bench_routing.py [--repeat N]
+"""
+import argparse
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from chatbot.routing import WEIGHT_HARD, WEIGHT_MEDIUM, WEIGHT_SMALL, route  # noqa: E402
+
+# The keyword regexes as they were before the routing engine (duplicates included)
+BASELINE_HARD_KEYWORDS = [
+    r"derivative", r"integral",  r"big-?o", r"complexity", r"algorithm", r"algoritma",r"mathematical",
+    r"dynamic programming", r"regex", r"sql",  r"stack trace", r"panic", r"traceback",  r"recursion", r"algorithm", r"theorem", r"bukti", r"turunan", r"integral", r"induksi",
+    r"np[-\s]?sulit", r"kompleksitas", r"pemrograman dinamis", r"jejak tumpukan", r"jejak kesalahan", r"jejak error", r"jejak",
+    r"algoritma", r"teorema", r"persamaan", r"matematika", r"logika", r"berpikir keras", r"pikir keras", r"buktikan", r"soal sulit",
+    r"tantangan", r"uji", r"uji coba", r"uji hipotesis", r"prima", r"prime"
+]
+BASELINE_MEDIUM_KEYWORDS = [
+    r"apa itu", r"jelaskan", r"analisa", r"penjelasan", r"mengapa", r"kenapa", r"sulit", r"tantangan", r"perbaiki", r"kesalahan",
+    r"masalah", r"solusi", r"langkah", r"cara", r"bagaimana", r"penyebab", r"penyelesaian"
+]
+BASELINE_HARD_PATTERN = re.compile("|".join(BASELINE_HARD_KEYWORDS), re.IGNORECASE)
+BASELINE_MEDIUM_PATTERN = re.compile("|".join(BASELINE_MEDIUM_KEYWORDS), re.IGNORECASE)
+
+SIZES = [100, 1_000, 10_000, 100_000, 1_000_000]
+
+FILLER_WORDS = (
+    "tolong bantu saya dengan tugas ini karena besok harus dikumpulkan please help me "
+    "understand the following code and data the server returns an empty list when"
+).split()
+KEYWORD_WORDS = ["algoritma", "jelaskan", "integral", "kenapa", "SQL", "uji coba", "soal sulit", "big-O", "np sulit"]
+# Checked against the baseline too: case-insensitive matching folds "İ" to "i" and "ſ" to "s",
+# which str.lower()/casefold() don't map back to the keyword
+EDGE_PROMPTS = [
+    "İntegral x dx", "İNTEGRAL dan ſql?", "ſql injection kenapa?", "KENAPA Big-O dari algoritma ini?",
+    "np-sulit, np sulit atau npsulit?", "uji coba dan uji hipotesis", "BUKTIKAN teorema ini", "",
+]
+
+
+def baseline_score(content: str) -> int:
+    """Complexity score exactly as the app computed it before the routing engine."""
+    return (1 + WEIGHT_HARD * len(BASELINE_HARD_PATTERN.findall(content))
+            + WEIGHT_MEDIUM * len(BASELINE_MEDIUM_PATTERN.findall(content))
+            + WEIGHT_SMALL * content.count('?'))
+
+
+def make_prompt(size: int, rng: random.Random) -> str:
+    """Synthetic prompt of ``size`` bytes with roughly one keyword per 20 words."""
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(KEYWORD_WORDS) if rng.random() < 0.05 else rng.choice(FILLER_WORDS)
+        if rng.random() < 0.02:
+            word += "?"
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:size]
+
+
+def best_time(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement (best is reported)")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    print(f"{'size':>10} | {'regex x1':>10} | {'regex x3/turn':>13} | {'engine x1':>10} | {'speedup/turn':>12} | score match")
+    print("-" * 80)
+    for size in SIZES:
+        prompt = make_prompt(size, rng)
+        regex_time = best_time(lambda: baseline_score(prompt), args.repeat)
+        engine_time = best_time(lambda: route(prompt, 0), args.repeat)
+        same = baseline_score(prompt) == route(prompt, 0).score
+        print(f"{size:>10,} | {regex_time * 1e3:>8.3f}ms | {3 * regex_time * 1e3:>11.3f}ms | "
+              f"{engine_time * 1e3:>8.3f}ms | {3 * regex_time / engine_time:>11.2f}x | {'yes' if same else 'NO'}")
+
+    mismatched = [prompt for prompt in EDGE_PROMPTS if baseline_score(prompt) != route(prompt, 0).score]
+    print(f"\nedge-case prompts: {len(EDGE_PROMPTS) - len(mismatched)}/{len(EDGE_PROMPTS)} scores match")
+    for prompt in mismatched:
+        print(f"  {prompt!r}: baseline {baseline_score(prompt)}, engine {route(prompt, 0).score}")
+    return 1 if mismatched else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+"""Server memory for many long-lived sessions, with and without the session memory budgets.
+
+Simulates ``--sessions`` browser tabs that each chat for ``--turns`` turns and
+are then left open, one after another, the way streamlit_app.py handles a turn:
+token ledger, rolling summaries (``ContextManager``), a pooled chat per tier and
+tool profile (``ChatSessionPool``) and ``Message`` records, against
+``fake_gemini``. Run once without a ``SessionMemoryManager`` (everything stays
+in memory forever) and once with one, where each turn ends with ``enforce`` and
+earlier tabs count as idle after ``--idle`` seconds. Memory is what
+``tracemalloc`` sees still allocated once all sessions have been created; the
+manager's own per-session estimate is printed next to it. Finally one released
+tab comes back for another turn, which has to read its recent history back
+from disk and rebuild its chat. No network access is needed.
+
+Usage:
+    python benchmarks/bench_session_memory.py
+    python benchmarks/bench_session_memory.py --sessions 200 --turns 40 --global-budget-mb 8
+"""
+import argparse
+import gc
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from google import genai  # noqa: E402
+
+from chatbot.context import ContextManager  # noqa: E402
+from chatbot.memory import HistoryStore, SessionMemoryManager  # noqa: E402
+from chatbot.messages import Message  # noqa: E402
+from chatbot.responses import ReplyParser  # noqa: E402
+from chatbot.routing import MODEL_LADDER, route  # noqa: E402
+from chatbot.sessions import MAX_CHAT_HISTORY, ChatSessionPool  # noqa: E402
+from chatbot.tokens import TokenLedger  # noqa: E402
+from fake_gemini import FakeBackendConfig, install  # noqa: E402
+
+HISTORY_WINDOW_MESSAGES = 20  # streamlit_app.py's visible window
+PROMPTS = [
+    "jelaskan bagaimana cara kerja hash map di python?",
+    "apa itu rekursi dan kapan sebaiknya dipakai?",
+    "bagaimana cara membaca file csv dengan pandas?",
+    "kenapa list comprehension lebih cepat dari loop biasa?",
+]
+
+
+class Session:
+    """One tab's state, as streamlit_app.py keeps it in ``st.session_state``."""
+
+    def __init__(self, index: int, manager: SessionMemoryManager = None):
+        self.messages = []
+        self.ledger = TokenLedger()
+        self.context_manager = ContextManager()
+        self.chat_pool = ChatSessionPool(max_turns=MAX_CHAT_HISTORY)
+        self.memory = manager.register(f"{index:08x}{index:024x}") if manager else None
+
+    def turn(self, client, prompt: str, manager: SessionMemoryManager = None):
+        if self.memory is not None:
+            self.memory.attach(self.messages, self.chat_pool)
+            self.memory.touch()
+        self.messages.append(Message("user", prompt))
+        self.ledger.sync(self.messages)
+        self.context_manager.update(client, self.messages, self.ledger)
+        decision = route(prompt, self.context_manager.view(MODEL_LADDER[0], self.ledger).tokens)
+        view = self.context_manager.view(decision.model, self.ledger)
+        chat, _ = self.chat_pool.get(client, decision.model, decision.config, self.messages[:-1], start=view.start,
+                                     summary=view.summary, tool_profile=decision.tool_profile)
+        parser = ReplyParser()
+        parser.feed(chat.send_message(prompt))
+        self.messages.append(Message.from_reply(parser, model=decision.model))
+        self.chat_pool.mark_synced(decision.model, len(self.messages), decision.tool_profile)
+        if manager is not None:
+            keep_from = max(0, len(self.messages) - HISTORY_WINDOW_MESSAGES)
+            for model_name in MODEL_LADDER:
+                keep_from = min(keep_from, self.context_manager.view(model_name, self.ledger).start)
+            manager.enforce(self.memory, keep_from)
+
+
+def run(args, client, manager: SessionMemoryManager = None) -> dict:
+    """Create every session; returns retained memory, turn times and the sessions."""
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    sessions, turn_times = [], []
+    for index in range(args.sessions):
+        session = Session(index, manager)
+        for turn in range(args.turns):
+            started = time.perf_counter()
+            session.turn(client, PROMPTS[(index + turn) % len(PROMPTS)], manager)
+            turn_times.append(time.perf_counter() - started)
+        sessions.append(session)
+        if manager is not None:
+            time.sleep(args.idle)  # Earlier tabs go idle while later ones chat
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return {"retained": retained, "turn_times": turn_times, "sessions": sessions}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=100, help="tabs opened one after another")
+    parser.add_argument("--turns", type=int, default=30, help="turns per tab before it goes idle")
+    parser.add_argument("--reply-chars", type=int, default=1500, help="length of each fake reply")
+    parser.add_argument("--session-budget-kb", type=float, default=256, help="per-session budget")
+    parser.add_argument("--global-budget-mb", type=float, default=16, help="budget for all sessions together")
+    parser.add_argument("--idle", type=float, default=0.01, help="seconds after which a tab counts as idle")
+    args = parser.parse_args()
+
+    install(FakeBackendConfig(
+        first_token_latency=0.0,
+        chunk_latency=0.0,
+        count_tokens_latency=0.0,
+        reply_chars=args.reply_chars,
+    ))
+    client = genai.Client(api_key="offline-benchmark-key")
+
+    workdir = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            unbounded = run(args, client)
+            del unbounded["sessions"]
+            store_path = os.path.join(tmp, "history.sqlite3")
+            manager = SessionMemoryManager(
+                store=HistoryStore(store_path),
+                session_budget=args.session_budget_kb * 1024,
+                global_budget=args.global_budget_mb * 2**20,
+                idle_seconds=args.idle,
+            )
+            bounded = run(args, client, manager)
+            stats = manager.stats(limit=5)
+
+            # A released tab comes back: recent history is read back and its chat rebuilt
+            returning = bounded["sessions"][0]
+            before = returning.memory.footprint()
+            started = time.perf_counter()
+            returning.turn(client, "terima kasih, bisa diringkas?", manager)
+            return_time = time.perf_counter() - started
+            after = returning.memory.footprint()
+            disk_bytes = sum(os.path.getsize(store_path + suffix) for suffix in ("", "-wal") if os.path.exists(store_path + suffix))
+        finally:
+            os.chdir(workdir)
+
+    print(f"{args.sessions} sessions x {args.turns} turns, {args.reply_chars}-char replies; budgets "
+          f"{args.session_budget_kb:.0f} KB per session, {args.global_budget_mb:.0f} MB in total")
+    print(f"{'memory manager':<15} | {'retained':>10} | {'per session':>11} | {'turn mean':>9} | {'turn p95':>8}")
+    print("-" * 66)
+    for name, result in (("off", unbounded), ("on", bounded)):
+        times = sorted(result["turn_times"])
+        print(f"{name:<15} | {result['retained'] / 2**20:>7.1f} MB | {result['retained'] / args.sessions / 1024:>8.0f} KB | "
+              f"{statistics.mean(times) * 1000:>7.2f}ms | {times[int(0.95 * (len(times) - 1))] * 1000:>6.2f}ms")
+    print()
+    print(f"manager estimate: {stats['total_bytes'] / 2**20:.1f} MB in {stats['sessions']} sessions; "
+          f"{stats['spilled_messages']} messages moved to disk ({disk_bytes / 2**20:.1f} MB on disk), "
+          f"{stats['released_sessions']} idle sessions released")
+    print("largest sessions:")
+    for row in stats["largest"]:
+        print(f"  {row}")
+    print(f"returning released session: turn took {return_time * 1000:.1f}ms; "
+          f"before {before['in_memory']} messages in memory / {before['live_chats']} chats, "
+          f"after {after['in_memory']} / {after['live_chats']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""Upstream calls and turn latency when many sessions send the same first prompt at once.
+
+Starts ``--sessions`` copies of streamlit_app.py with Streamlit's AppTest, each
+in its own thread, against ``fake_gemini`` (with "Verify Token Counts with API"
+on and the response cache off). They all send the same prompt within
+``--spread`` seconds of each other, like a class following a demo, once with
+"Share Identical Requests" off and once with it on. Reported per run: upstream
+``send_message_stream`` / ``count_tokens`` calls, turn times and the single-flight
+counters. ``--rpm`` lowers the routed tier's requests/min limit to show how
+shared requests also save queueing. It also checks that a hedge lane cancelled
+while reading a shared stream closes that stream's upstream (exit code 1 if
+not). No network access is needed.
+
+Usage:
+    python benchmarks/bench_singleflight.py
+    python benchmarks/bench_singleflight.py --sessions 30 --spread 2 --rpm 10
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import streamlit as st  # noqa: E402
+from google.genai import types  # noqa: E402
+from streamlit.runtime.scriptrunner import magic  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+import chatbot.scheduler  # noqa: E402
+from chatbot.hedging import HedgedRequest  # noqa: E402
+from chatbot.singleflight import SingleFlight  # noqa: E402
+from fake_gemini import FakeBackendConfig, install  # noqa: E402
+
+APP_PATH = str(ROOT / "streamlit_app.py")
+PROMPT = "halo, apa itu python dan bagaimana cara mulai belajar?"
+
+# Compiling the script from several AppTest threads at once trips a CPython
+# 3.11 AST race; one compile at a time is enough (the turns still overlap)
+_compile_lock = threading.Lock()
+_add_magic = magic.add_magic
+
+
+def _locked_add_magic(code: str, script_path: str):
+    with _compile_lock:
+        return _add_magic(code, script_path)
+
+
+magic.add_magic = _locked_add_magic
+
+
+def open_session(share: bool) -> AppTest:
+    at = AppTest.from_file(APP_PATH, default_timeout=300)
+    at.run()
+    at.text_input[0].set_value("offline-benchmark-key").run()
+    toggles = {t.label: t for t in at.toggle}
+    toggles["Show Model Thinking Process"].set_value(False)
+    toggles["Reuse Cached Answers"].set_value(False)
+    toggles["Verify Token Counts with API"].set_value(True)
+    toggles["Share Identical Requests"].set_value(share)
+    at.run()
+    return at
+
+
+def run(sessions: int, spread: float, share: bool, backend_stats, seed: int) -> dict:
+    """One burst of identical first prompts; returns timings, upstream calls and flight counters."""
+    st.cache_resource.clear()
+    apps = [open_session(share) for _ in range(sessions)]
+    backend_stats.reset()
+    delays = sorted(random.Random(seed).uniform(0, spread) for _ in range(sessions))
+    turn_times = [None] * sessions
+    errors = []
+    started = time.perf_counter()
+
+    def send(index: int):
+        time.sleep(max(0.0, started + delays[index] - time.perf_counter()))
+        sent = time.perf_counter()
+        at = apps[index].chat_input[0].set_value(PROMPT).run()
+        turn_times[index] = time.perf_counter() - sent
+        reply = at.session_state.messages[-1]
+        if at.exception or reply.failed:
+            errors.append(at.exception or reply.text)
+
+    threads = [threading.Thread(target=send, args=(i,)) for i in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        sys.exit(f"Turn failed: {errors[0]}")
+    calls = dict(backend_stats.calls)
+
+    # Every session's next turn must still see the shared exchange as context
+    follow_up = apps[-1].chat_input[0].set_value("terima kasih, jelaskan lagi singkat saja").run()
+    if follow_up.exception or follow_up.session_state.messages[-1].failed:
+        sys.exit(f"Follow-up turn failed: {follow_up.exception}")
+
+    # The sidebar's single-flight table (drawn before the follow-up was sent) has the burst's counters
+    flights = {}
+    for table in follow_up.sidebar.dataframe:
+        if "coalesced" in table.value.columns:
+            flights = {row["kind"]: (row["calls"], row["coalesced"]) for row in table.value.to_dict("records")}
+    return {"turn_times": turn_times, "calls": calls, "flights": flights}
+
+
+def hedge_loser_closed(chunks: int = 50, slow_delay: float = 0.2) -> bool:
+    """Race a fast and a slow lane through single-flight; True if the losing lane's upstream gets closed.
+
+    Without the close, the slow upstream would be read to the end (``chunks * slow_delay`` seconds).
+    """
+    flights = SingleFlight()
+    closed = {"fast": threading.Event(), "slow": threading.Event()}
+    chunk = types.GenerateContentResponse(candidates=[types.Candidate(content=types.Content(
+        role="model", parts=[types.Part(text="halo ")]))])
+
+    def upstream(model: str):
+        try:
+            for _ in range(chunks):
+                time.sleep(slow_delay if model == "slow" else 0.01)
+                yield chunk
+        finally:
+            closed[model].set()
+
+    def send(model, chat, prompt, stream):
+        return flights.stream("generate", model, lambda: upstream(model))[0]
+
+    hedged = HedgedRequest(PROMPT, send=send)
+    hedged.launch("slow", None)
+    hedged.launch("fast", None)
+    winner = hedged.wait_for_first_token(timeout=5)
+    hedged.cancel_losers(winner)
+    for _ in hedged.chunks(winner):
+        pass
+    return winner == "fast" and closed["slow"].wait(timeout=5 * slow_delay)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=20, help="sessions sending the same prompt")
+    parser.add_argument("--spread", type=float, default=1.0, help="seconds over which the prompts arrive")
+    parser.add_argument("--latency", type=float, default=1.0, help="fake first-token latency")
+    parser.add_argument("--count-latency", type=float, default=0.3, help="fake count_tokens latency")
+    parser.add_argument("--rpm", type=int, help="requests/min limit for every tier (default: MODEL_RATE_LIMITS)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.rpm:
+        for model, (_, tokens_per_minute) in list(chatbot.scheduler.MODEL_RATE_LIMITS.items()):
+            chatbot.scheduler.MODEL_RATE_LIMITS[model] = (args.rpm, tokens_per_minute)
+    backend_stats = install(FakeBackendConfig(
+        first_token_latency=args.latency,
+        count_tokens_latency=args.count_latency,
+        chunk_latency=0.01,
+    ))
+
+    results = {}
+    workdir = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)  # Keep the response cache and metrics files out of the repository
+        try:
+            for share in (False, True):
+                results[share] = run(args.sessions, args.spread, share, backend_stats, args.seed)
+        finally:
+            os.chdir(workdir)
+
+    print(f"{args.sessions} sessions, same prompt within {args.spread:.1f}s, {args.latency:.1f}s first token"
+          + (f", {args.rpm} requests/min per tier" if args.rpm else ""))
+    print(f"{'sharing':<7} | {'generate calls':>14} | {'count_tokens':>12} | {'turn mean':>9} | {'turn p95':>8} | "
+          f"{'turn max':>8} | coalesced (generate / count_tokens)")
+    print("-" * 110)
+    for share, result in results.items():
+        times = sorted(result["turn_times"])
+        calls = result["calls"]
+        flights = result["flights"]
+        coalesced = " / ".join(f"{flights.get(kind, (0, 0))[1]} of {flights.get(kind, (0, 0))[0]}"
+                               for kind in ("generate", "count_tokens")) if flights else "-"
+        print(f"{'on' if share else 'off':<7} | {calls.get('send_message_stream', 0):>14} | {calls.get('count_tokens', 0):>12} | "
+              f"{statistics.mean(times):>8.2f}s | {times[int(0.95 * (len(times) - 1))]:>7.2f}s | {times[-1]:>7.2f}s | {coalesced}")
+
+    closed = hedge_loser_closed()
+    print(f"\ncancelled hedge lane closes its shared upstream: {'yes' if closed else 'NO'}")
+    return 0 if closed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""Latency, tokens and accuracy of predictive tool attachment on a labelled prompt set.
+
+Every prompt in ``benchmarks/tool_prompts.jsonl`` (``{"prompt": ..., "tools":
+["search", "code"]}`` with the tools a good answer needs) is routed twice with
+``chatbot.routing.route``: once with every tool attached (prediction off) and
+once with the predicted tool profile. Each decision's config is then sent to
+``fake_gemini``, where an attached tool costs ``--search-latency`` /
+``--code-latency`` before the first token and ``--tool-tokens`` input tokens,
+whether or not the prompt needed it. The stand-in can't tell how often a real
+model skips a tool it was given, so treat the latency numbers as an upper bound
+and measure your own with the real API. Missed tools (a needed tool that wasn't
+attached) are the quality cost and are listed per prompt. No network access is
+needed.
+
+Usage:
+    python benchmarks/bench_tool_prediction.py
+    python benchmarks/bench_tool_prediction.py --search-latency 1.5 --code-latency 0.8 --show-misses
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from google import genai  # noqa: E402
+
+from chatbot.routing import TOOL_PROFILES, route  # noqa: E402
+from fake_gemini import FakeBackendConfig, install  # noqa: E402
+
+PROMPTS_PATH = Path(__file__).resolve().parent / "tool_prompts.jsonl"
+
+
+def load_prompts(path: str) -> list:
+    """``[(prompt, needed tools frozenset)]`` from a labelled JSONL file."""
+    with open(path, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return [(row["prompt"], frozenset(row["tools"])) for row in rows]
+
+
+def label(tools) -> str:
+    """The tool profile name for a set of tools."""
+    return next(name for name, profile in TOOL_PROFILES.items() if set(profile) == set(tools))
+
+
+def run_turn(client, prompt: str, predict_tools: bool, stats) -> dict:
+    """Route and stream one prompt on a fresh chat; returns its profile, timings and input tokens."""
+    decision = route(prompt, 0, predict_tools)
+    chat = client.chats.create(model=decision.model, config=decision.config)
+    started = time.perf_counter()
+    first_token = None
+    usage = None
+    for chunk in chat.send_message_stream(prompt):
+        if first_token is None:
+            first_token = time.perf_counter() - started
+        usage = chunk.usage_metadata or usage
+    return {
+        "profile": decision.tool_profile,
+        "first_token": first_token,
+        "total": time.perf_counter() - started,
+        "prompt_tokens": usage.prompt_token_count if usage else 0,
+    }
+
+
+def best_time(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--prompts", default=str(PROMPTS_PATH), help="labelled JSONL prompt set")
+    parser.add_argument("--latency", type=float, default=0.3, help="fake first-token latency without tools")
+    parser.add_argument("--search-latency", type=float, default=0.8, help="extra first-token seconds with Google Search attached")
+    parser.add_argument("--code-latency", type=float, default=0.5, help="extra first-token seconds with code execution attached")
+    parser.add_argument("--tool-tokens", type=int, default=300, help="extra input tokens per attached tool")
+    parser.add_argument("--workers", type=int, default=8, help="prompts sent at once")
+    parser.add_argument("--show-misses", action="store_true", help="list every prompt whose prediction differs from its label")
+    args = parser.parse_args()
+
+    stats = install(FakeBackendConfig(
+        first_token_latency=args.latency,
+        search_latency=args.search_latency,
+        code_execution_latency=args.code_latency,
+        tool_prompt_tokens=args.tool_tokens,
+        reply_chars=400,
+        chunk_latency=0.005,
+        count_tokens_latency=0.0,
+    ))
+    client = genai.Client(api_key="offline-benchmark-key")
+    prompts = load_prompts(args.prompts)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for predict_tools in (False, True):
+            results[predict_tools] = list(executor.map(
+                lambda item: run_turn(client, item[0], predict_tools, stats), prompts
+            ))
+
+    print(f"{len(prompts)} labelled prompts, {args.latency:.1f}s base first token, +{args.search_latency:.1f}s search, "
+          f"+{args.code_latency:.1f}s code execution, +{args.tool_tokens} tokens per tool")
+    print(f"{'needs':<8} | {'prompts':>7} | {'1st token all':>13} | {'1st token pred':>14} | {'tokens all':>10} | "
+          f"{'tokens pred':>11} | {'exact':>5} | {'missed':>6}")
+    print("-" * 98)
+    groups = {}
+    for i, (_, needed) in enumerate(prompts):
+        groups.setdefault(label(needed), []).append(i)
+    for name in TOOL_PROFILES:
+        indices = groups.get(name, [])
+        if not indices:
+            continue
+        all_tools = [results[False][i] for i in indices]
+        predicted = [results[True][i] for i in indices]
+        exact = sum(row["profile"] == name for row in predicted)
+        missed = sum(not prompts[i][1] <= set(TOOL_PROFILES[results[True][i]["profile"]]) for i in indices)
+        print(f"{name:<8} | {len(indices):>7} | {statistics.mean(r['first_token'] for r in all_tools):>12.2f}s | "
+              f"{statistics.mean(r['first_token'] for r in predicted):>13.2f}s | "
+              f"{sum(r['prompt_tokens'] for r in all_tools):>10} | {sum(r['prompt_tokens'] for r in predicted):>11} | "
+              f"{exact:>5} | {missed:>6}")
+
+    print()
+    for predict_tools, rows in results.items():
+        first_tokens = sorted(row["first_token"] for row in rows)
+        print(f"prediction {'on ' if predict_tools else 'off'}: first token mean {statistics.mean(first_tokens):.2f}s / "
+              f"p95 {first_tokens[int(0.95 * (len(first_tokens) - 1))]:.2f}s, "
+              f"total mean {statistics.mean(row['total'] for row in rows):.2f}s, "
+              f"{sum(row['prompt_tokens'] for row in rows)} input tokens")
+    misses = [(prompt, needed, results[True][i]["profile"]) for i, (prompt, needed) in enumerate(prompts)
+              if label(needed) != results[True][i]["profile"]]
+    missing = sum(not needed <= set(TOOL_PROFILES[profile]) for _, needed, profile in misses)
+    print(f"predicted profile matches the label for {len(prompts) - len(misses)}/{len(prompts)} prompts; "
+          f"{missing} miss a needed tool, {len(misses) - missing} get an extra one")
+
+    sample = [prompt for prompt, _ in prompts]
+    routing_off = best_time(lambda: [route(prompt, 0, False) for prompt in sample], 20) / len(sample)
+    routing_on = best_time(lambda: [route(prompt, 0, True) for prompt in sample], 20) / len(sample)
+    print(f"routing per prompt: {routing_off * 1e6:.0f}µs without prediction, {routing_on * 1e6:.0f}µs with it")
+
+    if args.show_misses:
+        print()
+        for prompt, needed, profile in misses:
+            print(f"  label {label(needed):<6} predicted {profile:<6} {prompt.splitlines()[0][:70]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""A local stand-in for ``google.genai.Client`` used by the offline benchmarks.
+
+It answers chats, streams, ``count_tokens`` and ``generate_content`` with real
+``google.genai.types`` objects after configurable delays, so the app's parsing
+code runs exactly as it would against the API. It also keeps cached contents
+(``client.caches``): chats that reference one skip its tokens' prompt processing
+and report them as cached in their usage metadata. Replies only carry executed
+code when the chat has the code execution tool, and citations when it has
+Google Search; each attached tool can add latency and input tokens.
+``install()`` swaps it in for ``genai.Client``.
+"""
+import itertools
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+
+from google import genai
+from google.genai import types
+
+REPLY_TEXT = (
+    "Berikut penjelasannya. Fungsi di bawah menghitung bilangan Fibonacci secara iteratif, "
+    "sehingga kompleksitas waktunya O(n) dan memorinya O(1) [1]. "
+)
+REPLY_CODE = "def fib(n):\n    a, b = 0, 1\n    for _ in range(n):\n        a, b = b, a + b\n    return a\n\nprint(fib(10))"
+
+
+@dataclass
+class FakeBackendConfig:
+    """Knobs for the fake backend's latency and response shape."""
+    first_token_latency: float = 0.3    # Seconds before the first chunk / full response
+    model_latency: dict = field(default_factory=dict)  # Per-model first_token_latency overrides
+    chunk_latency: float = 0.02         # Seconds between streamed chunks
+    chunk_size: int = 40                # Characters of text per streamed chunk
+    reply_chars: int = 800              # Length of the text part of each reply
+    tool_parts: bool = True             # Add executable_code / code_execution_result parts
+    citations: int = 3                  # Grounding chunks (web URIs) per reply
+    count_tokens_latency: float = 0.1   # Seconds per count_tokens call
+    count_tokens_fails: bool = False    # Make count_tokens raise
+    error_rate: float = 0.0             # Share of generation calls that raise
+    prefill_per_1k_tokens: float = 0.0  # Extra first-token seconds per 1k uncached input tokens
+    cache_create_latency: float = 0.2   # Seconds per caches.create call
+    cache_min_tokens: int = 0           # caches.create rejects smaller contents, like the API
+    search_latency: float = 0.0         # Extra first-token seconds when Google Search is attached
+    code_execution_latency: float = 0.0 # Extra first-token seconds when code execution is attached
+    tool_prompt_tokens: int = 0         # Extra input tokens per attached tool (declarations, search results)
+    seed: int = 0
+
+
+@dataclass
+class FakeBackendStats:
+    """Seconds the fake spent "on the network" and calls made, per call kind (thread-safe).
+
+    Kinds: ``send_message``, ``send_message_stream`` (wait for the first chunk),
+    ``stream_chunk``, ``count_tokens``, ``generate_content`` and ``caches.create``
+    / ``caches.update`` / ``caches.delete``. ``tokens`` adds up the input tokens
+    of generation calls: ``prompt`` and the ``cached`` part of them.
+    """
+    waits: dict = field(default_factory=dict)
+    calls: dict = field(default_factory=dict)
+    tokens: dict = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, kind: str, waited: float):
+        with self._lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+            self.waits[kind] = self.waits.get(kind, 0.0) + waited
+
+    def record_tokens(self, prompt: int, cached: int):
+        with self._lock:
+            self.tokens["prompt"] = self.tokens.get("prompt", 0) + prompt
+            self.tokens["cached"] = self.tokens.get("cached", 0) + cached
+
+    def wait_for(self, *kinds) -> float:
+        with self._lock:
+            return sum(self.waits.get(kind, 0.0) for kind in kinds)
+
+    def reset(self):
+        with self._lock:
+            self.waits = {}
+            self.calls = {}
+            self.tokens = {}
+
+
+class _Backend:
+    def __init__(self, config: FakeBackendConfig, stats: FakeBackendStats):
+        self.config = config
+        self.stats = stats
+        self._rng = random.Random(config.seed)
+        self._rng_lock = threading.Lock()
+        self.caches = {}  # name -> {"model", "tokens", "tools", "expires"}
+        self._cache_ids = itertools.count(1)
+        self._cache_lock = threading.Lock()
+
+    def wait(self, kind: str, seconds: float):
+        time.sleep(seconds)
+        self.stats.record(kind, seconds)
+
+    def first_token_latency(self, model: str) -> float:
+        return self.config.model_latency.get(model, self.config.first_token_latency)
+
+    def prompt_usage(self, model: str, config, contents: list) -> tuple:
+        """``(prompt_tokens, cached_tokens)`` for a request, checking its cached content like the API."""
+        tokens = count_tokens(contents)
+        name = getattr(config, "cached_content", None)
+        if not name:
+            return tokens + count_tokens([getattr(config, "system_instruction", None)]), 0
+        if config.system_instruction or config.tools or config.tool_config:
+            raise RuntimeError("400 INVALID_ARGUMENT: CachedContent can not be used with GenerateContent request "
+                               "setting system_instruction, tools or tool_config (fake backend)")
+        with self._cache_lock:
+            cache = self.caches.get(name)
+        if cache is None or cache["expires"] <= time.monotonic() or cache["model"] != model:
+            raise RuntimeError(f"404 NOT_FOUND: CachedContent not found: {name} (fake backend)")
+        return tokens + cache["tokens"], cache["tokens"]
+
+    def attached_tools(self, config) -> set:
+        """Which of ``"code"`` / ``"search"`` a request's tools (or its cached content's) enable."""
+        tools = getattr(config, "tools", None)
+        name = getattr(config, "cached_content", None)
+        if name:
+            with self._cache_lock:
+                tools = self.caches.get(name, {}).get("tools")
+        attached = set()
+        for tool in tools or ():
+            if tool.code_execution is not None:
+                attached.add("code")
+            if tool.google_search is not None:
+                attached.add("search")
+        return attached
+
+    def prefill(self, model: str, config, contents: list) -> tuple:
+        """``(first_token_latency, usage_metadata)``: the base latency plus processing the uncached input and tools."""
+        prompt_tokens, cached_tokens = self.prompt_usage(model, config, contents)
+        tools = self.attached_tools(config)
+        prompt_tokens += self.config.tool_prompt_tokens * len(tools)
+        self.stats.record_tokens(prompt_tokens, cached_tokens)
+        usage = types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=prompt_tokens,
+            cached_content_token_count=cached_tokens or None,
+        )
+        latency = self.first_token_latency(model) + self.config.prefill_per_1k_tokens * (prompt_tokens - cached_tokens) / 1000
+        if "search" in tools:
+            latency += self.config.search_latency
+        if "code" in tools:
+            latency += self.config.code_execution_latency
+        return latency, usage
+
+    def maybe_fail(self):
+        with self._rng_lock:
+            failed = self._rng.random() < self.config.error_rate
+        if failed:
+            raise RuntimeError("503 UNAVAILABLE: The model is overloaded (fake backend)")
+
+    def reply_text(self, model: str) -> str:
+        text = f"[{model}] " + REPLY_TEXT * (self.config.reply_chars // len(REPLY_TEXT) + 1)
+        return text[:self.config.reply_chars]
+
+    def tool_parts(self) -> list:
+        if not self.config.tool_parts:
+            return []
+        return [
+            types.Part(executable_code=types.ExecutableCode(code=REPLY_CODE, language="PYTHON")),
+            types.Part(code_execution_result=types.CodeExecutionResult(outcome="OUTCOME_OK", output="55\n")),
+        ]
+
+    def grounding(self):
+        if not self.config.citations:
+            return None
+        return types.GroundingMetadata(
+            grounding_chunks=[
+                types.GroundingChunk(web=types.GroundingChunkWeb(uri=f"https://example.com/source-{i}", title=f"Source {i}"))
+                for i in range(self.config.citations)
+            ],
+            grounding_supports=[types.GroundingSupport(grounding_chunk_indices=[0])],
+        )
+
+    def response(self, parts: list, finish_reason=None, grounding=None, usage=None) -> types.GenerateContentResponse:
+        return types.GenerateContentResponse(candidates=[types.Candidate(
+            content=types.Content(role="model", parts=parts),
+            finish_reason=finish_reason,
+            grounding_metadata=grounding,
+        )], usage_metadata=usage)
+
+
+def count_tokens(contents: list) -> int:
+    """Rough token count (4 characters each) of strings and ``Content`` objects."""
+    chars = 0
+    for content in contents:
+        if isinstance(content, types.Content):
+            chars += sum(len(part.text or "") for part in content.parts or ())
+        elif content:
+            chars += len(str(content))
+    return chars // 4
+
+
+class FakeChat:
+    """Mimics ``google.genai.chats.Chat``: keeps history, sends or streams replies."""
+
+    def __init__(self, backend: _Backend, model: str, config=None, history=None):
+        self._backend = backend
+        self.model = model
+        self.config = config
+        self._history = list(history or [])
+
+    def get_history(self, curated: bool = False) -> list:
+        return list(self._history)
+
+    def _record(self, message, reply_parts: list):
+        self._history.append(types.Content(role="user", parts=[types.Part(text=str(message))]))
+        self._history.append(types.Content(role="model", parts=reply_parts))
+
+    def _prefill(self, message) -> tuple:
+        return self._backend.prefill(self.model, self.config, self._history + [str(message)])
+
+    def _tool_output(self) -> tuple:
+        # Executed code needs the code execution tool, citations need Google Search
+        backend = self._backend
+        tools = backend.attached_tools(self.config)
+        return (backend.tool_parts() if "code" in tools else [],
+                backend.grounding() if "search" in tools else None)
+
+    def send_message(self, message, config=None) -> types.GenerateContentResponse:
+        backend = self._backend
+        latency, usage = self._prefill(message)
+        backend.wait("send_message", latency)
+        backend.maybe_fail()
+        tool_parts, grounding = self._tool_output()
+        parts = [types.Part(text=backend.reply_text(self.model))] + tool_parts
+        self._record(message, parts)
+        return backend.response(parts, types.FinishReason.STOP, grounding, usage)
+
+    def send_message_stream(self, message, config=None):
+        backend = self._backend
+        latency, usage = self._prefill(message)
+        backend.wait("send_message_stream", latency)
+        backend.maybe_fail()
+        tool_parts, grounding = self._tool_output()
+        text = backend.reply_text(self.model)
+        size = max(1, backend.config.chunk_size)
+        for i in range(0, len(text), size):
+            if i:
+                backend.wait("stream_chunk", backend.config.chunk_latency)
+            yield backend.response([types.Part(text=text[i:i + size])])
+        for part in tool_parts:
+            backend.wait("stream_chunk", backend.config.chunk_latency)
+            yield backend.response([part])
+        self._record(message, [types.Part(text=text)] + tool_parts)
+        yield backend.response([], types.FinishReason.STOP, grounding, usage)
+
+
+class FakeClient:
+    """Drop-in for ``genai.Client`` backed by a shared fake backend."""
+
+    backend = None  # Set by install()
+
+    def __init__(self, api_key: str = None, http_options=None, **kwargs):
+        self.api_key = api_key
+        backend = FakeClient.backend
+        self.chats = _FakeChats(backend)
+        self.models = _FakeModels(backend)
+        self.caches = _FakeCaches(backend)
+
+    def close(self):
+        pass
+
+
+class _FakeChats:
+    def __init__(self, backend: _Backend):
+        self._backend = backend
+
+    def create(self, *, model: str, config=None, history=None) -> FakeChat:
+        return FakeChat(self._backend, model, config, history)
+
+
+class _FakeModels:
+    def __init__(self, backend: _Backend):
+        self._backend = backend
+
+    def count_tokens(self, *, model: str, contents, config=None) -> types.CountTokensResponse:
+        backend = self._backend
+        backend.wait("count_tokens", backend.config.count_tokens_latency)
+        if backend.config.count_tokens_fails:
+            raise RuntimeError("count_tokens failed (fake backend)")
+        return types.CountTokensResponse(total_tokens=max(1, len(str(contents)) // 4))
+
+    def generate_content(self, *, model: str, contents, config=None) -> types.GenerateContentResponse:
+        backend = self._backend
+        backend.wait("generate_content", backend.config.first_token_latency)
+        backend.maybe_fail()
+        summary = "Ringkasan: pengguna bertanya tentang algoritma, kode Python dan kompleksitas."
+        return backend.response([types.Part(text=summary)], types.FinishReason.STOP)
+
+
+class _FakeCaches:
+    """Mimics ``client.caches``: cached contents with a TTL, shared by every fake client."""
+
+    def __init__(self, backend: _Backend):
+        self._backend = backend
+
+    @staticmethod
+    def _ttl(config) -> float:
+        match = re.fullmatch(r"([\d.]+)s", getattr(config, "ttl", None) or "3600s")
+        return float(match.group(1))
+
+    def create(self, *, model: str, config=None) -> types.CachedContent:
+        backend = self._backend
+        backend.wait("caches.create", backend.config.cache_create_latency)
+        tokens = count_tokens(list(config.contents or []) + [config.system_instruction])
+        if tokens < backend.config.cache_min_tokens:
+            raise RuntimeError(f"400 INVALID_ARGUMENT: Cached content is too small: {tokens} tokens, "
+                               f"minimum is {backend.config.cache_min_tokens} (fake backend)")
+        name = f"cachedContents/fake-{next(backend._cache_ids)}"
+        with backend._cache_lock:
+            backend.caches[name] = {"model": model, "tokens": tokens, "tools": config.tools,
+                                    "expires": time.monotonic() + self._ttl(config)}
+        return types.CachedContent(name=name, model=f"models/{model}",
+                                   usage_metadata=types.CachedContentUsageMetadata(total_token_count=tokens))
+
+    def update(self, *, name: str, config=None) -> types.CachedContent:
+        backend = self._backend
+        backend.wait("caches.update", 0.0)
+        with backend._cache_lock:
+            cache = backend.caches.get(name)
+            if cache is None or cache["expires"] <= time.monotonic():
+                raise RuntimeError(f"404 NOT_FOUND: CachedContent not found: {name} (fake backend)")
+            cache["expires"] = time.monotonic() + self._ttl(config)
+        return types.CachedContent(name=name, model=f"models/{cache['model']}")
+
+    def delete(self, *, name: str, config=None):
+        backend = self._backend
+        backend.wait("caches.delete", 0.0)
+        with backend._cache_lock:
+            if backend.caches.pop(name, None) is None:
+                raise RuntimeError(f"404 NOT_FOUND: CachedContent not found: {name} (fake backend)")
+
+
+def install(config: FakeBackendConfig = None) -> FakeBackendStats:
+    """Replace ``genai.Client`` with the fake for this process; returns its stats."""
+    stats = FakeBackendStats()
+    FakeClient.backend = _Backend(config or FakeBackendConfig(), stats)
+    genai.Client = FakeClient
+    return stats
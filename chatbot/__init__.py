@@ -0,0 +1,5 @@
+"""Helpers shared by the Streamlit app that don't depend on the UI.
+
+Everything in this package can be imported without running Streamlit, so the
+same logic can be reused outside of ``streamlit_app.py``.
+"""
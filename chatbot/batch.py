@@ -0,0 +1,299 @@
+"""Headless batch runner: send JSONL conversations through the app's routing and parsing.
+
+Usage:
+    python -m chatbot.batch conversations.jsonl -o results.jsonl
+    python -m chatbot.batch conversations.jsonl -o results.jsonl --concurrency 8 --tier-concurrency gemini-2.5-pro=2
+
+Each input line is one conversation, either ``{"id": ..., "prompts": [...]}`` or
+``{"id": ..., "messages": [{"role": ..., "content": ...}, ...]}``. Every user
+message without an assistant reply right after it is answered in order; given
+replies are kept as history. One result line per answered turn is appended to
+the output, with its routing decision and timings. ``reply`` is the markdown the
+app would show; the answer text, executed code, its output and citations are
+also given as separate fields.
+
+Finished turns are also appended to a checkpoint file (``<output>.checkpoint`` by
+default). Rerunning the same command after a crash drops any output lines the
+checkpoint doesn't confirm, skips the finished turns and carries on from there.
+
+Turns are routed with ``chatbot.routing.route`` on the same compacted context
+as the app (rolling summary plus recent turns, see ``chatbot.context``), and
+each tier gets the same summarized context. The app writes summaries in the
+background; here each one is waited for, so results don't depend on timing.
+``full_token_count`` records the uncompacted conversation's estimate. Long conversations
+keep their older turns in Gemini's context cache like the app does (turn it off
+with ``--no-context-cache``), and each turn only gets the tools its prompt
+looks like it needs (``--all-tools`` attaches search and code execution to
+every turn). Turns are scored with the same routing profile as the app
+(``routing_profile.json`` if present, or ``--routing-profile``). The API key
+comes from ``--api-key`` or the ``GOOGLE_API_KEY`` environment variable.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from chatbot.clients import ClientRegistry
+from chatbot.context import ContextManager
+from chatbot.messages import Message
+from chatbot.prefix_cache import PrefixCache
+from chatbot.responses import ReplyParser
+from chatbot.routing import MODEL_LADDER, ROUTING_PROFILE_PATH, RoutingProfile, load_routing_profile, route
+from chatbot.scheduler import RequestScheduler
+from chatbot.sessions import MAX_CHAT_HISTORY, ChatSessionPool
+from chatbot.tokens import TokenLedger
+
+DEFAULT_TIER_CONCURRENCY = 4   # In-flight requests per model tier
+PROGRESS_EVERY = 10            # Conversations between progress lines on stderr
+
+
+def load_conversations(path: str) -> list:
+    """``[(conversation_id, [Message])]`` from a JSONL file (ids default to the line number)."""
+    conversations = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "prompts" in record:
+                messages = [Message("user", prompt) for prompt in record["prompts"]]
+            else:
+                messages = [Message(m["role"], m["content"]) for m in record["messages"]]
+            conversations.append((str(record.get("id", line_number)), messages))
+    return conversations
+
+
+def _open_for_append(path: str):
+    """Open a JSONL file for appending, finishing a line torn by a crash first."""
+    f = open(path, "a+", encoding="utf-8")
+    if f.tell():
+        f.seek(f.tell() - 1)
+        if f.read(1) != "\n":
+            f.write("\n")
+    return f
+
+
+def _read_jsonl(path: str) -> list:
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue  # Torn line from an interrupted write
+    return records
+
+
+class Checkpoint:
+    """Append-only record of finished turns, used to resume an interrupted run."""
+
+    def __init__(self, path: str):
+        self.path = path
+        # (conversation id, turn) -> the reply's parts (``Message.parts_json``), which later turns need as history
+        self.done = {(r["id"], r["turn"]): r["reply"] for r in _read_jsonl(path)}
+        self._file = _open_for_append(path)
+
+    def record(self, conversation_id: str, turn: int, reply: str):
+        self._file.write(json.dumps({"id": conversation_id, "turn": turn, "reply": reply}) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def prune_output(self, output_path: str):
+        """Keep only output lines for checkpointed turns (once each), dropping half-finished ones."""
+        if not os.path.exists(output_path):
+            return
+        kept, seen = [], set()
+        for record in _read_jsonl(output_path):
+            key = (record.get("id"), record.get("turn"))
+            if key in self.done and key not in seen:
+                seen.add(key)
+                kept.append(json.dumps(record) + "\n")
+        tmp_path = output_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(kept)
+        os.replace(tmp_path, output_path)
+
+    def close(self):
+        self._file.close()
+
+
+class BatchRunner:
+    """Runs conversations concurrently, bounding in-flight requests per model tier.
+
+    Turns within a conversation run in order (each one's reply is history for the
+    next); conversations share a thread pool, and each request first takes a slot
+    from its tier's semaphore, then waits for the tier's rate limits in
+    ``scheduler`` (which also retries 429 / 503 errors).
+    """
+
+    def __init__(self, genai_client, output_path: str, checkpoint: Checkpoint, tier_concurrency: dict,
+                 scheduler: RequestScheduler = None, context_cache: bool = True, predict_tools: bool = True,
+                 routing_profile: RoutingProfile = None):
+        self.genai_client = genai_client
+        self.checkpoint = checkpoint
+        self.context_cache = context_cache
+        self.predict_tools = predict_tools
+        self.routing_profile = routing_profile
+        self.scheduler = scheduler or RequestScheduler()
+        self._slots = {
+            model: threading.BoundedSemaphore(tier_concurrency.get(model, DEFAULT_TIER_CONCURRENCY))
+            for model in MODEL_LADDER
+        }
+        self._output = _open_for_append(output_path)
+        self._write_lock = threading.Lock()
+
+    def close(self):
+        self._output.close()
+
+    def _write(self, result: dict, reply: Message = None):
+        # Output first, then the checkpoint: a crash in between only loses the
+        # unconfirmed output line, which is pruned and re-run on resume
+        with self._write_lock:
+            self._output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            self._output.flush()
+            if reply is not None:
+                self.checkpoint.record(result["id"], result["turn"], reply.parts_json())
+
+    def run_conversation(self, conversation_id: str, messages: list) -> tuple:
+        """Answer every open user turn of one conversation; returns ``(answered, failed)``."""
+        pool = ChatSessionPool(max_turns=MAX_CHAT_HISTORY, prefix_cache=PrefixCache() if self.context_cache else None)
+        ledger = TokenLedger()
+        context_manager = ContextManager()
+        history = []
+        answered = 0
+        try:
+            for turn, msg in enumerate(messages):
+                history.append(msg)
+                has_reply = turn + 1 < len(messages) and messages[turn + 1].role == "assistant"
+                if msg.role != "user" or has_reply:
+                    continue
+                stored = self.checkpoint.done.get((conversation_id, turn))
+                if stored is not None:
+                    reply = Message.from_parts_json(stored)
+                else:
+                    reply = self._answer(conversation_id, turn, history, pool, ledger, context_manager)
+                    if reply is None:
+                        return answered, 1  # Later turns depend on this one, so stop here
+                    answered += 1
+                history.append(reply)
+            return answered, 0
+        finally:
+            if pool.prefix_cache is not None:
+                pool.prefix_cache.clear(self.genai_client)
+
+    def _answer(self, conversation_id: str, turn: int, history: list, pool: ChatSessionPool, ledger: TokenLedger,
+                context_manager: ContextManager):
+        """Route, send and parse one turn exactly like the app; returns the reply message or ``None``."""
+        prompt = history[-1].text
+        result = {"id": conversation_id, "turn": turn, "prompt": prompt}
+        try:
+            ledger.sync(history)
+            # Routed on the context the cheapest tier would get, like the app
+            context_manager.update(self.genai_client, history, ledger, wait=True)
+            routing_view = context_manager.view(MODEL_LADDER[0], ledger)
+            decision = route(prompt, routing_view.tokens, self.predict_tools, self.routing_profile)
+            result.update(model=decision.model, score=decision.score, token_count=decision.token_count,
+                          full_token_count=routing_view.full_tokens, tools=decision.tool_profile)
+            view = context_manager.view(decision.model, ledger)
+            chat, _ = pool.get(self.genai_client, decision.model, decision.config, history[:-1],
+                               start=view.start, summary=view.summary, tool_profile=decision.tool_profile)
+
+            queued = time.perf_counter()
+            with self._slots[decision.model]:
+                started = time.perf_counter()
+                response, rate_wait, retries = self.scheduler.call(
+                    decision.model, conversation_id, decision.token_count, lambda: chat.send_message(prompt)
+                )
+            latency = time.perf_counter() - started - rate_wait
+
+            parser = ReplyParser()
+            parser.feed(response)
+            reply = Message.from_reply(parser, model=decision.model)
+            pool.mark_synced(decision.model, len(history) + 1, decision.tool_profile)
+        except Exception as e:
+            result["error"] = str(e)
+            self._write(result)
+            return None
+
+        result.update(
+            reply=reply.content,
+            text=reply.text,
+            code=reply.code,
+            output=reply.output,
+            citations=[uri for _, uri in reply.citations],
+            ok=parser.ok,
+            prompt_tokens=getattr(parser.usage, "prompt_token_count", None),
+            cached_tokens=getattr(parser.usage, "cached_content_token_count", None) or 0,
+            queued_s=round(started - queued + rate_wait, 4),
+            retries=retries,
+            latency_s=round(latency, 4),
+        )
+        self._write(result, reply)
+        return reply
+
+
+def parse_tier_concurrency(values: list, default: int) -> dict:
+    """``["gemini-2.5-pro=2"]`` -> ``{"gemini-2.5-pro": 2, <other tiers>: default}``."""
+    limits = dict.fromkeys(MODEL_LADDER, default)
+    for value in values or []:
+        model, _, count = value.partition("=")
+        if model not in limits or not count.isdigit() or int(count) < 1:
+            raise SystemExit(f"--tier-concurrency expects MODEL=N with MODEL in {', '.join(MODEL_LADDER)}, got {value!r}")
+        limits[model] = int(count)
+    return limits
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="JSONL file with one conversation per line")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file results are appended to")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <output>.checkpoint)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_TIER_CONCURRENCY, help="in-flight requests per model tier")
+    parser.add_argument("--tier-concurrency", action="append", metavar="MODEL=N", help="override --concurrency for one tier")
+    parser.add_argument("--workers", type=int, help="conversations run at once (default: sum of the tier limits)")
+    parser.add_argument("--no-context-cache", action="store_true", help="don't keep long conversations' older turns in Gemini's context cache")
+    parser.add_argument("--all-tools", action="store_true", help="attach search and code execution to every turn instead of predicting them")
+    parser.add_argument("--routing-profile", default=ROUTING_PROFILE_PATH, help="routing profile to route with (default: %(default)s if present)")
+    parser.add_argument("--api-key", default=os.environ.get("GOOGLE_API_KEY"), help="Google AI API key (default: $GOOGLE_API_KEY)")
+    args = parser.parse_args(argv)
+
+    if not args.api_key:
+        parser.error("no API key: pass --api-key or set GOOGLE_API_KEY")
+    tier_concurrency = parse_tier_concurrency(args.tier_concurrency, args.concurrency)
+    workers = args.workers or sum(tier_concurrency.values())
+
+    conversations = load_conversations(args.input)
+    checkpoint = Checkpoint(args.checkpoint or args.output + ".checkpoint")
+    checkpoint.prune_output(args.output)
+    if checkpoint.done:
+        print(f"Resuming: {len(checkpoint.done)} turn(s) already done", file=sys.stderr)
+
+    runner = BatchRunner(ClientRegistry().get(args.api_key), args.output, checkpoint, tier_concurrency,
+                         context_cache=not args.no_context_cache, predict_tools=not args.all_tools,
+                         routing_profile=load_routing_profile(args.routing_profile))
+    started = time.perf_counter()
+    answered = failed = finished = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(runner.run_conversation, cid, messages) for cid, messages in conversations]
+            for future in as_completed(futures):
+                turns, errors = future.result()
+                answered += turns
+                failed += errors
+                finished += 1
+                if finished % PROGRESS_EVERY == 0 or finished == len(futures):
+                    print(f"{finished}/{len(futures)} conversations, {answered} turn(s) answered, "
+                          f"{failed} failed, {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    finally:
+        runner.close()
+        checkpoint.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
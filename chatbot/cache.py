@@ -0,0 +1,136 @@
+"""Response cache shared by every session in the server process."""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+RESPONSE_CACHE_PATH = os.path.join(".cache", "responses.sqlite3")
+RESPONSE_CACHE_TTL = 24 * 60 * 60      # Seconds before a cached answer expires
+RESPONSE_CACHE_TOOL_TTL = 15 * 60      # Same, for answers that used Google Search or code execution
+RESPONSE_CACHE_MAX_ENTRIES = 5000      # Size cap for the on-disk cache
+RESPONSE_CACHE_MEMORY_ENTRIES = 256    # Size cap for the in-memory LRU front
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Fold case, whitespace and trailing punctuation so trivial variants share a key."""
+    return " ".join(prompt.casefold().split()).rstrip("?!. ")
+
+
+def context_fingerprint(messages: list) -> str:
+    """Hash of the messages' text (failed turns are ignored, user text normalized)."""
+    digest = hashlib.sha256()
+    for msg in messages:
+        if msg.failed:
+            continue
+        text = normalize_prompt(msg.text) if msg.role == "user" else msg.text
+        digest.update(f"{msg.role}\x00{text}\x00".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def make_cache_key(prompt: str, model: str, history: list, summary: str = None, tool_profile: str = "") -> str:
+    """Cache key for a prompt sent to ``model`` with ``tool_profile``'s tools after ``summary`` and ``history``.
+
+    ``history`` is the part of the conversation the model gets verbatim, after
+    the ``summary`` of older turns (if any): a stored answer is only reused when
+    the model would have been sent the same context.
+    """
+    raw = f"{model}\x00{tool_profile}\x00{normalize_prompt(prompt)}\x00{summary or ''}\x00{context_fingerprint(history)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """In-memory LRU in front of an SQLite table, with TTL and size-capped eviction.
+
+    Each entry can have its own TTL (``put(..., ttl=)``), e.g. shorter for answers
+    built on search results. Safe to share between Streamlit script threads; all
+    access goes through one lock. Pass ``path=None`` for a memory-only cache.
+    """
+
+    def __init__(self, path: str = RESPONSE_CACHE_PATH, ttl: float = RESPONSE_CACHE_TTL,
+                 max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 memory_entries: int = RESPONSE_CACHE_MEMORY_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (expires_at, reply)
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, reply TEXT, created_at REAL, last_used REAL, expires_at REAL)"
+            )
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(responses)")]
+            if "expires_at" not in columns:
+                # Made by an older version, when every entry had the same TTL
+                self._db.execute("ALTER TABLE responses ADD COLUMN expires_at REAL")
+                self._db.execute("UPDATE responses SET expires_at = created_at + ?", (ttl,))
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+            self._db.commit()
+
+    def get(self, key: str):
+        """Return the cached reply for ``key``, or ``None`` on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now > entry[0]:
+                del self._memory[key]
+                entry = None
+            if entry is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT expires_at, reply FROM responses WHERE key = ? AND expires_at >= ?",
+                    (key, now)
+                ).fetchone()
+                if row is not None:
+                    entry = (row[0], row[1])
+                    self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, entry)
+            return entry[1]
+
+    def put(self, key: str, model: str, reply: str, ttl: float = None):
+        """Store a reply for ``ttl`` seconds (default: the cache's), evicting expired and least recently used entries."""
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._remember(key, (expires_at, reply))
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, model, reply, created_at, last_used, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, model, reply, now, now, expires_at)
+                )
+                self._db.execute("DELETE FROM responses WHERE expires_at < ?", (now,))
+                self._db.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+                self._db.commit()
+
+    def _remember(self, key: str, entry: tuple):
+        # Caller holds the lock
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+            }
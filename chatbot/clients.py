@@ -0,0 +1,79 @@
+"""Process-wide Gemini clients, one pooled client per API key."""
+import hashlib
+import threading
+import time
+
+import httpx
+from google import genai
+from google.genai import types
+
+CLIENT_IDLE_TIMEOUT = 30 * 60       # Seconds a client may sit unused before eviction
+MAX_CONNECTIONS = 100               # Concurrent connections per client (all sessions)
+MAX_KEEPALIVE_CONNECTIONS = 20      # Idle connections kept open for reuse
+KEEPALIVE_EXPIRY = 120              # Seconds an idle connection stays open
+
+
+def _key_id(api_key: str) -> str:
+    # Index clients by a hash so the registry never needs the raw key as a dict key
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+class ClientRegistry:
+    """Hand out one shared, keep-alive ``genai.Client`` per API key.
+
+    Every Streamlit session using the same key reuses the same client and its
+    HTTP connection pool, so requests skip fresh TCP/TLS handshakes. Clients that
+    haven't been used for ``idle_timeout`` seconds are dropped from the registry;
+    sessions still holding one keep working and pick up a new client on their
+    next rerun. Safe to call from any script thread.
+    """
+
+    def __init__(self, idle_timeout: float = CLIENT_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._clients = {}  # key id -> [client, last_used]
+        self._last_sweep = time.monotonic()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def get(self, api_key: str) -> genai.Client:
+        """Return the pooled client for ``api_key``, creating it on first use."""
+        key_id = _key_id(api_key)
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_sweep > self.idle_timeout / 2:
+                self._evict_idle(now)
+            entry = self._clients.get(key_id)
+            if entry is None:
+                entry = [self._create_client(api_key), now]
+                self._clients[key_id] = entry
+            entry[1] = time.monotonic()
+            return entry[0]
+
+    def evict_idle(self) -> int:
+        """Drop clients that have been idle for too long; returns how many were dropped."""
+        with self._lock:
+            return self._evict_idle(time.monotonic())
+
+    def _evict_idle(self, now: float) -> int:
+        # Caller holds the lock. Clients are not closed here because sessions may
+        # still hold them; their connections expire on their own via keep-alive
+        idle = [key_id for key_id, (_, last_used) in self._clients.items()
+                if now - last_used > self.idle_timeout]
+        for key_id in idle:
+            del self._clients[key_id]
+        self._last_sweep = now
+        return len(idle)
+
+    @staticmethod
+    def _create_client(api_key: str) -> genai.Client:
+        limits = httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        )
+        return genai.Client(
+            api_key=api_key,
+            http_options=types.HttpOptions(client_args={"limits": limits})
+        )
@@ -0,0 +1,170 @@
+"""Token-budgeted conversation context with rolling summaries of older turns."""
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from google.genai import types
+
+from chatbot.tokens import ROLE_OVERHEAD_TOKENS, default_estimator
+
+SUMMARY_MODEL = "gemini-2.5-flash-lite"  # Cheapest tier writes the summaries
+SUMMARY_MAX_TOKENS = 400                 # Upper bound on a summary's length
+SUMMARY_CACHE_ENTRIES = 512              # Summaries kept in memory (all sessions)
+FOLD_TARGET_RATIO = 0.5                  # After folding, keep this share of the budget verbatim
+
+# Context tokens each tier may receive (summary + verbatim recent turns)
+CONTEXT_TOKEN_BUDGETS = {
+    "gemini-2.5-flash-lite": 1500,
+    "gemini-2.5-flash": 2500,
+    "gemini-2.5-pro": 8000,
+}
+
+SUMMARY_PROMPT = """Summarize the conversation below so it can replace the original messages as context for an assistant.
+Keep facts, user preferences, decisions, open questions, names, numbers and code identifiers. Write in the language of the conversation, at most {max_words} words.
+
+Summary so far:
+{previous}
+
+New messages:
+{transcript}"""
+
+# Background workers and results shared by every session in the process
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="context-summary")
+_summary_cache = OrderedDict()
+_summary_cache_lock = threading.Lock()
+
+
+def summary_contents(summary: str) -> list:
+    """Chat turns that stand in for the summarized part of a conversation."""
+    if not summary:
+        return []
+    return [
+        types.Content(role="user", parts=[types.Part(text=f"Summary of our earlier conversation:\n{summary}")]),
+        types.Content(role="model", parts=[types.Part(text="Got it, I'll keep that in mind.")]),
+    ]
+
+
+def summarize(genai_client, previous_summary: str, messages: list) -> str:
+    """Fold ``messages`` into ``previous_summary`` with the cheapest model (cached)."""
+    transcript = "\n".join(f"{msg.role}: {msg.text}" for msg in messages if not msg.failed)
+    key = hashlib.sha256(f"{previous_summary}\x00{transcript}".encode("utf-8")).hexdigest()
+    with _summary_cache_lock:
+        if key in _summary_cache:
+            _summary_cache.move_to_end(key)
+            return _summary_cache[key]
+
+    response = genai_client.models.generate_content(
+        model=SUMMARY_MODEL,
+        contents=SUMMARY_PROMPT.format(
+            max_words=SUMMARY_MAX_TOKENS * 3 // 4,
+            previous=previous_summary or "(none)",
+            transcript=transcript,
+        ),
+        config=types.GenerateContentConfig(temperature=0.2, max_output_tokens=SUMMARY_MAX_TOKENS),
+    )
+    summary = (response.text or "").strip()
+    if not summary:
+        raise ValueError("Empty summary")
+
+    with _summary_cache_lock:
+        _summary_cache[key] = summary
+        while len(_summary_cache) > SUMMARY_CACHE_ENTRIES:
+            _summary_cache.popitem(last=False)
+    return summary
+
+
+@dataclass(frozen=True)
+class ContextView:
+    """What a model tier gets as context: a summary plus verbatim recent messages."""
+    start: int            # Index of the first message kept verbatim
+    summary: str          # Summary of messages[:start], or None
+    summary_tokens: int
+    verbatim_tokens: int  # Tokens in messages[start:]
+    full_tokens: int      # Tokens in the whole, uncompacted conversation
+
+    @property
+    def tokens(self) -> int:
+        return self.summary_tokens + self.verbatim_tokens
+
+    @property
+    def saved_tokens(self) -> int:
+        return max(0, self.full_tokens - self.tokens)
+
+
+class ContextManager:
+    """Keep each tier's context within its token budget by folding old turns.
+
+    Older messages are folded into a rolling summary at "fold points". A new fold
+    point is summarized in the background once the verbatim part no longer fits
+    the smallest budget; until it's ready, the previous fold point is used. Each
+    tier then gets the least-summarized fold point that fits its own budget.
+    """
+
+    def __init__(self, budgets: dict = None):
+        self.budgets = budgets or CONTEXT_TOKEN_BUDGETS
+        self._folds = [(0, None, 0)]  # (start, summary, summary_tokens), ascending start
+        self._pending = None          # (start, future) of a summary being written
+
+    def update(self, genai_client, messages: list, ledger, wait: bool = False):
+        """Collect finished summaries and schedule a new one if the context has grown.
+
+        With ``wait``, a new summary is finished before returning, so the views
+        don't depend on timing (batch runs); the app lets it finish in the background.
+        """
+        if self._folds[-1][0] > len(messages):
+            # The conversation was reset
+            self._folds = [(0, None, 0)]
+            self._pending = None
+
+        if self._pending is not None and self._pending[1].done():
+            start, future = self._pending
+            self._pending = None
+            try:
+                summary = future.result()
+                tokens = ROLE_OVERHEAD_TOKENS * 2 + default_estimator.estimate(summary)
+                self._folds.append((start, summary, tokens))
+            except Exception:
+                pass  # Try again on a later turn
+
+        last_start, last_summary, last_tokens = self._folds[-1]
+        limit = min(self.budgets.values())
+        if self._pending is not None or last_tokens + ledger.tokens_between(last_start) <= limit:
+            return
+
+        # Fold until the verbatim part fits in a fraction of the smallest budget,
+        # never touching the message being sent and always starting on a user turn
+        target = limit * FOLD_TARGET_RATIO - last_tokens
+        new_start = len(messages) - 1
+        for i in range(last_start + 1, len(messages)):
+            if messages[i].role == "user" and ledger.tokens_between(i) <= target:
+                new_start = i
+                break
+        if new_start <= last_start:
+            return
+
+        future = _executor.submit(summarize, genai_client, last_summary, messages[last_start:new_start])
+        self._pending = (new_start, future)
+        if wait:
+            try:
+                future.result()
+            except Exception:
+                return  # Collected and tried again on a later turn, like in the app
+            self.update(genai_client, messages, ledger, wait=True)
+
+    def view(self, model_name: str, ledger) -> ContextView:
+        """Context for a tier: the least-summarized fold point within its budget."""
+        budget = self.budgets.get(model_name, min(self.budgets.values()))
+        start, summary, summary_tokens = self._folds[-1]
+        for fold in self._folds:
+            if fold[2] + ledger.tokens_between(fold[0]) <= budget:
+                start, summary, summary_tokens = fold
+                break
+        return ContextView(
+            start=start,
+            summary=summary,
+            summary_tokens=summary_tokens,
+            verbatim_tokens=ledger.tokens_between(start),
+            full_tokens=ledger.total,
+        )
@@ -0,0 +1,152 @@
+"""Latency-SLA mode: race a slow generation against the next cheaper model tier."""
+import queue
+import threading
+import time
+
+from chatbot.responses import response_text
+
+DEFAULT_LATENCY_BUDGET = 10.0    # Seconds the caller is willing to wait for the first token
+HEDGE_FRACTION = 0.5             # Share of the budget to wait before firing the hedge
+LATENCY_HISTORY_QUANTILE = 0.95  # Observed first-token quantile compared against the budget
+LATENCY_HISTORY_MIN_SAMPLES = 5  # Turns a tier needs before its latency history steers routing
+
+
+def send_directly(model: str, chat, prompt: str, stream: bool):
+    """Send ``prompt`` on ``chat``: a response stream, or the whole response."""
+    return chat.send_message_stream(prompt) if stream else chat.send_message(prompt)
+
+
+class _Lane:
+    """One in-flight request to one model tier."""
+
+    def __init__(self, model: str, chat):
+        self.model = model
+        self.chat = chat
+        self.started = time.perf_counter()
+        self.cancelled = threading.Event()
+        self.buffer = []            # Chunks received before a winner was picked
+        self.first_token_at = None
+        self.finished = False
+        self.error = None
+
+
+class HedgedRequest:
+    """Sends one prompt to one or more tiers in background threads; the first to answer wins.
+
+    Each lane pushes its chunks (or, without streaming, the whole response) into a
+    shared queue, so the caller keeps rendering on the Streamlit thread. The SDK
+    can't abort a request mid-flight, so a cancelled lane stops at its next chunk
+    and whatever it still returns is dropped. ``on_late_answer(model, seconds)`` is
+    called from that lane's thread when a cancelled request finally answers, so its
+    real latency can still be recorded. ``send(model, chat, prompt, stream)`` makes
+    the actual call (by default straight on the chat), e.g. to go through a
+    rate-limiting scheduler.
+    """
+
+    def __init__(self, prompt: str, stream: bool = True, on_late_answer=None, send=None):
+        self.prompt = prompt
+        self.stream = stream
+        self.on_late_answer = on_late_answer
+        self.send = send or send_directly
+        self._lanes = {}             # model name -> _Lane
+        self._events = queue.Queue()  # (model, kind, payload) with kind "chunk", "done" or "error"
+
+    @property
+    def models(self) -> list:
+        """Models a request was sent to, in launch order."""
+        return list(self._lanes)
+
+    def launch(self, model: str, chat):
+        lane = _Lane(model, chat)
+        self._lanes[model] = lane
+        threading.Thread(target=self._run, args=(lane,), name=f"hedge-{model}", daemon=True).start()
+
+    def _run(self, lane: _Lane):
+        try:
+            if self.stream:
+                response_stream = self.send(lane.model, lane.chat, self.prompt, True)
+                for index, chunk in enumerate(response_stream):
+                    if lane.cancelled.is_set():
+                        response_stream.close()
+                        if index == 0:
+                            self._late_answer(lane)
+                        return
+                    self._events.put((lane.model, "chunk", chunk))
+            else:
+                response = self.send(lane.model, lane.chat, self.prompt, False)
+                if lane.cancelled.is_set():
+                    self._late_answer(lane)
+                    return
+                self._events.put((lane.model, "chunk", response))
+            self._events.put((lane.model, "done", None))
+        except Exception as e:
+            self._events.put((lane.model, "error", e))
+
+    def _late_answer(self, lane: _Lane):
+        if self.on_late_answer is not None:
+            self.on_late_answer(lane.model, time.perf_counter() - lane.started)
+
+    def _handle(self, model: str, kind: str, payload) -> bool:
+        """Apply one event to its lane; True when it carried the lane's first text."""
+        lane = self._lanes[model]
+        if kind == "chunk":
+            lane.buffer.append(payload)
+            if lane.first_token_at is None and response_text(payload):
+                lane.first_token_at = time.perf_counter()
+                return True
+        else:
+            lane.finished = True
+            lane.error = payload
+        return False
+
+    def wait_for_first_token(self, timeout: float = None):
+        """Model of the first lane to produce text, or ``None`` on timeout / when every lane ended without any."""
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        for lane in self._lanes.values():
+            if lane.first_token_at is not None:
+                return lane.model
+        while not all(lane.finished for lane in self._lanes.values()):
+            remaining = None if deadline is None else deadline - time.perf_counter()
+            if remaining is not None and remaining <= 0:
+                return None
+            try:
+                model, kind, payload = self._events.get(timeout=remaining)
+            except queue.Empty:
+                return None
+            if self._handle(model, kind, payload):
+                return model
+        return None
+
+    def fallback(self) -> str:
+        """Winner when no lane produced text: the first that finished cleanly, else re-raise the first error."""
+        for lane in self._lanes.values():
+            if lane.error is None:
+                return lane.model
+        raise next(iter(self._lanes.values())).error
+
+    def cancel_losers(self, winner: str) -> list:
+        """Cancel every lane but ``winner``'s; returns the cancelled models."""
+        losers = [model for model in self._lanes if model != winner]
+        for model in losers:
+            self._lanes[model].cancelled.set()
+        return losers
+
+    def first_token_latency(self, model: str):
+        """Seconds from launching ``model``'s request to its first text, if it produced any."""
+        lane = self._lanes[model]
+        return None if lane.first_token_at is None else lane.first_token_at - lane.started
+
+    def chat(self, model: str):
+        return self._lanes[model].chat
+
+    def chunks(self, model: str):
+        """Yield ``model``'s chunks: those already buffered, then the rest as they arrive."""
+        lane = self._lanes[model]
+        while True:
+            while lane.buffer:
+                yield lane.buffer.pop(0)
+            if lane.finished:
+                if lane.error is not None:
+                    raise lane.error
+                return
+            self._handle(*self._events.get())
@@ -0,0 +1,366 @@
+"""Per-session and process-wide memory budgets: cold history goes to disk, idle chats are dropped."""
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from chatbot.messages import Message
+
+HISTORY_STORE_PATH = os.path.join(".cache", "history.sqlite3")
+HISTORY_STORE_MAX_AGE = 7 * 24 * 60 * 60    # Seconds before rows left behind by a crashed process are purged
+HISTORY_STORE_MEMORY_ENTRIES = 128           # Spilled messages kept in memory after being read back
+SESSION_MEMORY_BUDGET = 2 * 1024 * 1024      # Bytes of messages and live chats per session
+GLOBAL_MEMORY_BUDGET = 256 * 1024 * 1024     # Bytes for every session in the process together
+IDLE_SESSION_SECONDS = 10 * 60               # Untouched this long, a session may lose its chats and history to disk
+CONTENT_OVERHEAD_BYTES = 1450                # One chat turn (Content + Part objects) besides its text
+CHAT_OVERHEAD_BYTES = 256                    # An empty chat object
+
+# Fields a spilled message keeps in memory (the rest goes to the store)
+_KEPT_FIELDS = ("role", "model", "tokens", "context_tokens", "first_token_time", "generation_time", "cached", "failed")
+
+
+def message_bytes(msg: Message) -> int:
+    """Approximate memory held by one message record and its strings."""
+    size = sys.getsizeof(msg)
+    if isinstance(msg, SpilledMessage):
+        return size
+    size += sys.getsizeof(msg.text)
+    for parts in (msg.code, msg.output):
+        size += sys.getsizeof(parts) + sum(sys.getsizeof(part) for part in parts)
+    size += sys.getsizeof(msg.citations) + sum(sys.getsizeof(citation) + sys.getsizeof(citation[1]) for citation in msg.citations)
+    return size
+
+
+def content_bytes(contents: list) -> int:
+    """Approximate memory held by chat contents (``types.Content``)."""
+    return sum(
+        CONTENT_OVERHEAD_BYTES + sum(sys.getsizeof(part.text) for part in content.parts or () if part.text)
+        for content in contents
+    )
+
+
+class HistoryStore:
+    """Spilled message parts in SQLite, keyed by session and position, with a small LRU in front.
+
+    A session's rows are deleted when it ends (or its conversation is reset).
+    Safe to share between Streamlit script threads; all access goes through one
+    lock. Pass ``path=None`` for an in-memory database.
+    """
+
+    def __init__(self, path: str = HISTORY_STORE_PATH, memory_entries: int = HISTORY_STORE_MEMORY_ENTRIES):
+        self.memory_entries = memory_entries
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # (session id, position) -> parts JSON
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "session TEXT, position INTEGER, parts TEXT, saved_at REAL, PRIMARY KEY (session, position))"
+        )
+        self._db.execute("DELETE FROM messages WHERE saved_at < ?", (time.time() - HISTORY_STORE_MAX_AGE,))
+        self._db.commit()
+
+    def save(self, session_id: str, items: list):
+        """Store ``[(position, parts JSON), ...]`` for a session."""
+        now = time.time()
+        with self._lock:
+            for position, _ in items:
+                self._memory.pop((session_id, position), None)
+            self._db.executemany(
+                "INSERT OR REPLACE INTO messages (session, position, parts, saved_at) VALUES (?, ?, ?, ?)",
+                [(session_id, position, parts, now) for position, parts in items]
+            )
+            self._db.commit()
+
+    def load(self, session_id: str, position: int) -> str:
+        """The parts JSON stored for one message."""
+        key = (session_id, position)
+        with self._lock:
+            parts = self._memory.get(key)
+            if parts is None:
+                row = self._db.execute(
+                    "SELECT parts FROM messages WHERE session = ? AND position = ?", key
+                ).fetchone()
+                if row is None:
+                    raise KeyError(f"Message {position} of session {session_id} is not in the history store")
+                parts = row[0]
+            self._memory[key] = parts
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+            return parts
+
+    def load_range(self, session_id: str, start: int, end: int) -> dict:
+        """``{position: parts JSON}`` for the stored messages in ``[start, end)``, in one query."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT position, parts FROM messages WHERE session = ? AND position >= ? AND position < ?",
+                (session_id, start, end)
+            ).fetchall()
+        return dict(rows)
+
+    def drop(self, session_id: str):
+        """Forget every message of a session."""
+        with self._lock:
+            for key in [key for key in self._memory if key[0] == session_id]:
+                del self._memory[key]
+            self._db.execute("DELETE FROM messages WHERE session = ?", (session_id,))
+            self._db.commit()
+
+
+class SpilledMessage(Message):
+    """A ``Message`` whose text, code, output and citations were moved to a ``HistoryStore``.
+
+    Role, flags, model, timings and token count stay in memory; the parts are
+    read back from the store whenever something asks for them (e.g. when the
+    user scrolls back), so the record can stand in for the original anywhere.
+    Shown messages are swapped back for full ones on the next run (``touch``),
+    so ``content`` is only read from here once per page load.
+    """
+
+    __slots__ = ("_store", "_session_id", "_position")
+
+    def __init__(self, msg: Message, store: HistoryStore, session_id: str, position: int):
+        for name in _KEPT_FIELDS:
+            setattr(self, name, getattr(msg, name))
+        self._store = store
+        self._session_id = session_id
+        self._position = position
+
+    def __repr__(self):
+        return f"SpilledMessage({self.role!r}, position={self._position})"
+
+    def _parts(self) -> dict:
+        return json.loads(self._store.load(self._session_id, self._position))
+
+    @property
+    def text(self) -> str:
+        return self._parts()["text"]
+
+    @property
+    def code(self) -> tuple:
+        return tuple(self._parts()["code"])
+
+    @property
+    def output(self) -> tuple:
+        return tuple(self._parts()["output"])
+
+    @property
+    def citations(self) -> tuple:
+        return tuple(tuple(citation) for citation in self._parts()["citations"])
+
+    @property
+    def content(self) -> str:
+        return self.restore().content
+
+    def restore(self, parts_json: str = None) -> Message:
+        """The full ``Message`` again (``parts_json`` if it was already loaded)."""
+        parts = json.loads(parts_json or self._store.load(self._session_id, self._position))
+        msg = Message(self.role, parts["text"], parts["code"], parts["output"],
+                      [tuple(citation) for citation in parts["citations"]])
+        for name in _KEPT_FIELDS:
+            setattr(msg, name, getattr(self, name))
+        return msg
+
+
+class SessionMemory:
+    """What the ``SessionMemoryManager`` knows about one session: its history, chats and footprint.
+
+    ``attach`` must be given the session's current message list and chat pool on
+    every run (both are replaced when the conversation is reset).
+    """
+
+    def __init__(self, session_id: str, store: HistoryStore):
+        self.session_id = session_id
+        self.store = store
+        self.lock = threading.RLock()  # Held while this session's memory is measured or moved
+        self.messages = None
+        self.chat_pool = None
+        self.last_active = time.monotonic()
+        self.keep_from = 0             # Messages from here on stay in memory while the session is in use
+        self.spilled = 0               # messages[:spilled] live in the store
+        self.live_chats = 0
+        self.chat_bytes = 0
+        self._message_bytes = 0
+        self._measured = 0             # messages[:_measured] are included in _message_bytes
+
+    @property
+    def total_bytes(self) -> int:
+        return self._message_bytes + self.chat_bytes
+
+    def attach(self, messages: list, chat_pool):
+        with self.lock:
+            if messages is not self.messages:
+                # A new conversation: whatever was stored belongs to the old one
+                if self.messages is not None:
+                    self.store.drop(self.session_id)
+                self.messages = messages
+                self.spilled = self._measured = self._message_bytes = 0
+            self.chat_pool = chat_pool
+
+    def touch(self):
+        """Mark the session as in use and read back recent messages spilled while it was idle."""
+        with self.lock:
+            self.last_active = time.monotonic()
+            start = min(self.keep_from, len(self.messages))
+            if self.spilled > start:
+                loaded = self.store.load_range(self.session_id, start, self.spilled)
+                for position in range(start, self.spilled):
+                    msg = self.messages[position]
+                    if isinstance(msg, SpilledMessage):
+                        self._replace(position, msg.restore(loaded.get(position)))
+                self.spilled = start
+
+    def measure(self):
+        """Bring the footprint up to date (new messages and the chats' current histories)."""
+        with self.lock:
+            for msg in self.messages[self._measured:]:
+                self._message_bytes += message_bytes(msg)
+            self._measured = len(self.messages)
+            contents = self.chat_pool.contents() if self.chat_pool is not None else []
+            self.live_chats = len(contents)
+            self.chat_bytes = sum(CHAT_OVERHEAD_BYTES + content_bytes(chat_contents) for chat_contents in contents)
+
+    def spill(self, end: int, budget: float = 0) -> int:
+        """Move the oldest in-memory messages before ``end`` to the store until the footprint is within ``budget``.
+
+        Returns how many messages were moved.
+        """
+        with self.lock:
+            end = min(end, len(self.messages))
+            batch = []
+            position = self.spilled
+            footprint = self.total_bytes
+            while position < end and footprint > budget:
+                msg = self.messages[position]
+                if not isinstance(msg, SpilledMessage):
+                    batch.append((position, msg))
+                    footprint -= message_bytes(msg)
+                position += 1
+            if not batch:
+                return 0
+            # Written before any record is swapped, so a reader always finds the parts somewhere
+            self.store.save(self.session_id, [(i, msg.parts_json()) for i, msg in batch])
+            for i, msg in batch:
+                self._replace(i, SpilledMessage(msg, self.store, self.session_id, i))
+            self.spilled = position
+            return len(batch)
+
+    def release(self) -> int:
+        """Drop the live chats and spill the whole history; returns the bytes freed."""
+        with self.lock:
+            before = self.total_bytes
+            if self.chat_pool is not None:
+                self.chat_pool.release()
+            self.live_chats = self.chat_bytes = 0
+            self.spill(len(self.messages))
+            return before - self.total_bytes
+
+    def _replace(self, position: int, msg: Message):
+        # Caller holds the lock
+        if position < self._measured:
+            self._message_bytes += message_bytes(msg) - message_bytes(self.messages[position])
+        self.messages[position] = msg
+
+    def footprint(self) -> dict:
+        """``{"session", "memory_kb", "in_memory", "on_disk", "live_chats", "idle_s"}`` for the sidebar."""
+        on_disk = self.spilled
+        return {
+            "session": self.session_id[:8],
+            "memory_kb": round(self.total_bytes / 1024, 1),
+            "in_memory": len(self.messages or ()) - on_disk,
+            "on_disk": on_disk,
+            "live_chats": self.live_chats,
+            "idle_s": round(time.monotonic() - self.last_active),
+        }
+
+
+class SessionMemoryManager:
+    """Keeps every session's messages and live chats within a per-session and a global budget.
+
+    Each session calls ``enforce`` at the end of every run. Over its own budget,
+    its oldest messages are moved to the ``HistoryStore``, except the ones it
+    still needs in memory (``keep_from`` onwards: the visible window and what
+    the models are sent verbatim). With all sessions together over the global
+    budget, the sessions idle for the longest (at least ``idle_seconds``) lose
+    their live chats, which are rebuilt from the history when used again, and
+    their whole history moves to disk until they return (``SessionMemory.touch``).
+    Sessions that end are forgotten along with their stored messages. Footprints
+    are estimates of what the message records and chat contents hold, not the
+    process's RSS; they err high, since a chat's turns usually share their text
+    with the message records. Safe to share between threads.
+    """
+
+    def __init__(self, store: HistoryStore = None, session_budget: float = SESSION_MEMORY_BUDGET,
+                 global_budget: float = GLOBAL_MEMORY_BUDGET, idle_seconds: float = IDLE_SESSION_SECONDS):
+        self.store = store if store is not None else HistoryStore()
+        self.session_budget = session_budget
+        self.global_budget = global_budget
+        self.idle_seconds = idle_seconds
+        self.spilled_messages = 0   # Messages moved to disk so far
+        self.released_sessions = 0  # Idle sessions whose chats and history were released
+        self._lock = threading.Lock()
+        self._sessions = weakref.WeakValueDictionary()  # session id -> SessionMemory
+
+    def register(self, session_id: str) -> SessionMemory:
+        """A ``SessionMemory`` for a new session (keep it in the session's state)."""
+        memory = SessionMemory(session_id, self.store)
+        with self._lock:
+            self._sessions[session_id] = memory
+        # The session's state (and this object with it) goes away when the browser session ends
+        weakref.finalize(memory, self.store.drop, session_id)
+        return memory
+
+    def enforce(self, memory: SessionMemory, keep_from: int):
+        """End-of-run bookkeeping for ``memory``'s session, then the global budget."""
+        with memory.lock:
+            memory.keep_from = keep_from
+            memory.last_active = time.monotonic()
+            memory.measure()
+            if memory.total_bytes > self.session_budget:
+                spilled = memory.spill(keep_from, self.session_budget)
+                with self._lock:
+                    self.spilled_messages += spilled
+
+        with self._lock:
+            sessions = list(self._sessions.values())
+        total = sum(session.total_bytes for session in sessions)
+        if total <= self.global_budget:
+            return
+        now = time.monotonic()
+        for session in sorted(sessions, key=lambda session: session.last_active):
+            if session is memory or now - session.last_active < self.idle_seconds:
+                continue
+            with session.lock:
+                # Checked again under the session's lock: it may have come back meanwhile
+                if time.monotonic() - session.last_active < self.idle_seconds or session.messages is None:
+                    continue
+                if not session.live_chats and session.spilled == len(session.messages):
+                    continue  # Already released
+                on_disk = session.spilled
+                total -= session.release()
+                with self._lock:
+                    self.spilled_messages += session.spilled - on_disk
+                    self.released_sessions += 1
+            if total <= self.global_budget:
+                break
+
+    def stats(self, limit: int = 10) -> dict:
+        """Totals plus the footprints of the ``limit`` largest sessions."""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            spilled, released = self.spilled_messages, self.released_sessions
+        sessions.sort(key=lambda session: session.total_bytes, reverse=True)
+        return {
+            "sessions": len(sessions),
+            "total_bytes": sum(session.total_bytes for session in sessions),
+            "spilled_messages": spilled,
+            "released_sessions": released,
+            "largest": [session.footprint() for session in sessions[:limit]],
+        }
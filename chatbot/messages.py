@@ -0,0 +1,85 @@
+"""Compact chat message records that keep a reply's parts apart."""
+import json
+from functools import lru_cache
+
+from chatbot.responses import FALLBACK_REPLY, ReplyParser, wrap_code_blocks
+
+RENDERED_REPLY_CACHE_ENTRIES = 1024    # Rendered replies kept for reruns (all sessions)
+
+
+@lru_cache(maxsize=RENDERED_REPLY_CACHE_ENTRIES)
+def render_reply(text: str, code: tuple, output: tuple, citations: tuple) -> str:
+    """The markdown shown in the chat for a reply: text, then code, output and references.
+
+    Cached outside the message records, so redrawing the visible messages on every
+    rerun doesn't rebuild them, and records don't carry a second copy of each reply.
+    A plain reply renders to its own text object.
+    """
+    blocks = [wrap_code_blocks(text)]
+    blocks += [f"```python\n{part.rstrip()}\n```" for part in code]
+    blocks += [f"**Output:**\n```\n{part.rstrip()}\n```" for part in output]
+    if citations:
+        blocks.append("Referensi:\n" + "\n".join(f"[{number}] {uri}  " for number, uri in citations))
+    return "\n\n".join(block for block in blocks if block)
+
+
+class Message:
+    """One chat message.
+
+    Assistant replies keep their answer text, executed code, execution output and
+    citation URIs in separate fields. Only ``text`` is used as context for the
+    models (token counts, summaries, syncing other tiers); the rest is added back
+    when the message is displayed via ``content`` (see ``render_reply``).
+    ``__slots__`` keeps each record small, since every session holds its whole
+    history in memory.
+    """
+
+    __slots__ = ("role", "text", "code", "output", "citations", "model", "tokens",
+                 "context_tokens", "first_token_time", "generation_time", "cached", "failed")
+
+    def __init__(self, role: str, text: str = "", code: tuple = (), output: tuple = (), citations: tuple = (),
+                 model: str = None, context_tokens: int = None, first_token_time: float = None,
+                 generation_time: float = None, cached: bool = False, failed: bool = False):
+        self.role = role
+        self.text = text
+        self.code = tuple(code)            # Code the model ran with the code execution tool
+        self.output = tuple(output)        # What that code printed
+        self.citations = tuple(citations)  # ((number, uri), ...) from search grounding
+        self.model = model
+        self.tokens = None                 # Estimated tokens of ``text``, filled in by the TokenLedger
+        self.context_tokens = context_tokens
+        self.first_token_time = first_token_time
+        self.generation_time = generation_time
+        self.cached = cached
+        self.failed = failed
+
+    def __repr__(self):
+        return f"Message({self.role!r}, {self.text[:40]!r}{'...' if len(self.text) > 40 else ''})"
+
+    @classmethod
+    def from_reply(cls, parser: ReplyParser, **fields) -> "Message":
+        """Build an assistant message from a parsed reply (empty replies get ``FALLBACK_REPLY``)."""
+        text = parser.text if parser.ok else FALLBACK_REPLY
+        return cls("assistant", text, parser.code, parser.output, parser.citations, **fields)
+
+    @property
+    def content(self) -> str:
+        """The markdown shown in the chat."""
+        if self.role != "assistant":
+            return self.text
+        return render_reply(self.text, self.code, self.output, self.citations)
+
+    def parts_json(self) -> str:
+        """The reply's parts as JSON (what the response cache and batch checkpoints store)."""
+        return json.dumps({"text": self.text, "code": self.code, "output": self.output, "citations": self.citations})
+
+    @classmethod
+    def from_parts_json(cls, data: str, **fields) -> "Message":
+        try:
+            parts = json.loads(data)
+        except ValueError:
+            parts = None
+        if not isinstance(parts, dict):
+            parts = {"text": data}  # Stored as one markdown string by an older version
+        citations = [tuple(citation) for citation in parts.get("citations", ())]
+        return cls("assistant", parts["text"], parts.get("code", ()), parts.get("output", ()), citations, **fields)
@@ -0,0 +1,219 @@
+"""Per-turn latency spans, aggregated per model tier and exported as JSONL / Prometheus."""
+import json
+import logging
+import logging.handlers
+import math
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_DIR = ".metrics"                 # Where the JSONL log and .prom file are written
+METRICS_LOG_MAX_BYTES = 5 * 1024 * 1024  # Rotate the JSONL log at this size
+METRICS_LOG_BACKUPS = 3                  # Rotated JSONL files to keep
+METRICS_WINDOW = 1000                    # Recent samples per (stage, model) used for quantiles
+METRICS_PORT = int(os.environ.get("CHATBOT_METRICS_PORT", "0"))  # 0 disables the /metrics endpoint
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def quantile(sorted_values: list, q: float) -> float:
+    """Nearest-rank quantile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(q * len(sorted_values)) - 1)]
+
+
+class TurnTrace:
+    """Timing spans for one chat turn, tagged with the model and whether it switched.
+
+    ``turn_id`` links the turn's record to feedback given on its answer later.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.turn_id = uuid.uuid4().hex
+        self.spans = {}  # stage -> seconds (repeated stages add up)
+        self.tags = {"turn_id": self.turn_id, "model": None, "switched": False}
+
+    @contextmanager
+    def span(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def add(self, stage: str, seconds: float):
+        self.spans[stage] = self.spans.get(stage, 0.0) + seconds
+
+    def tag(self, **tags):
+        self.tags.update(tags)
+
+    def finish(self) -> dict:
+        """Close the trace: adds the whole-turn span and returns a JSON-ready record."""
+        self.spans["turn"] = time.perf_counter() - self.started
+        return {"ts": time.time(), **self.tags, "spans": dict(self.spans)}
+
+
+class MetricsRecorder:
+    """Collects finished turn traces from every session in the process.
+
+    Keeps the most recent samples per (stage, model) for p50/p95/p99, appends each
+    turn to a rotating JSONL log and rewrites a Prometheus text-format file. With
+    ``port`` set, the same text is also served at ``http://<host>:<port>/metrics``.
+    Thumbs ratings of answers go to their own log, ``feedback.jsonl``.
+    """
+
+    def __init__(self, directory: str = METRICS_DIR, port: int = METRICS_PORT):
+        self._lock = threading.Lock()
+        self._samples = {}  # (stage, model) -> deque of seconds
+        self._totals = {}   # (stage, model) -> [count, sum] since start
+        self._failures = {}  # model -> failed turns (logged, but kept out of the quantiles)
+        self._feedback = {}  # (model, "up" / "down") -> ratings given
+        self._prom_path = None
+        self._log = None
+        self._feedback_log = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._prom_path = os.path.join(directory, "metrics.prom")
+            # Used on its own (not attached to a logger) just for its size-based rotation
+            self._log = logging.handlers.RotatingFileHandler(
+                os.path.join(directory, "turns.jsonl"),
+                maxBytes=METRICS_LOG_MAX_BYTES,
+                backupCount=METRICS_LOG_BACKUPS,
+                encoding="utf-8",
+            )
+            self._feedback_log = logging.handlers.RotatingFileHandler(
+                os.path.join(directory, "feedback.jsonl"),
+                maxBytes=METRICS_LOG_MAX_BYTES,
+                backupCount=METRICS_LOG_BACKUPS,
+                encoding="utf-8",
+            )
+        self.server = None
+        if port:
+            try:
+                self.server = start_metrics_server(self, port)
+            except OSError as e:
+                # Another recorder in this process already serves the port
+                logging.getLogger(__name__).warning("Metrics endpoint not started on port %s: %s", port, e)
+
+    def record(self, trace: TurnTrace):
+        record = trace.finish()
+        model = record.get("model") or "unknown"
+        with self._lock:
+            if record.get("failed"):
+                self._failures[model] = self._failures.get(model, 0) + 1
+                spans = {}
+            else:
+                spans = record["spans"]
+        for stage, seconds in spans.items():
+            self.observe(stage, model, seconds)
+        if self._log is not None:
+            self._log.handle(logging.makeLogRecord({"msg": json.dumps(record)}))
+        self._write_prometheus()
+
+    def record_feedback(self, turn_id: str, model: str, rating):
+        """Log a thumbs rating of a recorded turn's answer: 1 up, 0 down, ``None`` taken back.
+
+        A later rating of the same turn replaces the earlier one.
+        """
+        if rating is not None:
+            key = (model or "unknown", "up" if rating else "down")
+            with self._lock:
+                self._feedback[key] = self._feedback.get(key, 0) + 1
+        if self._feedback_log is not None:
+            record = {"ts": time.time(), "turn_id": turn_id, "model": model, "rating": rating}
+            self._feedback_log.handle(logging.makeLogRecord({"msg": json.dumps(record)}))
+        self._write_prometheus()
+
+    def _write_prometheus(self):
+        if self._prom_path is not None:
+            tmp_path = f"{self._prom_path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self.prometheus_text())
+            os.replace(tmp_path, self._prom_path)
+
+    def observe(self, stage: str, model: str, seconds: float):
+        """Add one sample outside a turn trace (e.g. the wait of a cancelled request)."""
+        with self._lock:
+            self._samples.setdefault((stage, model), deque(maxlen=METRICS_WINDOW)).append(seconds)
+            totals = self._totals.setdefault((stage, model), [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+
+    def percentile(self, stage: str, model: str, q: float, min_samples: int = 1):
+        """Recent ``q`` quantile of a stage for one model, or ``None`` with too little history."""
+        with self._lock:
+            values = sorted(self._samples.get((stage, model), ()))
+        if len(values) < max(1, min_samples):
+            return None
+        return quantile(values, q)
+
+    def summary(self) -> list:
+        """Rows of ``{"model", "stage", "count", "p50_ms", "p95_ms", "p99_ms"}``."""
+        with self._lock:
+            snapshot = {key: sorted(values) for key, values in self._samples.items()}
+        rows = []
+        for (stage, model), values in sorted(snapshot.items(), key=lambda item: (item[0][1], item[0][0])):
+            row = {"model": model, "stage": stage, "count": len(values)}
+            for q in QUANTILES:
+                row[f"p{int(q * 100)}_ms"] = round(quantile(values, q) * 1e3, 1)
+            rows.append(row)
+        return rows
+
+    def prometheus_text(self) -> str:
+        with self._lock:
+            snapshot = {key: sorted(values) for key, values in self._samples.items()}
+            totals = {key: list(value) for key, value in self._totals.items()}
+            failures = dict(self._failures)
+            feedback = dict(self._feedback)
+        lines = [
+            "# HELP chatbot_turn_stage_seconds Latency of each stage of a chat turn.",
+            "# TYPE chatbot_turn_stage_seconds summary",
+        ]
+        for (stage, model), values in sorted(snapshot.items()):
+            labels = f'stage="{stage}",model="{model}"'
+            for q in QUANTILES:
+                lines.append(f'chatbot_turn_stage_seconds{{{labels},quantile="{q}"}} {quantile(values, q):.6f}')
+            count, total = totals[(stage, model)]
+            lines.append(f"chatbot_turn_stage_seconds_sum{{{labels}}} {total:.6f}")
+            lines.append(f"chatbot_turn_stage_seconds_count{{{labels}}} {count}")
+        lines += [
+            "# HELP chatbot_turn_failures_total Turns that ended with an error.",
+            "# TYPE chatbot_turn_failures_total counter",
+        ]
+        for model, count in sorted(failures.items()):
+            lines.append(f'chatbot_turn_failures_total{{model="{model}"}} {count}')
+        lines += [
+            "# HELP chatbot_feedback_total Thumbs ratings given to answers.",
+            "# TYPE chatbot_feedback_total counter",
+        ]
+        for (model, rating), count in sorted(feedback.items()):
+            lines.append(f'chatbot_feedback_total{{model="{model}",rating="{rating}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(recorder: MetricsRecorder, port: int) -> ThreadingHTTPServer:
+    """Serve ``recorder.prometheus_text()`` at ``/metrics`` from a daemon thread."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            body = recorder.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Keep scrape requests out of the Streamlit log
+
+    server = ThreadingHTTPServer(("", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,218 @@
+"""Explicit context caching: keep each tier's stable chat prefix in Gemini's cached-content store."""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+
+from google.genai import types
+
+from chatbot.tokens import default_estimator
+
+# Smallest prefix (system instruction + contents) the API will cache, per model
+CACHE_MIN_TOKENS = {
+    "gemini-2.5-flash-lite": 1024,
+    "gemini-2.5-flash": 1024,
+    "gemini-2.5-pro": 4096,
+}
+DEFAULT_CACHE_MIN_TOKENS = 4096  # For models missing from CACHE_MIN_TOKENS
+CACHE_TTL_SECONDS = 600          # Lifetime of a cache; renewed while the conversation is active
+CACHE_RENEW_MARGIN = 120         # Renew a cache's TTL once less than this many seconds are left
+CACHE_EXPIRY_GUARD = 30          # Stop referencing a cache this close to its expiry
+CACHE_REFRESH_TOKENS = 2048      # Uncached tail size at which the cached prefix is moved forward
+CACHE_RETRY_AFTER = 300          # Seconds to wait after a failed cache creation before trying again
+
+# Rough prompt-processing time per 1k input tokens, only used to estimate the
+# latency a cache hit saved; measure yours with benchmarks/bench_prefix_cache.py
+PREFILL_SECONDS_PER_1K_TOKENS = {
+    "gemini-2.5-flash-lite": 0.02,
+    "gemini-2.5-flash": 0.04,
+    "gemini-2.5-pro": 0.1,
+}
+
+# Cache uploads, renewals and deletes run here so a turn never waits for them
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefix-cache")
+_log = logging.getLogger(__name__)
+
+
+def contents_tokens(contents: list) -> int:
+    """Estimated tokens in the text parts of chat contents."""
+    return sum(default_estimator.estimate(part.text) for content in contents for part in content.parts or () if part.text)
+
+
+def estimated_savings(model_name: str, cached_tokens: int) -> float:
+    """Seconds of prompt processing a turn likely skipped thanks to ``cached_tokens``."""
+    return PREFILL_SECONDS_PER_1K_TOKENS.get(model_name, 0.0) * (cached_tokens or 0) / 1000
+
+
+def is_cache_error(error: Exception) -> bool:
+    """Whether a request failed because its cached content is gone (expired or deleted)."""
+    message = str(error)
+    return "CachedContent" in message or "cached content" in message.lower()
+
+
+def _create(genai_client, model_name: str, config, contents: list) -> str:
+    cache = genai_client.caches.create(
+        model=model_name,
+        config=types.CreateCachedContentConfig(
+            contents=contents,
+            system_instruction=config.system_instruction,
+            tools=config.tools,
+            tool_config=config.tool_config,
+            ttl=f"{CACHE_TTL_SECONDS}s",
+        ),
+    )
+    return cache.name
+
+
+def _renew(genai_client, name: str):
+    genai_client.caches.update(name=name, config=types.UpdateCachedContentConfig(ttl=f"{CACHE_TTL_SECONDS}s"))
+
+
+def _delete(genai_client, name: str):
+    try:
+        genai_client.caches.delete(name=name)
+    except Exception as e:
+        # It expires on its own anyway
+        _log.info("Could not delete cached content %s: %s", name, e)
+
+
+def _delete_created(genai_client, future):
+    # Done-callback for a creation that finished after its conversation was reset
+    if future.exception() is None:
+        _delete(genai_client, future.result())
+
+
+@dataclass
+class _Entry:
+    """A cached prefix: the first ``len(contents)`` chat contents plus the config's instruction and tools."""
+    name: str
+    contents: list
+    instruction: tuple  # (system_instruction, tools, tool_config) it was created with
+    expires: float      # time.monotonic() deadline (measured from the request, so it errs early)
+
+
+class PrefixCache:
+    """Uploads the system instruction plus the stable start of each chat's history once.
+
+    Chats then reference the cache by name and only send the turns after it. A
+    cache is created in the background once a tier's prefix is long enough to be
+    cached, moved forward (a new cache replaces the old one) when the uncached
+    tail grows past ``refresh_tokens``, renewed while it's in use and dropped
+    when the history it covers changes (e.g. older turns folded into a summary).
+    ``ChatSessionPool`` asks ``update`` whether a chat should be rebuilt and
+    ``split`` how to build it. Caches are kept per chat ``key``, a
+    ``(model name, tool profile)`` pair, since the tools are part of the cache.
+    """
+
+    def __init__(self, min_tokens: dict = None, refresh_tokens: int = CACHE_REFRESH_TOKENS):
+        self.min_tokens = min_tokens or CACHE_MIN_TOKENS
+        self.refresh_tokens = refresh_tokens
+        self._entries = {}   # key -> _Entry
+        self._pending = {}   # key -> (_Entry without a name yet, future)
+        self._renewing = {}  # key -> (started, future) of a TTL renewal
+        self._failed = {}    # key -> time.monotonic() of the last failed creation
+
+    def update(self, genai_client, key: tuple, config, contents: list) -> bool:
+        """Collect finished cache work and start new work for a chat; True when it should be rebuilt.
+
+        ``contents`` is the whole history the chat holds before the next prompt.
+        """
+        model_name = key[0]
+        now = time.monotonic()
+        changed = False
+        instruction = (config.system_instruction, config.tools, config.tool_config)
+        entry = self._entries.get(key)
+        if entry is not None and (
+            entry.expires - now < CACHE_EXPIRY_GUARD
+            or entry.instruction != instruction
+            or contents[:len(entry.contents)] != entry.contents
+        ):
+            # The history it covers changed or it (nearly) expired: stop using it
+            self._drop(genai_client, key)
+            entry, changed = None, True
+
+        pending = self._pending.get(key)
+        if pending is not None and pending[1].done():
+            new_entry, future = self._pending.pop(key)
+            try:
+                new_entry.name = future.result()
+            except Exception as e:
+                _log.warning("Context cache for %s not created: %s", model_name, e)
+                self._failed[key] = now
+            else:
+                if contents[:len(new_entry.contents)] == new_entry.contents and new_entry.instruction == instruction:
+                    if entry is not None:
+                        self._drop(genai_client, key)
+                    self._entries[key] = entry = new_entry
+                    changed = True
+                else:
+                    # The history moved on while it was being uploaded
+                    _executor.submit(_delete, genai_client, new_entry.name)
+            pending = None
+
+        renewing = self._renewing.get(key)
+        if renewing is not None and renewing[1].done():
+            started, future = self._renewing.pop(key)
+            if future.exception() is None and entry is not None:
+                entry.expires = started + CACHE_TTL_SECONDS
+        elif renewing is None and entry is not None and entry.expires - now < CACHE_RENEW_MARGIN:
+            self._renewing[key] = (now, _executor.submit(_renew, genai_client, entry.name))
+
+        if pending is None and now - self._failed.get(key, float("-inf")) > CACHE_RETRY_AFTER:
+            cached = len(entry.contents) if entry is not None else 0
+            tail_tokens = contents_tokens(contents[cached:])
+            if entry is not None:
+                due = tail_tokens >= self.refresh_tokens
+            else:
+                instruction_tokens = default_estimator.estimate(str(config.system_instruction or ""))
+                due = instruction_tokens + tail_tokens >= self.min_tokens.get(model_name, DEFAULT_CACHE_MIN_TOKENS)
+            if due:
+                new_entry = _Entry(None, list(contents), instruction, now + CACHE_TTL_SECONDS)
+                future = _executor.submit(_create, genai_client, model_name, config, new_entry.contents)
+                self._pending[key] = (new_entry, future)
+        return changed
+
+    def _drop(self, genai_client, key: tuple):
+        entry = self._entries.pop(key, None)
+        self._renewing.pop(key, None)
+        if entry is not None:
+            _executor.submit(_delete, genai_client, entry.name)
+
+    def split(self, key: tuple, config, contents: list) -> tuple:
+        """``(chat_config, cached, history)`` for a new chat: the ``cached`` prefix by reference, ``history`` verbatim."""
+        entry = self._entries.get(key)
+        if entry is None or contents[:len(entry.contents)] != entry.contents:
+            return config, [], contents
+        # The instruction and tools live in the cache; the API rejects them next to it
+        chat_config = config.model_copy(update={
+            "cached_content": entry.name,
+            "system_instruction": None,
+            "tools": None,
+            "tool_config": None,
+        })
+        return chat_config, entry.contents, contents[len(entry.contents):]
+
+    def discard(self, genai_client, model_name: str):
+        """Stop using a tier's caches, for every tool profile (e.g. after a request said one is gone)."""
+        for key in [key for key in self._entries if key[0] == model_name]:
+            self._drop(genai_client, key)
+
+    def release(self):
+        """Forget every cache (and the contents kept to compare against) without deleting it.
+
+        For conversations idle long enough that their caches have expired or soon
+        will (``CACHE_TTL_SECONDS``); nothing renews them once they're forgotten.
+        """
+        self._entries.clear()
+        self._pending.clear()
+        self._renewing.clear()
+
+    def clear(self, genai_client):
+        """Delete every cache this conversation made, including ones still being created."""
+        for key in list(self._entries):
+            self._drop(genai_client, key)
+        for _, future in self._pending.values():
+            future.add_done_callback(partial(_delete_created, genai_client))
+        self._pending.clear()
+
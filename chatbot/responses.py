@@ -0,0 +1,107 @@
+"""Turning Gemini responses into the markdown shown in the chat."""
+import re
+
+FALLBACK_REPLY = "I apologize, but I couldn't generate a proper response. Please try again."
+
+
+def wrap_code_blocks(text):
+    """Process code blocks for Streamlit display - keep markdown formatting intact."""
+    if not isinstance(text, str):
+        text = str(text) if text is not None else ""
+    
+    # Keep markdown code blocks intact for Streamlit's native rendering
+    # Streamlit automatically handles ```language and ``` code blocks
+    # We just need to ensure proper formatting
+    
+    # Clean up any malformed code blocks and ensure proper spacing
+    text = re.sub(r"```(\w*)\s*\n", r"```\1\n", text)  # Clean language specifier
+    text = re.sub(r"```\s*$", "```", text, flags=re.MULTILINE)  # Clean closing tags
+    
+    return text
+
+
+def close_open_code_fence(text: str) -> str:
+    """Temporarily close a code block that is still being streamed."""
+    fences = sum(1 for line in text.splitlines() if line.lstrip().startswith("```"))
+    if fences % 2 == 1:
+        return text + "\n```"
+    return text
+
+
+def _reply_parts(response) -> tuple:
+    """The first candidate and its content parts (empty when the response has none)."""
+    candidates = getattr(response, "candidates", None)
+    if not candidates:
+        return None, ()
+    candidate = candidates[0]
+    content = getattr(candidate, "content", None)
+    return candidate, (getattr(content, "parts", None) or ())
+
+
+def response_text(response) -> str:
+    """Just the answer text of a response or streamed chunk (no code, output or thoughts)."""
+    _, parts = _reply_parts(response)
+    return "".join(part.text for part in parts if part.text and not getattr(part, "thought", None))
+
+
+def citation_uris(grounding_metadata) -> tuple:
+    """``((number, uri), ...)`` for the web sources in grounding metadata, numbered like the chunks."""
+    if not grounding_metadata:
+        return ()
+    supports = getattr(grounding_metadata, "grounding_supports", None)
+    chunks = getattr(grounding_metadata, "grounding_chunks", None)
+    if not supports or not chunks:
+        return ()
+    return tuple(
+        (i + 1, chunk.web.uri)
+        for i, chunk in enumerate(chunks)
+        if getattr(chunk, "web", None) and getattr(chunk.web, "uri", None)
+    )
+
+
+class ReplyParser:
+    """Splits a reply into text, executed code, execution output and citations.
+
+    ``feed`` walks each response (or streamed chunk) once, sorting every part into
+    its own field instead of gluing everything into one string. ``usage`` is the
+    latest usage metadata seen (token counts, including cached input tokens).
+    """
+
+    __slots__ = ("_text", "code", "output", "citations", "usage")
+
+    def __init__(self):
+        self._text = []
+        self.code = []
+        self.output = []
+        self.citations = ()
+        self.usage = None
+
+    def feed(self, response) -> str:
+        """Take in one response or chunk; returns the new answer text it carried."""
+        candidate, parts = _reply_parts(response)
+        self.usage = getattr(response, "usage_metadata", None) or self.usage
+        new_text = []
+        for part in parts:
+            if part.text:
+                if not getattr(part, "thought", None):
+                    new_text.append(part.text)
+            elif part.executable_code and part.executable_code.code:
+                self.code.append(part.executable_code.code)
+            elif part.code_execution_result and part.code_execution_result.output:
+                self.output.append(part.code_execution_result.output)
+        if candidate is not None:
+            # Grounding metadata usually comes with the last chunk
+            self.citations = citation_uris(getattr(candidate, "grounding_metadata", None)) or self.citations
+        text = "".join(new_text)
+        if text:
+            self._text.append(text)
+        return text
+
+    @property
+    def text(self) -> str:
+        return "".join(self._text)
+
+    @property
+    def ok(self) -> bool:
+        """Whether the model actually produced an answer."""
+        return bool(self.text.strip() or self.code or self.output)
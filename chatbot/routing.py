@@ -0,0 +1,442 @@
+"""Complexity-based model routing, computed once per turn."""
+import json
+import logging
+import os
+import random
+import re
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # Imported where configs are built: the SDK is slow to import and the app
+    # reads this module's constants before an API key is entered
+    from google.genai import types
+
+# === Model Routing Constants ===
+MODEL_MEDIUM_TIER_THRESHOLD = 5  # Threshold for gemini-2.5-flash
+MODEL_TOP_TIER_THRESHOLD = 10    # Threshold for gemini-2.5-pro
+TOKEN_THRESHOLD_PRO = 3000       # Token threshold for using pro model
+WEIGHT_SMALL = 2
+WEIGHT_MEDIUM = 3
+WEIGHT_HARD = 5
+
+# Tuned weights and thresholds (written by ``python -m chatbot.tuning``) replace the ones above
+ROUTING_PROFILE_PATH = os.environ.get("CHATBOT_ROUTING_PROFILE", "routing_profile.json")
+ROUTING_PROFILE_FORMAT = 1       # Layout version of routing profile files this code reads
+# Share of turns deliberately answered one tier cheaper than routed, so the tuner sees how
+# cheaper tiers do. Off by default: those answers may be worse, so opt in (e.g. 0.05) knowingly
+ROUTING_EXPLORATION_RATE = float(os.environ.get("CHATBOT_ROUTING_EXPLORATION", "0"))
+
+# Temperature settings for different models
+TEMPERATURE_PRO = 0.2            # Low temperature for consistent, accurate responses
+TEMPERATURE_FLASH = 0.7          # Balanced temperature for medium creativity
+TEMPERATURE_LITE = 1.0           # High temperature for creative, varied responses
+
+# Top-p (nucleus sampling) settings for different models
+TOP_P_PRO = 0.8                  # More focused sampling for consistency
+TOP_P_FLASH = 0.9                # Balanced sampling
+TOP_P_LITE = 0.95                # Broader sampling for creativity
+
+# Top-k settings for different models
+TOP_K_PRO = 20                   # Smaller vocabulary for more focused responses
+TOP_K_FLASH = 40                 # Balanced vocabulary size
+TOP_K_LITE = 64                  # Larger vocabulary for more varied responses
+
+# Model tiers from cheapest/fastest to most capable
+MODEL_LADDER = ("gemini-2.5-flash-lite", "gemini-2.5-flash", "gemini-2.5-pro")
+
+# (temperature, top_p, top_k, description) per model
+TIER_PARAMETERS = {
+    "gemini-2.5-pro": (TEMPERATURE_PRO, TOP_P_PRO, TOP_K_PRO, "focused & consistent"),
+    "gemini-2.5-flash": (TEMPERATURE_FLASH, TOP_P_FLASH, TOP_K_FLASH, "balanced"),
+    "gemini-2.5-flash-lite": (TEMPERATURE_LITE, TOP_P_LITE, TOP_K_LITE, "creative & varied"),
+}
+
+SYSTEM_INSTRUCTION = "You are a helpful assistant. Use Google Search if needed to ground your answers and cite sources with [number] where relevant. Use Code execution tool only for code-related queries and complex math, do not show internal tool in response if it being used"
+
+# Model routing keywords (plain, case-insensitive substrings)
+HARD_KEYWORDS = [
+    "derivative", "integral", "big-o", "bigo", "complexity", "algorithm", "algoritma", "mathematical",
+    "dynamic programming", "regex", "sql", "stack trace", "panic", "traceback", "recursion", "theorem", "bukti", "turunan", "induksi",
+    "np-sulit", "np sulit", "npsulit", "kompleksitas", "pemrograman dinamis", "jejak tumpukan", "jejak kesalahan", "jejak error", "jejak",
+    "teorema", "persamaan", "matematika", "logika", "berpikir keras", "pikir keras", "buktikan", "soal sulit",
+    "tantangan", "uji", "uji coba", "uji hipotesis", "prima", "prime"
+]
+MEDIUM_KEYWORDS = [
+    "apa itu", "jelaskan", "analisa", "penjelasan", "mengapa", "kenapa", "sulit", "tantangan", "perbaiki", "kesalahan",
+    "masalah", "solusi", "langkah", "cara", "bagaimana", "penyebab", "penyelesaian"
+]
+
+# === Tool Prediction ===
+# Tools attached to a chat for each tool profile. Grounded search and code execution
+# add latency and tokens, so turns that likely don't need them go without.
+TOOL_PROFILES = {
+    "none": (),
+    "search": ("search",),
+    "code": ("code",),
+    "full": ("code", "search"),
+}
+DEFAULT_TOOL_PROFILE = "full"    # Profile used when tool prediction is off
+
+# Prompts asking for fresh or verifiable facts (plain, case-insensitive substrings) -> Google Search
+SEARCH_KEYWORDS = [
+    "terbaru", "terkini", "latest", "newest", "recent", "hari ini", "today", "kemarin", "yesterday", "besok", "tomorrow",
+    "minggu ini", "this week", "bulan ini", "this month", "tahun ini", "this year", "sekarang", "saat ini", "currently",
+    "right now", "berita", "news", "harga", "price", "kurs", "exchange rate", "saham", "stock", "cuaca", "weather",
+    "jadwal", "schedule", "skor", "hasil pertandingan", "rilis", "release", "versi", "version", "siapa presiden",
+    "who is the president", "sumber", "source", "referensi", "reference", "cari di", "search for", "google",
+]
+# Prompts about running code, data or non-trivial math -> code execution
+CODE_KEYWORDS = [
+    "python", "kode", "code", "coding", "script", "program", "fungsi", "function", "jalankan", "eksekusi", "execute",
+    "hitung", "calculate", "compute", "simulasi", "simulate", "plot", "grafik", "chart", "csv", "dataframe", "pandas",
+    "numpy", "debug", "error", "traceback", "stack trace", "regex", "sql", "algoritma", "algorithm", "fibonacci",
+    "faktorial", "factorial", "prima", "prime", "integral", "turunan", "derivative", "persamaan", "equation", "matriks",
+    "matrix", "statistik", "statistic", "rata-rata", "average", "median", "standar deviasi", "probabilitas", "probability",
+    "konversi", "convert",
+]
+# What keywords can't express: (name, tool, regex)
+TOOL_PATTERNS = [
+    ("code block", "code", r"```|`[^`\n]+`|\b(?:def|import|return|print|console\.log)\b"),
+    ("arithmetic", "code", r"\d(?:\s*[+*/^×÷%]\s*\d|\s+-\s+\d|!|\s*%)|[√∫∑]|\b(?:sqrt|log|sin|cos|tan)\s*\("),
+    ("link", "search", r"https?://|www\.|\.(?:com|org|net|id|io|dev)\b"),
+    ("year", "search", r"\b(?:19|20)\d\d\b"),
+]
+# The patterns only read this many characters at each end of a long prompt (e.g. a pasted
+# log or file), where the question usually is; the keyword scan above still reads all of it
+TOOL_PATTERN_SCAN_CHARS = 4000
+
+
+def _trie_to_regex(node: dict) -> str:
+    """Serialize a character trie into a regex with shared prefixes factored out."""
+    branches = [re.escape(char) + _trie_to_regex(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ""
+    if len(branches) == 1 and "" not in node:
+        return branches[0]
+    group = "(?:" + "|".join(branches) + ")"
+    # Greedy "?" makes the longest keyword win at each position
+    return group + "?" if "" in node else group
+
+
+class KeywordMatcher:
+    """Count keyword hits for several tiers with a single scan of the text.
+
+    All keywords are deduplicated into one trie, compiled to a single regex that
+    reports the longest keyword starting at each position. Each tier then picks
+    its own leftmost-longest, non-overlapping matches from that one list, so a
+    word in two tiers (or a keyword inside a longer one) counts for both tiers.
+    Case-insensitive matching also accepts spans like "İntegral" or "ſql", whose
+    ``casefold()`` isn't the keyword; those are mapped back with the regex's own rules.
+    """
+
+    def __init__(self, tiers: dict):
+        self.tiers = tuple(tiers)
+        keywords = {kw.lower() for words in tiers.values() for kw in words}
+
+        trie = {}
+        for kw in keywords:
+            node = trie
+            for char in kw:
+                node = node.setdefault(char, {})
+            node[""] = {}
+        self.pattern = re.compile(f"(?=({_trie_to_regex(trie)}))", re.IGNORECASE)
+        self._by_length = {}
+        for kw in keywords:
+            self._by_length.setdefault(len(kw), []).append(kw)
+
+        # For every keyword: the longest keyword of each tier that is a prefix of it
+        tier_sets = {tier: {kw.lower() for kw in words} for tier, words in tiers.items()}
+        self._tier_hits = {}
+        for kw in keywords:
+            hits = {}
+            for tier, words in tier_sets.items():
+                prefixes = [kw[:i] for i in range(len(kw), 0, -1) if kw[:i] in words]
+                if prefixes:
+                    hits[tier] = prefixes[0]
+            self._tier_hits[kw.casefold()] = hits
+
+    def _hits(self, span: str) -> dict:
+        """``{tier: keyword}`` for a matched span."""
+        hits = self._tier_hits.get(span.casefold())
+        if hits is not None:
+            return hits
+        # A character the regex folds differently from str.casefold (e.g. "İ" -> "i")
+        for kw in self._by_length.get(len(span), ()):
+            if re.fullmatch(re.escape(kw), span, re.IGNORECASE):
+                return self._tier_hits.get(kw.casefold(), {})
+        return {}
+
+    def scan(self, text: str) -> dict:
+        """Return ``{tier: (matched keywords...)}`` in order of appearance."""
+        matches = {tier: [] for tier in self.tiers}
+        next_free = dict.fromkeys(self.tiers, 0)
+        for m in self.pattern.finditer(text):
+            start = m.start()
+            for tier, kw in self._hits(m.group(1)).items():
+                if start >= next_free[tier]:
+                    matches[tier].append(kw)
+                    next_free[tier] = start + len(kw)
+        return {tier: tuple(found) for tier, found in matches.items()}
+
+
+# Compiled once per process; the tool keyword lists share the routing scan
+KEYWORD_MATCHER = KeywordMatcher({
+    "hard": HARD_KEYWORDS, "medium": MEDIUM_KEYWORDS, "search": SEARCH_KEYWORDS, "code": CODE_KEYWORDS,
+})
+# One regex per pattern: the first match is all prediction needs
+TOOL_REGEXES = [(name, tool, re.compile(pattern, re.IGNORECASE)) for name, tool, pattern in TOOL_PATTERNS]
+
+
+@dataclass(frozen=True)
+class RoutingProfile:
+    """Scoring weights and tier thresholds for ``route``; the defaults are the constants above.
+
+    ``version`` names the profile in the turn log and the sidebar, so every turn
+    can be traced back to the weights it was routed with.
+    """
+    weight_small: int = WEIGHT_SMALL
+    weight_medium: int = WEIGHT_MEDIUM
+    weight_hard: int = WEIGHT_HARD
+    medium_tier_threshold: int = MODEL_MEDIUM_TIER_THRESHOLD
+    top_tier_threshold: int = MODEL_TOP_TIER_THRESHOLD
+    token_threshold_pro: int = TOKEN_THRESHOLD_PRO
+    version: str = "default"
+
+    def to_json(self, **extra) -> dict:
+        """The profile file's contents; ``extra`` adds fields such as how it was tuned."""
+        return {
+            "format": ROUTING_PROFILE_FORMAT,
+            "version": self.version,
+            "weights": {"small": self.weight_small, "medium": self.weight_medium, "hard": self.weight_hard},
+            "thresholds": {"medium_tier": self.medium_tier_threshold, "top_tier": self.top_tier_threshold,
+                           "token_pro": self.token_threshold_pro},
+            **extra,
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> "RoutingProfile":
+        """Read a profile file's contents; raises ``ValueError`` for files this code can't use."""
+        if data.get("format") != ROUTING_PROFILE_FORMAT:
+            raise ValueError(f"unsupported routing profile format {data.get('format')!r}")
+        weights, thresholds = data["weights"], data["thresholds"]
+        profile = cls(
+            weight_small=int(weights["small"]),
+            weight_medium=int(weights["medium"]),
+            weight_hard=int(weights["hard"]),
+            medium_tier_threshold=int(thresholds["medium_tier"]),
+            top_tier_threshold=int(thresholds["top_tier"]),
+            token_threshold_pro=int(thresholds["token_pro"]),
+            version=str(data["version"]),
+        )
+        if min(profile.weight_small, profile.weight_medium, profile.weight_hard) < 0:
+            raise ValueError("routing weights can't be negative")
+        if not 0 < profile.medium_tier_threshold < profile.top_tier_threshold:
+            raise ValueError("routing thresholds must satisfy 0 < medium_tier < top_tier")
+        return profile
+
+
+DEFAULT_ROUTING_PROFILE = RoutingProfile()
+
+
+def load_routing_profile(path: str = ROUTING_PROFILE_PATH) -> RoutingProfile:
+    """The routing profile at ``path``, or the defaults if there is none or it can't be used."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return RoutingProfile.from_json(json.load(f))
+    except FileNotFoundError:
+        return DEFAULT_ROUTING_PROFILE
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        logging.getLogger(__name__).warning("Ignoring routing profile %s, using the defaults: %s", path, e)
+        return DEFAULT_ROUTING_PROFILE
+
+
+@dataclass(frozen=True)
+class RoutingDecision:
+    """Everything the UI needs to know about how a turn was routed."""
+    score: int
+    hard_matches: tuple
+    medium_matches: tuple
+    question_marks: int
+    token_count: int
+    model: str
+    config: "types.GenerateContentConfig"
+    routed_model: str = None      # Tier the score asked for, when a cheaper one was picked instead
+    downgrade_reason: str = None  # Why the cheaper tier was picked
+    tool_profile: str = DEFAULT_TOOL_PROFILE  # Key of TOOL_PROFILES attached to the chat
+    tool_reasons: tuple = ()                   # Prompt features that asked for each tool, e.g. "search: terbaru"
+
+    @property
+    def parameters_summary(self) -> str:
+        """Human readable sampling parameters, e.g. for the thinking display."""
+        temperature, top_p, top_k, description = TIER_PARAMETERS[self.model]
+        return f"Temperature={temperature}, Top-p={top_p}, Top-k={top_k} ({description})"
+
+    @property
+    def tools_summary(self) -> str:
+        """Human readable attached tools and why, e.g. for the thinking display."""
+        names = {"code": "Code execution", "search": "Google Search"}
+        tools = " + ".join(names[tool] for tool in TOOL_PROFILES[self.tool_profile]) or "None"
+        return f"{tools} ({', '.join(self.tool_reasons)})" if self.tool_reasons else tools
+
+
+@lru_cache(maxsize=None)
+def build_generation_config(model_name: str, tool_profile: str = DEFAULT_TOOL_PROFILE) -> "types.GenerateContentConfig":
+    """Tools and sampling parameters for a model tier and tool profile.
+
+    Built once per process for each (model, tool profile) and shared by every
+    turn and session, so treat the returned config as read-only.
+    """
+    from google.genai import types
+
+    # Different models support different tools
+    tools = []
+
+    # Code execution and search tools support varies by model
+    if model_name in MODEL_LADDER:
+        enabled = TOOL_PROFILES[tool_profile]
+        if "code" in enabled:
+            tools.append(types.Tool(code_execution=types.ToolCodeExecution))
+        if "search" in enabled:
+            tools.append(types.Tool(google_search=types.GoogleSearch()))
+    # For experimental models or others, use no tools or adjust as needed
+
+    # Set generation parameters based on model for different creativity/consistency levels
+    temperature, top_p, top_k, _ = TIER_PARAMETERS.get(model_name, TIER_PARAMETERS["gemini-2.5-flash-lite"])
+
+    return types.GenerateContentConfig(
+        tools=tools,
+        temperature=temperature,
+        top_p=top_p,
+        top_k=top_k,
+        system_instruction=SYSTEM_INSTRUCTION
+    )
+
+
+def predict_tool_profile(content: str, found: dict = None) -> tuple:
+    """``(tool_profile, reasons)`` for a prompt: which tools it likely needs and what gave it away.
+
+    ``found`` is the prompt's ``KEYWORD_MATCHER.scan`` result, if it was already scanned.
+    """
+    found = found or KEYWORD_MATCHER.scan(content)
+    reasons = [f"search: {kw}" for kw in found["search"]] + [f"code: {kw}" for kw in found["code"]]
+    needed = {"search"} if found["search"] else set()
+    if found["code"]:
+        needed.add("code")
+    if len(content) > 2 * TOOL_PATTERN_SCAN_CHARS:
+        windows = (content[:TOOL_PATTERN_SCAN_CHARS], content[-TOOL_PATTERN_SCAN_CHARS:])
+    else:
+        windows = (content,)
+    for name, tool, regex in TOOL_REGEXES:
+        if any(regex.search(window) for window in windows):
+            needed.add(tool)
+            reasons.append(f"{tool}: {name}")
+    profile = next(name for name, tools in TOOL_PROFILES.items() if set(tools) == needed)
+    return profile, tuple(dict.fromkeys(reasons))
+
+
+def route(content: str, token_count: int, predict_tools: bool = True, profile: RoutingProfile = None) -> RoutingDecision:
+    """Score the prompt once and pick a model tier, its tool profile and generation config.
+
+    With ``predict_tools`` off every turn gets ``DEFAULT_TOOL_PROFILE`` (all tools).
+    ``profile`` holds the weights and thresholds (default: the constants above).
+    """
+    profile = profile or DEFAULT_ROUTING_PROFILE
+    found = KEYWORD_MATCHER.scan(content)
+    tool_profile, tool_reasons = predict_tool_profile(content, found) if predict_tools else (DEFAULT_TOOL_PROFILE, ())
+    question_marks = content.count('?')
+
+    score = 1  # Start with a base score of 1
+    # Hard keywords: +5 each, medium keywords: +3 each, question marks: +2 each (by default)
+    score += profile.weight_hard * len(found["hard"])
+    score += profile.weight_medium * len(found["medium"])
+    score += profile.weight_small * question_marks
+
+    # Enhanced model selection with token consideration:
+    # 1. gemini-2.5-pro: For really hard problems OR long conversations
+    # 2. gemini-2.5-flash: For medium complexity
+    # 3. gemini-2.5-flash-lite: For simple queries and short conversations
+    if score >= profile.top_tier_threshold or token_count > profile.token_threshold_pro:
+        model = "gemini-2.5-pro"        # Most capable model for complex/long contexts
+    elif score >= profile.medium_tier_threshold:
+        model = "gemini-2.5-flash"      # Balanced model for medium complexity
+    else:
+        model = "gemini-2.5-flash-lite"  # Fastest model for simple queries
+
+    return RoutingDecision(
+        score=score,
+        hard_matches=found["hard"],
+        medium_matches=found["medium"],
+        question_marks=question_marks,
+        token_count=token_count,
+        model=model,
+        config=build_generation_config(model, tool_profile),
+        tool_profile=tool_profile,
+        tool_reasons=tool_reasons,
+    )
+
+
+def select_model(content: str, token_count: int) -> str:
+    """Select Gemini model based on weighted content complexity and token count."""
+    return route(content, token_count).model
+
+
+def cheaper_tier(model_name: str):
+    """The next cheaper (and faster) model on the ladder, or ``None`` at the bottom."""
+    index = MODEL_LADDER.index(model_name) if model_name in MODEL_LADDER else 0
+    return MODEL_LADDER[index - 1] if index > 0 else None
+
+
+def _step_down(decision: RoutingDecision, unfit, reason: str) -> RoutingDecision:
+    """Move down the ladder while ``unfit(model)`` holds (stopping at the cheapest tier)."""
+    model = decision.model
+    while unfit(model) and cheaper_tier(model):
+        model = cheaper_tier(model)
+    if model == decision.model:
+        return decision
+    return replace(
+        decision,
+        model=model,
+        config=build_generation_config(model, decision.tool_profile),
+        routed_model=decision.routed_model or decision.model,
+        downgrade_reason=reason.format(model=decision.model),
+    )
+
+
+def fit_latency_budget(decision: RoutingDecision, budget: float, expected_latency: dict) -> RoutingDecision:
+    """Step down the ladder until a tier's observed latency fits ``budget`` (seconds).
+
+    ``expected_latency`` maps model name -> observed first-token latency; tiers
+    without history are assumed to fit. The cheapest tier is used if none fits.
+    """
+    return _step_down(
+        decision,
+        lambda model: expected_latency.get(model, 0.0) > budget,
+        f"{{model}} has recently been slower than the {budget:.1f}s latency budget",
+    )
+
+
+def avoid_busy_tiers(decision: RoutingDecision, queue_depths: dict, max_depth: int) -> RoutingDecision:
+    """Step down the ladder past tiers with ``max_depth`` or more requests already queued."""
+    return _step_down(
+        decision,
+        lambda model: queue_depths.get(model, 0) >= max_depth,
+        f"{{model}} has {max_depth}+ requests queued",
+    )
+
+
+def explore_cheaper_tier(decision: RoutingDecision, rate: float = ROUTING_EXPLORATION_RATE, rng=random) -> RoutingDecision:
+    """With probability ``rate``, answer with the next cheaper tier instead.
+
+    The turn log only shows how a tier does on the prompts it was routed, so
+    without these turns ``python -m chatbot.tuning`` could never learn that a
+    cheaper tier is good enough for some of them.
+    """
+    if rate <= 0 or rng.random() >= rate:
+        return decision
+    return _step_down(
+        decision,
+        lambda model: model == decision.model,
+        "trying a cheaper tier than {model} for routing tuning",
+    )
@@ -0,0 +1,201 @@
+"""Process-wide request scheduler: per-model rate limits, fair queuing and retries."""
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+# model -> (requests per minute, tokens per minute); set these to your project's quota
+MODEL_RATE_LIMITS = {
+    "gemini-2.5-flash-lite": (4000, 4_000_000),
+    "gemini-2.5-flash": (1000, 1_000_000),
+    "gemini-2.5-pro": (150, 2_000_000),
+}
+DEFAULT_RATE_LIMIT = (60, 1_000_000)  # For models missing from MODEL_RATE_LIMITS
+MAX_RETRIES = 3                       # Extra attempts after a 429 / 503
+RETRY_BASE_DELAY = 1.0                # Seconds; backoff doubles per retry, with full jitter
+RETRY_MAX_DELAY = 20.0                # Cap on a single backoff sleep
+MAX_QUEUE_WAIT = 120.0                # Give up after waiting this long for a slot
+DOWNGRADE_QUEUE_DEPTH = 5             # Queued requests at which "downgrade when busy" skips a tier
+WAIT_HISTORY = 200                    # Recent queue waits kept per model for the UI
+RETRYABLE_CODES = (429, 503)
+RETRYABLE_MARKERS = ("429", "503", "RESOURCE_EXHAUSTED", "UNAVAILABLE")
+
+
+class QueueTimeout(RuntimeError):
+    """Raised when a request waited longer than ``max_wait`` for its model's rate limits."""
+
+
+def is_retryable(error: Exception) -> bool:
+    """Quota (429) and overload (503) errors are worth retrying; anything else is not."""
+    if getattr(error, "code", None) in RETRYABLE_CODES:
+        return True
+    message = str(error)
+    return any(marker in message for marker in RETRYABLE_MARKERS)
+
+
+def open_stream(response_stream):
+    """Start a lazy response stream so connection errors are raised now (and can be retried)."""
+    iterator = iter(response_stream)
+    first = next(iterator, None)
+    return _resume_stream(first, iterator)
+
+
+def _resume_stream(first, iterator):
+    # Closing this generator also closes the underlying stream
+    try:
+        if first is not None:
+            yield first
+        yield from iterator
+    finally:
+        getattr(iterator, "close", lambda: None)()
+
+
+class TokenBucket:
+    """Refills continuously at ``per_minute / 60`` per second, up to one minute's worth."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until ``amount`` can be taken (0 if it can be taken now)."""
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self.level -= amount
+
+
+class _ModelQueue:
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.sessions = OrderedDict()  # session id -> deque of waiting tickets, served round-robin
+        self.depth = 0
+        self.waits = deque(maxlen=WAIT_HISTORY)
+        self.retries = 0
+
+
+class _Ticket:
+    __slots__ = ("tokens", "granted")
+
+    def __init__(self, tokens: float):
+        self.tokens = tokens
+        self.granted = False
+
+
+class RequestScheduler:
+    """Shares each model's request and token quota between every session in the process.
+
+    Each model has two token buckets (requests/min and tokens/min). Waiting
+    requests are queued per session and sessions take turns, so one busy user
+    can't starve the others. There is no background thread: whichever waiting
+    thread wakes up hands out the slots that have become available. Safe to call
+    from any thread.
+    """
+
+    def __init__(self, limits: dict = None, max_retries: int = MAX_RETRIES, max_wait: float = MAX_QUEUE_WAIT):
+        self.limits = dict(MODEL_RATE_LIMITS if limits is None else limits)
+        self.max_retries = max_retries
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._queues = {}  # model name -> _ModelQueue
+
+    def _queue(self, model: str) -> _ModelQueue:
+        # Caller holds the lock
+        if model not in self._queues:
+            self._queues[model] = _ModelQueue(*self.limits.get(model, DEFAULT_RATE_LIMIT))
+        return self._queues[model]
+
+    def _dispatch(self, queue: _ModelQueue, now: float):
+        """Grant tickets in round-robin order while both buckets allow; returns the delay until the next grant."""
+        # Caller holds the lock
+        while queue.sessions:
+            session_id, tickets = next(iter(queue.sessions.items()))
+            ticket = tickets[0]
+            delay = max(queue.requests.wait_time(1, now), queue.tokens.wait_time(ticket.tokens, now))
+            if delay > 0:
+                return delay
+            queue.requests.take(1)
+            queue.tokens.take(ticket.tokens)
+            ticket.granted = True
+            tickets.popleft()
+            # This session goes to the back of the line
+            del queue.sessions[session_id]
+            if tickets:
+                queue.sessions[session_id] = tickets
+            self._cond.notify_all()
+        return None
+
+    def acquire(self, model: str, session_id: str, tokens: int) -> float:
+        """Block until ``model`` has room for one request of ``tokens``; returns the seconds waited."""
+        started = time.monotonic()
+        with self._cond:
+            queue = self._queue(model)
+            # A request larger than a whole minute's budget would never fit otherwise
+            ticket = _Ticket(min(max(1, tokens), queue.tokens.capacity))
+            queue.sessions.setdefault(session_id, deque()).append(ticket)
+            queue.depth += 1
+            try:
+                while True:
+                    delay = self._dispatch(queue, time.monotonic())
+                    if ticket.granted:
+                        break
+                    remaining = self.max_wait - (time.monotonic() - started)
+                    if remaining <= 0:
+                        tickets = queue.sessions[session_id]
+                        tickets.remove(ticket)
+                        if not tickets:
+                            del queue.sessions[session_id]
+                        raise QueueTimeout(f"Waited over {self.max_wait:.0f}s for {model}'s rate limit")
+                    self._cond.wait(timeout=min(delay or remaining, remaining))
+            finally:
+                queue.depth -= 1
+            waited = time.monotonic() - started
+            queue.waits.append(waited)
+            return waited
+
+    def call(self, model: str, session_id: str, tokens: int, send):
+        """Run ``send()`` once a slot is free, retrying 429 / 503 errors with jittered backoff.
+
+        Every attempt takes its own slot. Returns ``(result, waited, retries)`` where
+        ``waited`` is the total time spent queued and backing off.
+        """
+        waited = 0.0
+        retries = 0
+        while True:
+            waited += self.acquire(model, session_id, tokens)
+            try:
+                return send(), waited, retries
+            except Exception as e:
+                if retries >= self.max_retries or not is_retryable(e):
+                    raise
+                retries += 1
+                with self._cond:
+                    self._queue(model).retries += 1
+                backoff = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** retries))
+                time.sleep(backoff)
+                waited += backoff
+
+    def queue_depths(self) -> dict:
+        """Requests currently waiting, per model."""
+        with self._cond:
+            return {model: queue.depth for model, queue in self._queues.items()}
+
+    def stats(self) -> list:
+        """Rows of ``{"model", "queued", "avg_wait_ms", "max_wait_ms", "retries"}`` for models used so far."""
+        with self._cond:
+            rows = []
+            for model, queue in sorted(self._queues.items()):
+                waits = list(queue.waits)
+                rows.append({
+                    "model": model,
+                    "queued": queue.depth,
+                    "avg_wait_ms": round(sum(waits) / len(waits) * 1e3, 1) if waits else 0.0,
+                    "max_wait_ms": round(max(waits) * 1e3, 1) if waits else 0.0,
+                    "retries": queue.retries,
+                })
+            return rows
@@ -0,0 +1,128 @@
+"""Per-tier chat sessions kept in sync with the shared message history."""
+from google.genai import types
+
+from chatbot.context import summary_contents
+from chatbot.prefix_cache import PrefixCache
+from chatbot.routing import DEFAULT_TOOL_PROFILE
+
+MAX_CHAT_HISTORY = 100  # Safety cap on contents per chat session (token budgets do the real trimming)
+
+
+def to_content(msg) -> types.Content:
+    """Convert a stored ``Message`` into a structured chat turn (its text only)."""
+    role = "model" if msg.role == "assistant" else "user"
+    # A reply made only of code / output has no text; send its markdown instead of an empty part
+    return types.Content(role=role, parts=[types.Part(text=msg.text or msg.content)])
+
+
+def trim_history(history: list, max_turns: int) -> list:
+    """Keep the newest ``max_turns`` contents, starting on a user turn."""
+    history = history[-max_turns:]
+    while history and history[0].role != "user":
+        history = history[1:]
+    return history
+
+
+class ChatSessionPool:
+    """One live chat per model tier and tool profile, each remembering how far it has seen the history.
+
+    The Gemini API is stateless, so a chat re-sends its own history on every turn.
+    Keeping a chat per tier means switching back to a tier only appends the turns it
+    missed, as structured contents, instead of replaying the whole transcript as one
+    flattened string. When older turns are folded into a summary, the chat is
+    rebuilt once from that summary plus the verbatim turns. Each chat's history is
+    capped at ``max_turns`` contents as a safety net. A tier's chats for different
+    tool profiles (``chatbot.routing.TOOL_PROFILES``) are separate, since a chat's
+    tools are fixed when it's created.
+
+    With a ``prefix_cache``, the start of each chat's history (and the system
+    instruction) is kept in Gemini's cached-content store and the chat only sends
+    what comes after it; the chat is rebuilt whenever that cached prefix changes.
+    """
+
+    def __init__(self, max_turns: int, prefix_cache: PrefixCache = None):
+        self.max_turns = max_turns
+        self.prefix_cache = prefix_cache
+        # Keyed by (model name, tool profile)
+        self._chats = {}   # key -> chat session
+        self._seen = {}    # key -> number of shared messages the chat has seen
+        self._base = {}    # key -> (first verbatim message, summary) it was built on
+        self._prefix = {}  # key -> contents held by the chat's cached prefix
+
+    def __contains__(self, model_name: str):
+        return any(model == model_name for model, _ in self._chats)
+
+    def get(self, genai_client, model_name: str, config, history: list, start: int = 0, summary: str = None,
+            tool_profile: str = DEFAULT_TOOL_PROFILE):
+        """Return ``(chat, synced_turns)`` for a tier and tool profile, catching it up with ``history``.
+
+        ``config`` must carry that profile's tools. ``history`` is the shared message
+        list *without* the message about to be sent. Messages before ``start`` are
+        represented by ``summary`` instead of verbatim. ``synced_turns`` is how many
+        missed messages had to be added to the chat.
+        """
+        key = (model_name, tool_profile)
+        chat = self._chats.get(key)
+        seen = self._seen.get(key, 0)
+        if chat is None or seen > len(history) or self._base.get(key, (0, None)) != (start, summary):
+            # No chat yet (or it was released), the shared history was reset or older
+            # turns were folded into a new summary
+            chat, seen = None, start
+
+        # Failed turns never made it into any chat's history, so don't replay them
+        missing = [msg for msg in history[max(seen, start):] if not msg.failed]
+        if chat is not None:
+            current = self._prefix.get(key, []) + chat.get_history(curated=True)
+        else:
+            current = summary_contents(summary)
+
+        rebuild = chat is None or missing or len(current) > self.max_turns
+        contents = trim_history(current + [to_content(msg) for msg in missing], self.max_turns) if rebuild else current
+        if self.prefix_cache is not None and self.prefix_cache.update(genai_client, key, config, contents):
+            rebuild = True
+
+        if rebuild:
+            # Creating a chat is local (no request), so rebuilding it is cheap
+            chat_config, cached, chat_history = config, [], contents
+            if self.prefix_cache is not None:
+                chat_config, cached, chat_history = self.prefix_cache.split(key, config, contents)
+            self._prefix[key] = cached
+            chat = genai_client.chats.create(model=model_name, config=chat_config, history=chat_history)
+            self._chats[key] = chat
+            self._base[key] = (start, summary)
+
+        self._seen[key] = len(history)
+        return chat, len(missing)
+
+    def mark_synced(self, model_name: str, message_count: int, tool_profile: str = DEFAULT_TOOL_PROFILE):
+        """Record that a tier's chat now holds the first ``message_count`` messages."""
+        key = (model_name, tool_profile)
+        if key in self._chats:
+            self._seen[key] = message_count
+
+    def discard(self, model_name: str, tool_profile: str = None):
+        """Forget a tier's chat (e.g. after its request was cancelled); it's rebuilt on next use.
+
+        Without a ``tool_profile`` the tier's chats for every profile are forgotten.
+        """
+        for key in [key for key in self._chats if key[0] == model_name and tool_profile in (None, key[1])]:
+            self._chats.pop(key, None)
+            self._seen.pop(key, None)
+            self._base.pop(key, None)
+            self._prefix.pop(key, None)
+
+    def contents(self) -> list:
+        """Each live chat's contents (its cached prefix included), e.g. for memory accounting."""
+        return [self._prefix.get(key, []) + chat.get_history() for key, chat in list(self._chats.items())]
+
+    def release(self):
+        """Drop every live chat to free memory; each is rebuilt from the shared history on next use.
+
+        The prefix cache forgets its caches without deleting them (see ``PrefixCache.release``).
+        """
+        self._chats.clear()
+        self._seen.clear()
+        self._base.clear()
+        self._prefix.clear()
+        if self.prefix_cache is not None:
+            self.prefix_cache.release()
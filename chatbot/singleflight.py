@@ -0,0 +1,197 @@
+"""Single-flight coalescing: identical requests in flight at once share one upstream call."""
+import hashlib
+import threading
+
+from chatbot.cache import context_fingerprint, normalize_prompt
+
+
+def generation_key(model: str, config, prompt: str, history: list, summary: str = None) -> str:
+    """Flight key for sending ``prompt`` to ``model`` with ``config`` after ``summary`` and ``history``.
+
+    ``history`` is the part of the conversation the model gets verbatim, after
+    the ``summary`` of older turns (if any). A follower gets the leader's reply
+    as is, so the model must have been sent exactly the same context.
+    """
+    raw = "\x00".join((
+        "generate", model, config.model_dump_json(exclude_none=True) if config is not None else "",
+        normalize_prompt(prompt), summary or "", context_fingerprint(history),
+    ))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def count_tokens_key(model: str, text: str) -> str:
+    """Flight key for an exact token count of ``text`` (not normalized: case changes the count)."""
+    return hashlib.sha256(f"count_tokens\x00{model}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    """One upstream call and everyone waiting on it."""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.cond = threading.Condition()
+        self.opened = False     # The leader's stream started (or its call returned)
+        self.done = False
+        self.abandoned = False  # The leader was interrupted before it got an answer
+        self.listeners = 0      # Callers that joined and haven't stopped reading yet
+        self.closed = False     # Everyone stopped reading the stream, so it's closed early
+        self.result = None
+        self.error = None
+        self.chunks = []        # Streamed chunks so far, replayed to every follower
+
+
+class SingleFlight:
+    """Lets identical concurrent requests from different sessions share one upstream call.
+
+    The first caller for a key (the leader) makes the call; callers that arrive
+    while it's in flight (followers) wait for it and get the same result or
+    error. Streams are read by a background thread into a buffer that each
+    caller replays from the first chunk, so a follower that joins late still
+    gets the whole answer and nobody slows anyone else down. That thread keeps
+    reading while anyone still listens, even if the leader has stopped; once the
+    last caller closes its stream (e.g. a cancelled hedge lane), the upstream
+    stream is closed at its next chunk. If the leader is interrupted before its
+    call returns (e.g. a Streamlit rerun), its followers make their own calls.
+    A key is only shared while its call is in flight; finished answers are the
+    response cache's job. Safe to share between threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}  # key -> _Flight
+        self._counts = {}   # kind -> [calls, coalesced]
+
+    def _join(self, kind: str, key: str) -> tuple:
+        """``(flight, leader)``: the key's flight, started by this caller if ``leader``."""
+        with self._lock:
+            counts = self._counts.setdefault(kind, [0, 0])
+            counts[0] += 1
+            flight = self._flights.get(key)
+            if flight is not None:
+                counts[1] += 1
+                flight.listeners += 1
+                return flight, False
+            flight = self._flights[key] = _Flight(kind)
+            flight.listeners = 1
+            return flight, True
+
+    def _detach(self, key: str, flight: _Flight):
+        """A caller stopped reading ``flight``'s stream; close it early if nobody else reads it."""
+        with self._lock:
+            flight.listeners -= 1
+            if flight.listeners > 0 or flight.done:
+                return
+            # Later callers with the same key start a new call instead of joining one being closed
+            flight.closed = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def _land(self, key: str, flight: _Flight, result=None, error: Exception = None, abandoned: bool = False):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        with flight.cond:
+            flight.result, flight.error, flight.abandoned = result, error, abandoned
+            flight.opened = flight.done = True
+            flight.cond.notify_all()
+
+    def _wait(self, flight: _Flight, until):
+        with flight.cond:
+            flight.cond.wait_for(until)
+
+    def do(self, kind: str, key: str, call) -> tuple:
+        """Run ``call()`` unless the same ``key`` is already in flight; returns ``(result, shared)``."""
+        flight, leader = self._join(kind, key)
+        if leader:
+            try:
+                result = call()
+            except Exception as e:
+                self._land(key, flight, error=e)
+                raise
+            except BaseException:
+                self._land(key, flight, abandoned=True)
+                raise
+            self._land(key, flight, result=result)
+            return result, False
+
+        self._wait(flight, lambda: flight.done)
+        if flight.abandoned:
+            return call(), False
+        if flight.error is not None:
+            raise flight.error
+        return flight.result, True
+
+    def stream(self, kind: str, key: str, open_stream) -> tuple:
+        """Like ``do`` for a response stream: ``(chunks, shared)``, where ``open_stream()`` starts one.
+
+        Errors raised while opening the stream are raised here, to every caller.
+        """
+        flight, leader = self._join(kind, key)
+        if leader:
+            try:
+                upstream = open_stream()
+            except Exception as e:
+                self._land(key, flight, error=e)
+                raise
+            except BaseException:
+                self._land(key, flight, abandoned=True)
+                raise
+            with flight.cond:
+                flight.opened = True
+                flight.cond.notify_all()
+            threading.Thread(target=self._pump, args=(key, flight, upstream), name="single-flight", daemon=True).start()
+            return self._replay(key, flight), False
+
+        self._wait(flight, lambda: flight.opened)
+        if flight.abandoned:
+            self._detach(key, flight)
+            return open_stream(), False
+        if flight.error is not None and not flight.chunks:
+            self._detach(key, flight)
+            raise flight.error
+        return self._replay(key, flight), True
+
+    def _pump(self, key: str, flight: _Flight, upstream):
+        error = None
+        try:
+            for chunk in upstream:
+                if flight.closed:
+                    # Nobody reads this stream any more; the SDK stops at the close
+                    close = getattr(upstream, "close", None)
+                    if close is not None:
+                        close()
+                    break
+                with flight.cond:
+                    flight.chunks.append(chunk)
+                    flight.cond.notify_all()
+        except Exception as e:
+            error = e
+        self._land(key, flight, error=error)
+
+    def _replay(self, key: str, flight: _Flight):
+        index = 0
+        try:
+            while True:
+                with flight.cond:
+                    flight.cond.wait_for(lambda: index < len(flight.chunks) or flight.done)
+                    chunks = flight.chunks[index:]
+                    done, error = flight.done, flight.error
+                yield from chunks
+                index += len(chunks)
+                if done:
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            self._detach(key, flight)
+
+    def stats(self) -> list:
+        """Rows of ``{"kind", "calls", "coalesced", "in_flight"}`` for kinds used so far."""
+        with self._lock:
+            in_flight = {}
+            for flight in self._flights.values():
+                in_flight[flight.kind] = in_flight.get(flight.kind, 0) + 1
+            return [
+                {"kind": kind, "calls": calls, "coalesced": coalesced, "in_flight": in_flight.get(kind, 0)}
+                for kind, (calls, coalesced) in sorted(self._counts.items())
+            ]
@@ -0,0 +1,102 @@
+"""Offline token estimation for routing and the conversation stats."""
+import re
+
+# Gemini's SentencePiece vocabulary keeps most short words whole, splits long
+# words into ~4-5 character pieces and gives every digit and symbol its own token.
+CHARS_PER_WORD_TOKEN = 4.5       # Average characters per token inside a word
+ROLE_OVERHEAD_TOKENS = 3         # "user: " / "assistant: " prefix plus newline
+CALIBRATION_SMOOTHING = 0.2      # Weight of each new remote sample in the scale
+COUNT_TOKENS_MODEL = "gemini-2.5-flash-lite"  # Tokenizer used for exact counts
+
+# Words, single digits, and single symbols (whitespace is free)
+_PIECE_PATTERN = re.compile(r"[^\W\d_]+|\d|[^\w\s]|_")
+
+
+class TokenEstimator:
+    """Approximate Gemini token counts locally, optionally calibrated by the API."""
+
+    def __init__(self, scale: float = 1.0):
+        self.scale = scale
+
+    def raw_estimate(self, text: str) -> int:
+        """Count tokens with the uncalibrated heuristic."""
+        tokens = 0
+        for piece in _PIECE_PATTERN.findall(text):
+            if len(piece) == 1:
+                tokens += 1
+            elif piece.isascii():
+                tokens += max(1, round(len(piece) / CHARS_PER_WORD_TOKEN))
+            else:
+                # Non-Latin scripts (CJK, Thai, ...) are close to one token per character
+                tokens += len(piece)
+        return tokens
+
+    def estimate(self, text: str) -> int:
+        """Estimated token count for a piece of text."""
+        if not text:
+            return 0
+        return max(1, round(self.raw_estimate(text) * self.scale))
+
+    def calibrate(self, estimated: int, actual: int):
+        """Nudge the scale towards an exact count returned by the API."""
+        if estimated <= 0 or actual <= 0:
+            return
+        ratio = self.scale * actual / estimated
+        self.scale += CALIBRATION_SMOOTHING * (ratio - self.scale)
+
+
+# Shared by every session in the process so calibration samples add up
+default_estimator = TokenEstimator()
+
+
+class TokenLedger:
+    """Cached per-message token counts with a running total for a conversation."""
+
+    def __init__(self, estimator: TokenEstimator = None):
+        self.estimator = estimator or default_estimator
+        self._counts = []
+        self._prefix = [0]  # _prefix[i] = tokens in the first i messages
+
+    def __len__(self):
+        return len(self._counts)
+
+    @property
+    def total(self) -> int:
+        return self._prefix[-1]
+
+    def append(self, role: str, content: str) -> int:
+        """Estimate one message once and add it to the running total."""
+        count = ROLE_OVERHEAD_TOKENS + self.estimator.estimate(content or "")
+        self._counts.append(count)
+        self._prefix.append(self._prefix[-1] + count)
+        return count
+
+    def sync(self, messages: list):
+        """Bring the ledger in line with a list of ``Message``s, estimating only new ones.
+
+        Only a message's text counts (that's all the models get as context); the
+        estimate is also stored on the message as ``tokens``.
+        """
+        if len(self._counts) > len(messages):
+            # History was cleared or truncated behind our back; start over
+            self._counts = []
+            self._prefix = [0]
+        for msg in messages[len(self._counts):]:
+            msg.tokens = self.append(msg.role, msg.text)
+
+    def tokens_between(self, start: int, end: int = None) -> int:
+        """Tokens in messages ``start`` (inclusive) to ``end`` (exclusive, default: all)."""
+        end = len(self._counts) if end is None else min(end, len(self._counts))
+        start = min(max(0, start), end)
+        return self._prefix[end] - self._prefix[start]
+
+    def window_total(self, last_n: int) -> int:
+        """Tokens in the most recent ``last_n`` messages."""
+        start = max(0, len(self._counts) - last_n)
+        return self._prefix[-1] - self._prefix[start]
+
+
+def count_tokens_remote(genai_client, text: str, model: str = COUNT_TOKENS_MODEL) -> int:
+    """Exact token count from the Gemini API (a blocking network call)."""
+    result = genai_client.models.count_tokens(model=model, contents=text)
+    return result.total_tokens if hasattr(result, 'total_tokens') else int(result)
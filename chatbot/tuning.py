@@ -0,0 +1,329 @@
+"""Offline routing optimizer: tune the routing weights and thresholds on the app's turn log.
+
+Usage:
+    python -m chatbot.tuning
+    python -m chatbot.tuning --metrics-dir .metrics -o routing_profile.json --max-quality-drop 0.02
+    python -m chatbot.tuning --latency-stage send_message --dry-run
+
+Every turn in ``.metrics/turns.jsonl`` (and its rotated files) carries what its
+routing score was made of (hard / medium keyword hits, question marks, the
+context's token estimate), the model that answered and its stage latencies.
+Thumbs ratings from ``.metrics/feedback.jsonl`` are joined on the turn id.
+From these, per model tier:
+
+* expected latency (``--latency-stage``): a least-squares line in the turn's
+  input tokens
+* chance of a thumbs-up: a logistic regression on the routing features, pulled
+  toward the all-tier fit when a tier has few ratings and made monotone up the
+  ladder (a bigger tier is never expected to do worse than a smaller one)
+
+The log only shows how a tier did on the turns it was sent, so a tier below
+the lowest one with ``MIN_SUPPORT`` ratings for the same routing features is
+expected to get a thumbs-down. With ``CHATBOT_ROUTING_EXPLORATION`` set, the
+app sends that share of turns one tier down to gather this evidence.
+
+Every combination of weights and thresholds on a grid is then replayed over the
+logged turns at once with NumPy: each candidate sends every turn to a tier,
+which gives an expected latency and an expected thumbs-up rate. The fastest
+candidate whose thumbs-up rate is at most ``--max-quality-drop`` below the
+current profile's wins (ties go to the one closest to the current profile) and
+is written as a new, versioned routing profile. The app reads it at startup.
+"""
+import argparse
+import glob
+import hashlib
+import itertools
+import json
+import os
+import sys
+from dataclasses import replace
+from datetime import datetime
+
+import numpy as np
+
+from chatbot.metrics import METRICS_DIR
+from chatbot.routing import MODEL_LADDER, ROUTING_PROFILE_PATH, RoutingProfile, load_routing_profile
+
+MIN_RATINGS = 20                 # Rated turns needed before quality can be estimated at all
+MIN_TIER_TURNS = 5               # Turns per tier needed to fit its latency line (fewer: the tier's mean)
+MAX_QUALITY_DROP = 0.02          # Allowed drop in expected thumbs-up rate versus the current profile
+LATENCY_TIE_SECONDS = 0.005      # Candidates this close to the fastest count as equally fast
+RIDGE_STRENGTH = 1.0             # Pull of each tier's quality fit toward the all-tier fit
+MIN_SUPPORT = 3                  # Ratings a tier needs on turns with the same features before it may get them
+
+# Candidate values searched for each profile field (the current profile's values are always added)
+WEIGHT_SMALL_GRID = range(0, 5)
+WEIGHT_MEDIUM_GRID = range(1, 7)
+WEIGHT_HARD_GRID = range(2, 11)
+MEDIUM_TIER_GRID = range(2, 15)
+TOP_TIER_GRID = range(3, 31)
+TOKEN_PRO_GRID = (1000, 1500, 2000, 3000, 4000, 6000, 8000, 12000)
+
+
+def _read_jsonl(pattern: str) -> list:
+    records = []
+    # Rotated files (.1, .2, ...) are older than the live one
+    for path in sorted(glob.glob(pattern), reverse=True):
+        with open(path, encoding="utf-8") as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return records
+
+
+def load_turns(metrics_dir: str, latency_stage: str) -> list:
+    """Answered turns that logged their routing features and ``latency_stage``.
+
+    Failed turns and cached answers (no model was asked) are left out.
+    """
+    return [
+        r for r in _read_jsonl(os.path.join(metrics_dir, "turns.jsonl*"))
+        if "hard" in r and r.get("model") in MODEL_LADDER and not r.get("failed") and not r.get("cached")
+        and latency_stage in r.get("spans", {})
+    ]
+
+
+def load_feedback(metrics_dir: str) -> dict:
+    """``{turn_id: 1 or 0}``; the latest rating of a turn wins, a withdrawn one removes it."""
+    ratings = {}
+    for record in sorted(_read_jsonl(os.path.join(metrics_dir, "feedback.jsonl*")), key=lambda r: r["ts"]):
+        if record.get("rating") is None:
+            ratings.pop(record["turn_id"], None)
+        else:
+            ratings[record["turn_id"]] = int(record["rating"])
+    return ratings
+
+
+class TurnLog:
+    """The logged turns as arrays: routing features, answering tier, latency, input tokens and rating."""
+
+    def __init__(self, turns: list, ratings: dict, latency_stage: str):
+        self.features = np.array([[r["hard"], r["medium"], r["question_marks"]] for r in turns], dtype=float)
+        self.tokens = np.array([r["routing_tokens"] for r in turns], dtype=float)
+        self.tier = np.array([MODEL_LADDER.index(r["model"]) for r in turns])
+        self.latency = np.array([r["spans"][latency_stage] for r in turns])
+        self.input_tokens = np.array([r.get("prompt_tokens") or r["routing_tokens"] for r in turns], dtype=float)
+        self.rating = np.array([ratings.get(r.get("turn_id"), np.nan) for r in turns])
+
+    def __len__(self):
+        return len(self.tier)
+
+    @property
+    def rated(self) -> np.ndarray:
+        return ~np.isnan(self.rating)
+
+
+def assign_tiers(features: np.ndarray, tokens: np.ndarray, profile: RoutingProfile) -> np.ndarray:
+    """Ladder index per turn, exactly as ``chatbot.routing.route`` would pick it with ``profile``."""
+    weights = np.array([profile.weight_hard, profile.weight_medium, profile.weight_small])
+    score = 1 + features @ weights
+    return np.where(
+        (score >= profile.top_tier_threshold) | (tokens > profile.token_threshold_pro), 2,
+        np.where(score >= profile.medium_tier_threshold, 1, 0),
+    )
+
+
+def fit_latency(log: TurnLog) -> np.ndarray:
+    """Expected latency of every turn on every tier, shape ``(turns, tiers)``."""
+    expected = np.empty((len(log), len(MODEL_LADDER)))
+    for tier, model in enumerate(MODEL_LADDER):
+        mask = log.tier == tier
+        if not mask.any():
+            raise SystemExit(f"No logged turns were answered by {model}, so its latency can't be estimated")
+        if mask.sum() >= MIN_TIER_TURNS and np.ptp(log.input_tokens[mask]) > 0:
+            design = np.column_stack([np.ones(mask.sum()), log.input_tokens[mask]])
+            (intercept, slope), *_ = np.linalg.lstsq(design, log.latency[mask], rcond=None)
+            slope = max(slope, 0.0)  # More input never makes a model faster
+        else:
+            intercept, slope = log.latency[mask].mean(), 0.0
+        expected[:, tier] = np.maximum(intercept + slope * log.input_tokens, 0.0)
+    return expected
+
+
+def _quality_design(log: TurnLog) -> np.ndarray:
+    return np.column_stack([np.ones(len(log)), log.features, np.log1p(log.tokens)])
+
+
+def _fit_logistic(design: np.ndarray, labels: np.ndarray, prior: np.ndarray, strength: float) -> np.ndarray:
+    """Logistic regression weights with an L2 pull toward ``prior`` (Newton's method)."""
+    weights = prior.copy()
+    penalty = strength * np.eye(design.shape[1])
+    for _ in range(25):
+        predicted = 1 / (1 + np.exp(-design @ weights))
+        gradient = design.T @ (predicted - labels) + penalty @ (weights - prior)
+        hessian = design.T @ (design * (predicted * (1 - predicted))[:, None]) + penalty
+        step = np.linalg.solve(hessian, gradient)
+        weights -= step
+        if np.abs(step).max() < 1e-6:
+            break
+    return weights
+
+
+def support_floor(log: TurnLog) -> np.ndarray:
+    """Lowest tier rated at least ``MIN_SUPPORT`` times on turns with the same features, per turn.
+
+    Features no tier has that many ratings for keep the highest tier they were logged on.
+    """
+    keys, key_of = np.unique(log.features, axis=0, return_inverse=True)
+    key_of = key_of.ravel()
+    floors = np.empty(len(keys), dtype=int)
+    for key in range(len(keys)):
+        mask = key_of == key
+        supported = np.flatnonzero(np.bincount(log.tier[mask & log.rated], minlength=len(MODEL_LADDER)) >= MIN_SUPPORT)
+        floors[key] = supported[0] if supported.size else log.tier[mask].max()
+    return floors[key_of]
+
+
+def fit_quality(log: TurnLog) -> np.ndarray:
+    """Expected chance of a thumbs-up for every turn on every tier, shape ``(turns, tiers)``.
+
+    Tiers below a turn's ``support_floor`` are expected to get a thumbs-down.
+    """
+    design = _quality_design(log)
+    rated = log.rated
+    pooled = _fit_logistic(design[rated], log.rating[rated], np.zeros(design.shape[1]), RIDGE_STRENGTH)
+    expected = np.empty((len(log), len(MODEL_LADDER)))
+    for tier in range(len(MODEL_LADDER)):
+        mask = rated & (log.tier == tier)
+        weights = _fit_logistic(design[mask], log.rating[mask], pooled, RIDGE_STRENGTH) if mask.any() else pooled
+        expected[:, tier] = 1 / (1 + np.exp(-design @ weights))
+    expected = np.maximum.accumulate(expected, axis=1)
+    expected[np.arange(len(MODEL_LADDER))[None, :] < support_floor(log)[:, None]] = 0.0
+    return expected
+
+
+def evaluate(log: TurnLog, latency: np.ndarray, quality: np.ndarray, profile: RoutingProfile) -> dict:
+    """Expected latency, thumbs-up rate and tier shares of routing the logged turns with ``profile``."""
+    tiers = assign_tiers(log.features, log.tokens, profile)
+    rows = np.arange(len(log))
+    return {
+        "expected_latency_s": round(float(latency[rows, tiers].mean()), 4),
+        "expected_thumbs_up": round(float(quality[rows, tiers].mean()), 4),
+        "tier_share": {model: round(float((tiers == tier).mean()), 4) for tier, model in enumerate(MODEL_LADDER)},
+    }
+
+
+def search(log: TurnLog, latency: np.ndarray, quality: np.ndarray, current: RoutingProfile, max_quality_drop: float) -> RoutingProfile:
+    """The fastest grid profile whose expected thumbs-up rate stays within ``max_quality_drop`` of ``current``'s.
+
+    Turns with the same features (and the same side of every token threshold)
+    always go to the same tier, so they are grouped first and every candidate
+    threshold combination is scored at once for each weight combination.
+    """
+    token_grid = np.array(sorted(set(TOKEN_PRO_GRID) | {current.token_threshold_pro}))
+    # tokens > token_grid[j] exactly when token_side > j
+    token_side = np.searchsorted(token_grid, log.tokens, side="left")
+    groups, group_of = np.unique(np.column_stack([log.features, token_side]), axis=0, return_inverse=True)
+    group_of = group_of.ravel()
+    features, side = groups[:, :3], groups[:, 3]
+    latency_sum = np.stack([np.bincount(group_of, latency[:, tier], len(groups)) for tier in range(3)], axis=1)
+    quality_sum = np.stack([np.bincount(group_of, quality[:, tier], len(groups)) for tier in range(3)], axis=1)
+
+    medium_grid = sorted(set(MEDIUM_TIER_GRID) | {current.medium_tier_threshold})
+    top_grid = sorted(set(TOP_TIER_GRID) | {current.top_tier_threshold})
+    thresholds = np.array([
+        (medium, top, token) for medium in medium_grid for top in top_grid if top > medium
+        for token in range(len(token_grid))
+    ])
+    weight_combos = itertools.product(
+        sorted(set(WEIGHT_SMALL_GRID) | {current.weight_small}),
+        sorted(set(WEIGHT_MEDIUM_GRID) | {current.weight_medium}),
+        sorted(set(WEIGHT_HARD_GRID) | {current.weight_hard}),
+    )
+    current_tiers = assign_tiers(log.features, log.tokens, current)
+    quality_floor = quality[np.arange(len(log)), current_tiers].mean() - max_quality_drop
+    current_values = np.array([current.weight_small, current.weight_medium, current.weight_hard,
+                               current.medium_tier_threshold, current.top_tier_threshold,
+                               int(np.searchsorted(token_grid, current.token_threshold_pro))])
+    # Distance to the current profile, relative to each field's grid span (used to break ties)
+    spans = np.array([max(WEIGHT_SMALL_GRID), max(WEIGHT_MEDIUM_GRID), max(WEIGHT_HARD_GRID),
+                      max(MEDIUM_TIER_GRID), max(TOP_TIER_GRID), len(token_grid)], dtype=float)
+
+    best = None  # (latency, distance, values)
+    fastest = np.inf
+    for small, medium, hard in weight_combos:
+        score = 1 + features @ np.array([hard, medium, small])
+        top = (score[None, :] >= thresholds[:, 1:2]) | (side[None, :] > thresholds[:, 2:3])
+        mid = score[None, :] >= thresholds[:, 0:1]
+        expected_latency = np.where(top, latency_sum[:, 2], np.where(mid, latency_sum[:, 1], latency_sum[:, 0])).sum(axis=1) / len(log)
+        expected_quality = np.where(top, quality_sum[:, 2], np.where(mid, quality_sum[:, 1], quality_sum[:, 0])).sum(axis=1) / len(log)
+        feasible = np.flatnonzero(expected_quality >= quality_floor - 1e-9)
+        if not feasible.size:
+            continue
+        fastest = min(fastest, expected_latency[feasible].min())
+        # Of this weight combination's candidates that are (nearly) the fastest so far, the one closest to the current profile
+        tied = feasible[expected_latency[feasible] <= fastest + LATENCY_TIE_SECONDS]
+        if not tied.size:
+            continue
+        values = np.column_stack([np.tile([small, medium, hard], (len(tied), 1)), thresholds[tied]])
+        distances = (np.abs(values - current_values) / spans).sum(axis=1)
+        closest = int(distances.argmin())
+        candidate = (float(expected_latency[tied[closest]]), float(distances[closest]), values[closest])
+        if best is None or best[0] > fastest + LATENCY_TIE_SECONDS or candidate[1] < best[1]:
+            best = candidate
+    if best is None:
+        return current  # Only reachable through float rounding: the current profile itself is always a candidate
+    small, medium, hard, medium_tier, top_tier, token = (int(value) for value in best[2])
+    return RoutingProfile(weight_small=small, weight_medium=medium, weight_hard=hard, medium_tier_threshold=medium_tier,
+                          top_tier_threshold=top_tier, token_threshold_pro=int(token_grid[token]))
+
+
+def versioned(profile: RoutingProfile) -> RoutingProfile:
+    """``profile`` named by when it was tuned and what it contains, e.g. ``20260101-1200-3f2a9c1e``."""
+    contents = profile.to_json()
+    values = json.dumps([contents["weights"], contents["thresholds"]], sort_keys=True)
+    digest = hashlib.sha256(values.encode("utf-8")).hexdigest()[:8]
+    return replace(profile, version=f"{datetime.now():%Y%m%d-%H%M}-{digest}")
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--metrics-dir", default=METRICS_DIR, help="where the app wrote turns.jsonl and feedback.jsonl")
+    parser.add_argument("-o", "--output", default=ROUTING_PROFILE_PATH, help="routing profile to write (default: %(default)s)")
+    parser.add_argument("--current", help="profile to improve on (default: --output if it exists, else the built-in one)")
+    parser.add_argument("--latency-stage", default="first_token", help="turn stage whose latency is minimized (e.g. send_message, turn)")
+    parser.add_argument("--max-quality-drop", type=float, default=MAX_QUALITY_DROP, help="allowed drop in expected thumbs-up rate")
+    parser.add_argument("--min-ratings", type=int, default=MIN_RATINGS, help="rated turns needed to tune")
+    parser.add_argument("--dry-run", action="store_true", help="print the result without writing the profile")
+    args = parser.parse_args(argv)
+
+    current = load_routing_profile(args.current or args.output)
+    log = TurnLog(load_turns(args.metrics_dir, args.latency_stage), load_feedback(args.metrics_dir), args.latency_stage)
+    if int(log.rated.sum()) < args.min_ratings:
+        print(f"Only {int(log.rated.sum())} of {len(log)} logged turns are rated; "
+              f"{args.min_ratings} are needed to tune (--min-ratings)", file=sys.stderr)
+        return 1
+
+    latency = fit_latency(log)
+    quality = fit_quality(log)
+    tuned = versioned(search(log, latency, quality, current, args.max_quality_drop))
+    before, after = evaluate(log, latency, quality, current), evaluate(log, latency, quality, tuned)
+
+    print(f"{len(log)} turns ({int(log.rated.sum())} rated), minimizing {args.latency_stage}")
+    print(f"{'profile':<24} | {'latency':>8} | {'thumbs-up':>9} | " + " | ".join(f"{m[7:]:>10}" for m in MODEL_LADDER))
+    for name, result in ((current.version, before), (tuned.version, after)):
+        shares = " | ".join(f"{result['tier_share'][m]:>10.0%}" for m in MODEL_LADDER)
+        print(f"{name:<24} | {result['expected_latency_s']:>7.3f}s | {result['expected_thumbs_up']:>9.1%} | {shares}")
+    print(json.dumps(tuned.to_json()["weights"]), json.dumps(tuned.to_json()["thresholds"]))
+    if args.dry_run:
+        return 0
+
+    report = tuned.to_json(
+        created=datetime.now().isoformat(timespec="seconds"),
+        tuning={
+            "turns": len(log),
+            "rated_turns": int(log.rated.sum()),
+            "latency_stage": args.latency_stage,
+            "max_quality_drop": args.max_quality_drop,
+            "baseline": {"version": current.version, **before},
+            "tuned": after,
+        },
+    )
+    tmp_path = f"{args.output}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, args.output)
+    print(f"Wrote {args.output} (restart the app to use it)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
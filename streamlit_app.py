@@ -1,156 +1,44 @@
 # Import the necessary libraries
 import streamlit as st  # For creating the web app interface
-from google import genai  # For interacting with the Google Gemini API
-from google.genai import types
-import re
-import re as _re
-
-# === Model Routing Constants ===
-MAX_CHAT_HISTORY = 20            # Number of messages to keep in context
-MODEL_MEDIUM_TIER_THRESHOLD = 5  # Threshold for gemini-2.5-flash
-MODEL_TOP_TIER_THRESHOLD = 10    # Threshold for gemini-2.5-pro
-TOKEN_THRESHOLD_PRO = 3000       # Token threshold for using pro model
-WEIGHT_SMALL = 2
-WEIGHT_MEDIUM = 3
-WEIGHT_HARD = 5
-
-# Temperature settings for different models
-TEMPERATURE_PRO = 0.2            # Low temperature for consistent, accurate responses
-TEMPERATURE_FLASH = 0.7          # Balanced temperature for medium creativity
-TEMPERATURE_LITE = 1.0           # High temperature for creative, varied responses
-
-# Top-p (nucleus sampling) settings for different models
-TOP_P_PRO = 0.8                  # More focused sampling for consistency
-TOP_P_FLASH = 0.9                # Balanced sampling
-TOP_P_LITE = 0.95                # Broader sampling for creativity
-
-# Top-k settings for different models
-TOP_K_PRO = 20                   # Smaller vocabulary for more focused responses
-TOP_K_FLASH = 40                 # Balanced vocabulary size
-TOP_K_LITE = 64                  # Larger vocabulary for more varied responses
-
-# Model routing keywords
-HARD_KEYWORDS = [
-    r"derivative", r"integral",  r"big-?o", r"complexity", r"algorithm", r"algoritma",r"mathematical",
-    r"dynamic programming", r"regex", r"sql",  r"stack trace", r"panic", r"traceback",  r"recursion", r"algorithm", r"theorem", r"bukti", r"turunan", r"integral", r"induksi",
-    r"np[-\s]?sulit", r"kompleksitas", r"pemrograman dinamis", r"jejak tumpukan", r"jejak kesalahan", r"jejak error", r"jejak",
-    r"algoritma", r"teorema", r"persamaan", r"matematika", r"logika", r"berpikir keras", r"pikir keras", r"buktikan", r"soal sulit",
-    r"tantangan", r"uji", r"uji coba", r"uji hipotesis", r"prima", r"prime"
-]
-MEDIUM_KEYWORDS = [
-    r"apa itu", r"jelaskan", r"analisa", r"penjelasan", r"mengapa", r"kenapa", r"sulit", r"tantangan", r"perbaiki", r"kesalahan",
-    r"masalah", r"solusi", r"langkah", r"cara", r"bagaimana", r"penyebab", r"penyelesaian" 
-]
-HARD_PATTERN = re.compile("|".join(HARD_KEYWORDS), re.IGNORECASE)
-MEDIUM_PATTERN = re.compile("|".join(MEDIUM_KEYWORDS), re.IGNORECASE)
-
-# === Helper Functions ===
-def select_model(content: str, conversation_history: list) -> str:
-    """Select Gemini model based on weighted content complexity and token count."""
-    score = 1  # Start with a base score of 1
-    
-    # Calculate complexity score
-    # Hard keywords: +5 each
-    score += WEIGHT_HARD * len(HARD_PATTERN.findall(content))
-    # Medium keywords: +3 each
-    score += WEIGHT_MEDIUM * len(MEDIUM_PATTERN.findall(content))
-    # Question marks: +2 each
-    score += WEIGHT_SMALL * content.count('?')
-    
-    # Estimate token count for conversation context
-    token_count = 0
-    try:
-        if conversation_history and len(conversation_history) > 0:
-            # Build conversation prompt for token estimation
-            prompt = ""
-            # Use recent history for token counting (limit to avoid huge contexts)
-            recent_history = conversation_history[-MAX_CHAT_HISTORY:]
-            for msg in recent_history:
-                prompt += f"{msg['role']}: {msg['content']}\n"
-            
-            # Add current message to the prompt for accurate estimation
-            prompt += f"user: {content}\n"
-            
-            # Use the client from session state to count tokens
-            if hasattr(st.session_state, 'genai_client') and st.session_state.genai_client:
-                try:
-                    estimated_token = st.session_state.genai_client.models.count_tokens(
-                        model="gemini-2.5-flash-lite", 
-                        contents=prompt
-                    )
-                    token_count = estimated_token.total_tokens if hasattr(estimated_token, 'total_tokens') else int(estimated_token)
-                except Exception as e:
-                    # Fallback: rough estimation if API call fails
-                    # Approximate: 1 token ≈ 4 characters for English text
-                    token_count = len(prompt) // 4
-                    st.warning(f"Token estimation failed, using approximation: {token_count} tokens")
-            else:
-                # Fallback estimation when client not available
-                token_count = len(prompt) // 4
-        else:
-            # For first message, just estimate current content
-            token_count = len(content) // 4
-            
-    except Exception as e:
-        # Fallback to character-based estimation
-        total_text = content
-        if conversation_history:
-            for msg in conversation_history[-5:]:  # Last 5 messages for safety
-                total_text += msg.get('content', '')
-        token_count = len(total_text) // 4
-    
-    # Enhanced model selection with token consideration:
-    # 1. gemini-2.5-pro: For really hard problems OR long conversations
-    # 2. gemini-2.5-flash: For medium complexity
-    # 3. gemini-2.5-flash-lite: For simple queries and short conversations
-    
-    if score >= MODEL_TOP_TIER_THRESHOLD or token_count > TOKEN_THRESHOLD_PRO:
-        return "gemini-2.5-pro"        # Most capable model for complex/long contexts
-    elif score >= MODEL_MEDIUM_TIER_THRESHOLD:
-        return "gemini-2.5-flash"      # Balanced model for medium complexity
-    else:
-        return "gemini-2.5-flash-lite"  # Fastest model for simple queries
-
-def wrap_code_blocks(text):
-    """Process code blocks for Streamlit display - keep markdown formatting intact."""
-    if not isinstance(text, str):
-        text = str(text) if text is not None else ""
-    
-    # Keep markdown code blocks intact for Streamlit's native rendering
-    # Streamlit automatically handles ```language and ``` code blocks
-    # We just need to ensure proper formatting
-    
-    # Clean up any malformed code blocks and ensure proper spacing
-    text = _re.sub(r"```(\w*)\s*\n", r"```\1\n", text)  # Clean language specifier
-    text = _re.sub(r"```\s*$", "```", text, flags=_re.MULTILINE)  # Clean closing tags
-    
-    return text
-
-def add_citations(response):
-    """Add citations from grounding metadata."""
-    text = ""
-    grounding_metadata = getattr(response.candidates[0], "grounding_metadata", None)
-    if not grounding_metadata:
-        return text
-    supports = getattr(grounding_metadata, "grounding_supports", None)
-    chunks = getattr(grounding_metadata, "grounding_chunks", None)
-    if not supports or not chunks:
-        return text
-
-    # Collect all unique citations (index, url)
-    citation_map = {}
-    for i, chunk in enumerate(chunks):
-        if getattr(chunk, "web", None) and getattr(chunk.web, "uri", None):
-            citation_map[i + 1] = chunk.web.uri
-
-    # Build bibliography at the end
-    if citation_map:
-        bib = "\n\n Referensi:\n"
-        for idx, url in sorted(citation_map.items()):
-            bib += f"[{idx}] {url}\n"
-        return bib.strip()
-    else:
-        return ""
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+from functools import partial
+# Only modules that load quickly are imported up here; the Gemini SDK (and the
+# helpers built on it) are imported further down, once an API key is entered
+from app_resources import (
+    ROUTING_GUIDE, ROUTING_PROFILE, get_client_registry, get_memory_manager, get_metrics_recorder, get_request_scheduler,
+    get_response_cache, get_single_flight,
+)
+from chatbot.cache import RESPONSE_CACHE_TOOL_TTL, make_cache_key
+from chatbot.hedging import (
+    DEFAULT_LATENCY_BUDGET, HEDGE_FRACTION, LATENCY_HISTORY_MIN_SAMPLES, LATENCY_HISTORY_QUANTILE, HedgedRequest,
+)
+from chatbot.metrics import TurnTrace
+from chatbot.messages import Message
+from chatbot.responses import ReplyParser, close_open_code_fence, wrap_code_blocks
+from chatbot.routing import (
+    DEFAULT_TOOL_PROFILE, MODEL_LADDER, avoid_busy_tiers, build_generation_config, cheaper_tier, explore_cheaper_tier,
+    fit_latency_budget, route,
+)
+from chatbot.scheduler import DOWNGRADE_QUEUE_DEPTH, open_stream
+from chatbot.singleflight import count_tokens_key, generation_key
+from chatbot.tokens import COUNT_TOKENS_MODEL, TokenLedger, count_tokens_remote, default_estimator
+
+# === Conversation Constants ===
+STREAM_RENDER_INTERVAL = 0.05    # Seconds between re-renders while streaming
+HISTORY_WINDOW_MESSAGES = 20     # Most recent messages rendered on every rerun
+HISTORY_PAGE_SIZE = 50           # Older messages revealed per "show earlier" click
+
+# Routing thresholds, keyword lists and per-model parameters live in chatbot/routing.py
+# (MAX_CHAT_HISTORY, the per-chat safety cap, lives in chatbot/sessions.py)
+
+# Response parsing (ReplyParser) lives in chatbot/responses.py; the Message record in chatbot/messages.py
+
+# The shared, process-wide resources (response cache, client registry, metrics,
+# request scheduler, single-flight, memory manager) live in app_resources.py: Streamlit imports a
+# module once per process, so they aren't set up again on every rerun
 
 # --- 1. Page Configuration and Title ---
 
@@ -179,39 +67,73 @@ with st.sidebar:
     if show_thinking:
         st.info("💭 **Thinking Mode**: You'll see the model's decision-making process including complexity analysis, token counting, and parameter selection.", icon="🧠")
     
-    # Show model routing information
-    st.subheader("🤖 Smart Model Routing")
-    st.markdown("""
-    **Gemini-2.5-Pro** is used for:
-    - Very complex mathematical problems
-    - Advanced algorithms and data structures
-    - Research-level technical analysis
-    - Long conversations (>3000 tokens)
-    - *Temperature: 0.2, Top-p: 0.8, Top-k: 20 (focused & consistent)*
+    # Stream responses chunk by chunk instead of waiting for the full answer
+    stream_responses = st.toggle("Stream Responses", value=True, help="Show the answer while it is being generated")
     
-    **Gemini-2.5-Flash** is used for:
-    - Programming and code analysis
-    - Technical explanations
-    - Medium complexity problems
-    - *Temperature: 0.7, Top-p: 0.9, Top-k: 40 (balanced)*
+    # Answer repeated questions from the shared response cache
+    use_cache = st.toggle("Reuse Cached Answers", value=True, help="Instantly reuse a stored answer when the same question was already asked in the same context")
     
-    **Gemini-2.5-Flash-Lite** is used for:
-    - Simple questions
-    - General conversations
-    - Basic information requests
-    - Short conversations
-    - *Temperature: 1.0, Top-p: 0.95, Top-k: 64 (creative & varied)*
+    # Upload the system instruction and older turns once per tier instead of re-sending them every turn
+    prefix_caching = st.toggle("Cache Conversation Prefix", value=True, help="Keep the system instruction and stable older history in Gemini's context cache once a conversation is long enough")
     
-    *Routing considers both content complexity and conversation length*
-    """)
+    # Only attach Google Search / code execution to turns whose prompt looks like it needs them
+    predict_tools = st.toggle("Predict Tool Use", value=True, help="Skip the search and code execution tools for prompts that don't seem to need them (faster, fewer tokens). Off: every turn gets both tools")
+    
+    # When several people send the same prompt at once, make one request and give everyone its answer
+    share_requests = st.toggle("Share Identical Requests", value=True, help="Join an identical request (same model, settings, prompt and conversation) that another session already has in flight instead of sending it again")
+    
+    # Token counts are estimated locally; this adds an exact count_tokens API call per turn
+    verify_tokens = st.toggle("Verify Token Counts with API", value=False, help="Also fetch the exact token count from Gemini each turn (slower)")
+    
+    # Keep turns within a latency budget: route by observed latency and hedge slow answers
+    sla_mode = st.toggle("Latency SLA Mode", value=False, help="Pick tiers whose recent latency fits the budget, and ask the next cheaper model too if the first token is late")
+    if sla_mode:
+        latency_budget = st.slider("Latency Budget (seconds)", min_value=1.0, max_value=60.0, value=DEFAULT_LATENCY_BUDGET, step=0.5, help="Longest acceptable wait for the first token")
+        hedge_fraction = st.slider("Hedge After (% of budget)", min_value=10, max_value=100, value=int(HEDGE_FRACTION * 100), step=5, help="When to fire the backup request at the next cheaper model") / 100
+    
+    # Requests wait their turn for each model's quota; optionally skip tiers with a long line
+    downgrade_when_busy = st.toggle("Downgrade When Busy", value=False, help=f"Use the next cheaper model when {DOWNGRADE_QUEUE_DEPTH} or more requests are already waiting for the selected one")
+    
+    # Show model routing information
+    st.subheader("🤖 Smart Model Routing")
+    st.markdown(ROUTING_GUIDE)  # Formatted once per process in app_resources.py
     
     # Show current conversation stats
     if "messages" in st.session_state and st.session_state.messages:
         st.subheader("📊 Conversation Stats")
         total_messages = len(st.session_state.messages)
-        user_messages = len([m for m in st.session_state.messages if m["role"] == "user"])
+        user_messages = len([m for m in st.session_state.messages if m.role == "user"])
         st.metric("Total Messages", total_messages)
         st.metric("Your Messages", user_messages)
+        
+        # Shared across all sessions on this server
+        cache_stats = get_response_cache().stats()
+        st.metric("Cache Hits / Misses", f"{cache_stats['hits']} / {cache_stats['misses']}", help=f"Hit rate: {cache_stats['hit_rate']:.0%} (all sessions)")
+        
+        # Where each turn's time goes, per model tier (all sessions)
+        latency_rows = get_metrics_recorder().summary()
+        if latency_rows:
+            st.caption("⏱️ Stage latency per model (ms, all sessions)")
+            st.dataframe(latency_rows, hide_index=True)
+        
+        # Requests waiting for each model's rate limits (all sessions)
+        queue_rows = get_request_scheduler().stats()
+        if queue_rows:
+            st.caption("🚦 Request queue per model (all sessions)")
+            st.dataframe(queue_rows, hide_index=True)
+        
+        # Requests that joined an identical one already in flight (all sessions)
+        flight_rows = get_single_flight().stats()
+        if flight_rows:
+            st.caption("🔗 Shared in-flight requests (all sessions)")
+            st.dataframe(flight_rows, hide_index=True)
+        
+        # Memory held by this session's messages and chats; cold history moves to disk over budget
+        session_memory = st.session_state.get("session_memory")
+        if session_memory is not None:
+            footprint = session_memory.footprint()
+            memory_stats = get_memory_manager().stats(limit=0)
+            st.metric("Session Memory", f"{footprint['memory_kb']:.0f} KB", help=f"{footprint['in_memory']} messages in memory, {footprint['on_disk']} on disk, {footprint['live_chats']} live chat(s). All sessions: {memory_stats['total_bytes'] / 2**20:.1f} MB in {memory_stats['sessions']} session(s)")
 
 # --- 3. API Key and Client Initialization ---
 
@@ -221,9 +143,26 @@ if not google_api_key:
     st.info("Please add your Google AI API key in the sidebar to start chatting.", icon="🗝️")
     st.stop()
 
+# The Gemini SDK takes a while to import, so it's only loaded from here on (i.e.
+# once a key is entered). Python keeps imported modules, so only the first run pays.
+from chatbot.context import ContextManager
+from chatbot.prefix_cache import PrefixCache, estimated_savings, is_cache_error
+from chatbot.sessions import MAX_CHAT_HISTORY, ChatSessionPool
+
+def drop_chat_pool(genai_client):
+    """Forget this session's chats, deleting their Gemini context caches first.
+
+    Caches that aren't deleted stay alive (and billed) until they expire.
+    """
+    pool = st.session_state.pop("chat_pool", None)
+    if pool is not None and pool.prefix_cache is not None and genai_client is not None:
+        pool.prefix_cache.clear(genai_client)
+
 # This block of code handles the creation of the Gemini API client.
-# It's designed to be efficient: it only creates a new client if one doesn't exist
-# or if the user has changed the API key in the sidebar.
+# It's designed to be efficient: clients come from a process-wide registry, so all
+# sessions using the same key share one client and its keep-alive connections.
+# A session only switches clients if one doesn't exist yet or the user has changed
+# the API key in the sidebar.
 
 # We use `st.session_state` which is Streamlit's way of "remembering" variables
 # between user interactions (like sending a message or clicking a button).
@@ -238,140 +177,390 @@ if not google_api_key:
 # So, it checks: "Is the key stored in memory different from the one in the input box?"
 if ("genai_client" not in st.session_state) or (getattr(st.session_state, "_last_key", None) != google_api_key):
     try:
-        # If the conditions are met, create a new client.
-        st.session_state.genai_client = genai.Client(api_key=google_api_key)
+        # If the conditions are met, look up the pooled client for this key.
+        previous_client = st.session_state.get("genai_client")
+        st.session_state.genai_client = get_client_registry().get(google_api_key)
         # Store the new key in session state to compare against later.
         st.session_state._last_key = google_api_key
         # Since the key changed, we must clear the chat session and message history.
         # .pop() safely removes an item from session_state.
+        # The old conversation's context caches were made with the old key's client.
         st.session_state.pop("chat", None)
+        drop_chat_pool(previous_client)
         st.session_state.pop("current_model", None)
         st.session_state.pop("messages", None)
+        st.session_state.pop("token_ledger", None)
+        st.session_state.pop("context_manager", None)
+        st.session_state.pop("history_pages", None)
+        st.session_state.pop("rated_turn", None)
     except Exception as e:
         # If the key is invalid, show an error and stop.
         st.error(f"Invalid API Key: {e}")
         st.stop()
+else:
+    # Same key: refresh the registry's idle timer. If the pooled client was evicted
+    # while this session was idle, switch to the new one and rebuild the chats from
+    # the stored history (the messages themselves are kept).
+    pooled_client = get_client_registry().get(google_api_key)
+    if pooled_client is not st.session_state.genai_client:
+        st.session_state.genai_client = pooled_client
+        st.session_state.pop("chat", None)
+        drop_chat_pool(pooled_client)  # Same key, so the new client can delete the old caches
 
 
 # --- 4. Chat History Management ---
 
-# Initialize single chat session that we'll use with model switching
+# Switching context caching on or off means building every tier's chat again
+if st.session_state.get("_prefix_caching") != prefix_caching:
+    st.session_state._prefix_caching = prefix_caching
+    drop_chat_pool(st.session_state.genai_client)
+
+# Initialize the active chat session and the pool holding one chat per model tier
 if "chat" not in st.session_state:
     st.session_state.chat = None
+if "chat_pool" not in st.session_state:
+    st.session_state.chat_pool = ChatSessionPool(
+        max_turns=MAX_CHAT_HISTORY,
+        prefix_cache=PrefixCache() if prefix_caching else None
+    )
 if "current_model" not in st.session_state:
     st.session_state.current_model = None
 
+# Identifies this browser session to the shared scheduler, which takes turns between sessions
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
 # Initialize the message history (shared across all models)
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
-def get_or_create_chat_session(model_name: str):
-    """Get or create a chat session, recreating if model changes to maintain context."""
-    # Different models support different tools
-    tools = []
-    
-    # Code execution and search tools support varies by model
-    if model_name in ["gemini-2.5-flash", "gemini-2.5-flash-lite", "gemini-2.5-pro"]:
-        tools = [
-            types.Tool(code_execution=types.ToolCodeExecution),
-            types.Tool(google_search=types.GoogleSearch())
-        ]
-    # For experimental models or others, use no tools or adjust as needed
+# Cached token count per stored message, so routing never re-tokenizes the history
+if "token_ledger" not in st.session_state:
+    st.session_state.token_ledger = TokenLedger()
+
+# Number of older history pages the user has chosen to show
+if "history_pages" not in st.session_state:
+    st.session_state.history_pages = 0
+
+# Folds older turns into a rolling summary so each tier's context fits its token budget
+if "context_manager" not in st.session_state:
+    st.session_state.context_manager = ContextManager()
+
+# Tracks this session's memory use for the process-wide budgets (chatbot/memory.py).
+# The message list and chat pool are handed over on every run because a reset or a
+# new key replaces them. Touching also reads back the recent messages that were
+# moved to disk while this session sat idle.
+if "session_memory" not in st.session_state:
+    st.session_state.session_memory = get_memory_manager().register(st.session_state.session_id)
+st.session_state.session_memory.attach(st.session_state.messages, st.session_state.chat_pool)
+st.session_state.session_memory.touch()
+
+def estimate_conversation_tokens(messages: list, verify: bool = False, trace: TurnTrace = None):
+    """Token count of the compacted conversation context, read from the cached ledger.
+
+    Routing looks at the context the cheapest tier would get, so a long conversation
+    alone doesn't push every turn onto the slowest model. Returns
+    ``(token_count, verified_count)``. ``verified_count`` is only set when ``verify``
+    is on: then the exact count is fetched from the API, used for routing and fed
+    back to calibrate the local estimator. The API call is timed as a
+    ``count_tokens`` span on ``trace``; with "Share Identical Requests" on, an
+    identical count already in flight from another session is reused.
+    """
+    ledger = st.session_state.token_ledger
+    ledger.sync(messages)
+    context_manager = st.session_state.context_manager
+    # Pick up finished summaries and start a new one in the background if needed
+    context_manager.update(st.session_state.genai_client, messages, ledger)
+    view = context_manager.view(MODEL_LADDER[0], ledger)
+    token_count = view.tokens
+    verified_count = None
     
-    # Set generation parameters based on model for different creativity/consistency levels
-    if model_name == "gemini-2.5-pro":
-        temperature = TEMPERATURE_PRO      # 0.2 - More consistent, accurate responses
-        top_p = TOP_P_PRO                  # 0.8 - More focused sampling
-        top_k = TOP_K_PRO                  # 20 - Smaller vocabulary for consistency
-    elif model_name == "gemini-2.5-flash":
-        temperature = TEMPERATURE_FLASH    # 0.7 - Balanced creativity
-        top_p = TOP_P_FLASH                # 0.9 - Balanced sampling
-        top_k = TOP_K_FLASH                # 40 - Balanced vocabulary
-    else:  # gemini-2.5-flash-lite
-        temperature = TEMPERATURE_LITE     # 1.0 - More creative, varied responses
-        top_p = TOP_P_LITE                 # 0.95 - Broader sampling for creativity
-        top_k = TOP_K_LITE                 # 64 - Larger vocabulary for variety
+    if verify and messages:
+        # Rebuild the transcript only in verification mode
+        prompt = f"summary: {view.summary}\n" if view.summary else ""
+        for msg in messages[view.start:]:
+            prompt += f"{msg.role}: {msg.text}\n"
+        try:
+            with trace.span("count_tokens") if trace else nullcontext():
+                count = partial(count_tokens_remote, st.session_state.genai_client, prompt, COUNT_TOKENS_MODEL)
+                if share_requests:
+                    verified_count, _ = get_single_flight().do("count_tokens", count_tokens_key(COUNT_TOKENS_MODEL, prompt), count)
+                else:
+                    verified_count = count()
+            default_estimator.calibrate(token_count, verified_count)
+        except Exception:
+            st.warning(f"Token verification failed, using local estimate: {token_count} tokens")
     
-    config = types.GenerateContentConfig(
-        tools=tools,
-        temperature=temperature,
-        top_p=top_p,
-        top_k=top_k,
-        system_instruction="You are a helpful assistant. Use Google Search if needed to ground your answers and cite sources with [number] where relevant. Use Code execution tool only for code-related queries and complex math, do not show internal tool in response if it being used"
+    return token_count, verified_count
+
+def get_or_create_chat_session(model_name: str, config, context_view, tool_profile: str):
+    """Get the pooled chat session for a model tier and tool profile, syncing the turns it missed.
+
+    ``context_view`` says which older messages are replaced by a summary for this
+    tier. Returns ``(chat, synced_turns)`` where ``synced_turns`` is the number of
+    earlier messages that were added to the chat's history for this switch.
+    """
+    # Reuse this tier's chat, adding only the messages it hasn't seen yet
+    # (everything except the message we're about to send)
+    chat, synced_turns = st.session_state.chat_pool.get(
+        st.session_state.genai_client,
+        model_name,
+        config,
+        st.session_state.messages[:-1],
+        start=context_view.start,
+        summary=context_view.summary,
+        tool_profile=tool_profile
     )
+    st.session_state.chat = chat
+    st.session_state.current_model = model_name
+    
+    return chat, synced_turns
+
+def response_cache_key(prompt: str, model_name: str, tool_profile: str) -> str:
+    """Response cache key for sending ``prompt`` to a tier with a tool profile, built from the context that tier is sent."""
+    # The tier's summary of older turns plus the turns after it (everything except the new prompt)
+    view = st.session_state.context_manager.view(model_name, st.session_state.token_ledger)
+    return make_cache_key(prompt, model_name, st.session_state.messages[view.start:-1], view.summary, tool_profile)
+
+def make_scheduled_send(token_estimate: int, flight_key=None):
+    """A ``send(model, chat, prompt, stream)`` that goes through the shared request scheduler.
+
+    Each call waits for its tier's requests/min and tokens/min limits (taking turns
+    with other sessions) and retries 429 / 503 errors with jittered backoff. Returns
+    ``(send, lane_stats)``; ``lane_stats(model)`` is that tier's time spent waiting,
+    retries, and whether its answer was shared. Hedged tiers run at the same time,
+    so each keeps its own numbers and the turn reports only the answering tier's.
+    With ``flight_key(model)``, a request identical to one another session already
+    has in flight joins it instead of being sent (and queued) again.
+    """
+    # Looked up here: with SLA mode, send() runs in background threads without the session
+    scheduler = get_request_scheduler()
+    flights = get_single_flight()
+    session_id = st.session_state.session_id
+    stats_lock = threading.Lock()
+    queue_stats = {}  # model name -> {"waited", "retries", "shared"}; updated from the hedge lanes' threads
+    
+    def lane_stats(model_name):
+        with stats_lock:
+            return dict(queue_stats.get(model_name, {"waited": 0.0, "retries": 0, "shared": False}))
+    
+    def add_stats(model_name, waited=0.0, retries=0, shared=False):
+        with stats_lock:
+            stats = queue_stats.setdefault(model_name, {"waited": 0.0, "retries": 0, "shared": False})
+            stats["waited"] += waited
+            stats["retries"] += retries
+            stats["shared"] = stats["shared"] or shared
     
-    # If model changed or no chat exists, create new session with the new model
-    if (st.session_state.chat is None or 
-        st.session_state.current_model != model_name):
+    def send(model_name, chat, prompt, stream):
+        def attempt():
+            if stream:
+                # Start the stream here so a 429 / 503 is raised inside the retry loop
+                return open_stream(chat.send_message_stream(prompt))
+            return chat.send_message(prompt)
         
-        st.session_state.chat = st.session_state.genai_client.chats.create(
-            model=model_name,
-            config=config
-        )
-        st.session_state.current_model = model_name
+        def scheduled():
+            result, waited, retries = scheduler.call(model_name, session_id, token_estimate, attempt)
+            add_stats(model_name, waited=waited, retries=retries)
+            return result
+        
+        if flight_key is None:
+            return scheduled()
+        # Followers wait for the leader's call and get its (streamed) answer
+        join = flights.stream if stream else flights.do
+        result, shared = join("generate", flight_key(model_name), scheduled)
+        if shared:
+            add_stats(model_name, shared=True)
+        return result
+    
+    return send, lane_stats
+
+def start_hedged_request(prompt: str, model_name: str, chat, trace: TurnTrace, send, tool_profile: str):
+    """Send ``prompt`` to ``chat`` in SLA mode, hedging with the next cheaper tier if it's slow.
+
+    If no first token arrives within ``hedge_fraction`` of the budget (or the
+    request fails first), the same prompt goes to the next cheaper tier (with
+    the same tools) and the first to produce text wins. Returns
+    ``(request, winning_model)``.
+    """
+    # A cancelled tier's late answer still counts towards its latency history
+    request = HedgedRequest(prompt, stream=stream_responses, on_late_answer=partial(get_metrics_recorder().observe, "first_token"), send=send)
+    request.launch(model_name, chat)
+    winner = request.wait_for_first_token(latency_budget * hedge_fraction)
+    hedge_model = cheaper_tier(model_name)
+    if winner is None and hedge_model:
+        hedge_view = st.session_state.context_manager.view(hedge_model, st.session_state.token_ledger)
+        with trace.span("chat_session"):
+            hedge_chat, _ = st.session_state.chat_pool.get(
+                st.session_state.genai_client,
+                hedge_model,
+                build_generation_config(hedge_model, tool_profile),
+                st.session_state.messages[:-1],
+                start=hedge_view.start,
+                summary=hedge_view.summary,
+                tool_profile=tool_profile
+            )
+        request.launch(hedge_model, hedge_chat)
+        winner = request.wait_for_first_token()
+    if winner is None:
+        winner = request.fallback()
+    
+    for loser in request.cancel_losers(winner):
+        # A cancelled chat may or may not have recorded the prompt; rebuild it next time
+        st.session_state.chat_pool.discard(loser, tool_profile)
+    return request, winner
+
+def stream_response(response_stream, placeholder, parser: ReplyParser, on_first_token=None, started=None):
+    """Feed streamed chunks to ``parser``, rendering the text so far into ``placeholder``.
+
+    Code, execution output and citations are collected by the parser and shown
+    once the stream is done. Returns ``first_token_time``, measured from
+    ``started`` (default: now).
+    """
+    started = started or time.perf_counter()
+    first_token_time = None
+    last_render = 0.0
     
-    return st.session_state.chat
-
-def send_message_with_context(chat_session, current_message, message_history):
-    """Send message with full conversation context for model switches."""
-    # If this is the first message or we just switched models,
-    # we need to provide context from the conversation history
-    if len(message_history) > 1:  # More than just the current user message
-        # Build context from conversation history
-        context_messages = message_history[:-1]  # All except current message
-        context = "Previous conversation:\n"
-        for msg in context_messages[-MAX_CHAT_HISTORY:]:  # Limit context
-            context += f"{msg['role']}: {msg['content']}\n"
-        context += f"\nCurrent message: {current_message}"
+    for chunk in response_stream:
+        if not parser.feed(chunk):
+            continue
+        if first_token_time is None:
+            first_token_time = time.perf_counter() - started
+            if on_first_token:
+                on_first_token()
         
-        # Send the context + current message
-        return chat_session.send_message(context)
-    else:
-        # First message, send directly
-        return chat_session.send_message(current_message)
+        # Re-render at most every STREAM_RENDER_INTERVAL seconds
+        now = time.perf_counter()
+        if now - last_render >= STREAM_RENDER_INTERVAL:
+            placeholder.markdown(wrap_code_blocks(close_open_code_fence(parser.text)) + " ▌")
+            last_render = now
+    
+    return first_token_time
 
 # Handle the reset button click.
 if reset_button:
     # If the reset button is clicked, clear chat and message history from memory.
+    # The conversation's context caches are deleted too (they'd expire on their own later).
     st.session_state.pop("chat", None)
+    drop_chat_pool(st.session_state.genai_client)
     st.session_state.pop("current_model", None)
     st.session_state.pop("messages", None)
+    st.session_state.pop("token_ledger", None)
+    st.session_state.pop("context_manager", None)
+    st.session_state.pop("history_pages", None)
+    st.session_state.pop("rated_turn", None)
     # st.rerun() tells Streamlit to refresh the page from the top.
     st.rerun()
 
 # --- 5. Display Past Messages ---
 
-# Loop through every message currently stored in the session state.
-for msg in st.session_state.messages:
+# Messages are Message records (chatbot/messages.py); ``msg.content`` puts the
+# answer text, code, output and citations together into markdown for display.
+# Only the most recent window is drawn on each rerun; older messages are revealed
+# a page at a time so rerun cost doesn't grow with the chat. Sending a new message
+# hides them again, so revealed pages don't stay on every rerun after that.
+def show_earlier_messages():
+    st.session_state.history_pages += 1
+
+def hide_earlier_messages():
+    st.session_state.history_pages = 0
+
+hidden_messages = max(0, len(st.session_state.messages) - HISTORY_WINDOW_MESSAGES - st.session_state.history_pages * HISTORY_PAGE_SIZE)
+if hidden_messages:
+    st.button(
+        f"⬆️ Show earlier messages ({hidden_messages} hidden)",
+        on_click=show_earlier_messages,
+        help=f"Load up to {HISTORY_PAGE_SIZE} more messages"
+    )
+
+# Thumbs up/down under the latest answer. Ratings are logged with the turn's id
+# (.metrics/feedback.jsonl) so `python -m chatbot.tuning` can weigh speed against quality.
+def record_feedback(turn_id: str, model: str):
+    get_metrics_recorder().record_feedback(turn_id, model, st.session_state.get(f"feedback_{turn_id}"))
+
+def show_feedback(turn: dict):
+    st.feedback("thumbs", key=f"feedback_{turn['turn_id']}", on_change=record_feedback, args=(turn["turn_id"], turn["model"]))
+
+# The answer that can be rated: {"index", "turn_id", "model"}
+rated_turn = st.session_state.get("rated_turn")
+
+# Loop through the visible messages stored in the session state.
+for index, msg in enumerate(st.session_state.messages[hidden_messages:], start=hidden_messages):
     # For each message, create a chat message bubble with the appropriate role ("user" or "assistant").
-    with st.chat_message(msg["role"]):
+    with st.chat_message(msg.role):
         # Display the content of the message using Markdown for nice formatting.
-        st.markdown(msg["content"])
+        st.markdown(msg.content)
+        if rated_turn is not None and rated_turn["index"] == index:
+            show_feedback(rated_turn)
 
 # --- 6. Handle User Input and API Communication ---
 
 # Create a chat input box at the bottom of the page.
 # The user's typed message will be stored in the 'prompt' variable.
-prompt = st.chat_input("Type your message here...")
+prompt = st.chat_input("Type your message here...", on_submit=hide_earlier_messages)
 
 # Check if the user has entered a message.
 if prompt:
     # 1. Add the user's message to our message history list.
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    st.session_state.messages.append(Message("user", prompt))
     # 2. Display the user's message on the screen immediately for a responsive feel.
     with st.chat_message("user"):
         st.markdown(prompt)
 
+    # Time every stage of this turn (routing, token counting, chat creation,
+    # generation, parsing, rendering) so slow stages show up per model tier
+    trace = TurnTrace()
+    
     # 3. Get the assistant's response using dynamic model routing with context preservation.
     try:
-        # Select the appropriate model based on content complexity
-        selected_model = select_model(prompt, st.session_state.messages)
+        # Estimate the context size once; the thinking display reuses this number
+        with trace.span("token_estimation"):
+            token_count, verified_token_count = estimate_conversation_tokens(st.session_state.messages, verify_tokens, trace)
         
-        # Get or create the appropriate chat session (recreates if model changed)
-        chat_session = get_or_create_chat_session(selected_model)
+        # Score the prompt once; the thinking display and caption reuse this decision
+        with trace.span("routing"):
+            decision = route(prompt, verified_token_count if verified_token_count is not None else token_count, predict_tools, ROUTING_PROFILE)
+            # What the score was made of, so the routing optimizer can replay this turn with other weights
+            trace.tag(hard=len(decision.hard_matches), medium=len(decision.medium_matches), question_marks=decision.question_marks,
+                      routing_tokens=decision.token_count, score=decision.score, routing_profile=ROUTING_PROFILE.version)
+            # If exploration is switched on (CHATBOT_ROUTING_EXPLORATION), now and then answer with
+            # a cheaper tier, so ratings show where it would have been good enough
+            explored = explore_cheaper_tier(decision)
+            exploring = explored is not decision
+            if exploring:
+                trace.tag(explored=True, explored_from=decision.model)
+                decision = explored
+            if sla_mode:
+                # Step down to a tier whose recent first-token latency fits the budget
+                recorder = get_metrics_recorder()
+                observed_latency = {}
+                for model_name in MODEL_LADDER:
+                    latency = recorder.percentile("first_token", model_name, LATENCY_HISTORY_QUANTILE, LATENCY_HISTORY_MIN_SAMPLES)
+                    if latency is not None:
+                        observed_latency[model_name] = latency
+                decision = fit_latency_budget(decision, latency_budget, observed_latency)
+            if downgrade_when_busy:
+                # Don't join a long line for the selected tier when a cheaper one is free
+                decision = avoid_busy_tiers(decision, get_request_scheduler().queue_depths(), DOWNGRADE_QUEUE_DEPTH)
+            selected_model = decision.model
+            
+            # Context this tier will see: summary of older turns + recent turns verbatim
+            context_view = st.session_state.context_manager.view(selected_model, st.session_state.token_ledger)
+        
+        # Look for an answer to the same question in the same context first
+        with trace.span("cache_lookup"):
+            cache_key = response_cache_key(prompt, selected_model, decision.tool_profile)
+            # An exploring turn is there to try its tier, so it neither reuses nor stores answers
+            cached_reply = get_response_cache().get(cache_key) if use_cache and not exploring else None
         
         # Display which model is being used and if it switched
-        model_switched = st.session_state.current_model != selected_model
+        previous_model = st.session_state.current_model
+        model_switched = cached_reply is None and previous_model is not None and previous_model != selected_model
+        trace.tag(model=selected_model, switched=model_switched, cached=cached_reply is not None, streamed=stream_responses, tools=decision.tool_profile)
+        
+        # Get the pooled chat session for this tier (catches up on missed turns)
+        if cached_reply is None:
+            with trace.span("chat_session"):
+                chat_session, synced_turns = get_or_create_chat_session(selected_model, decision.config, context_view, decision.tool_profile)
         
         with st.chat_message("assistant"):
             # Create a status container to show model thinking process (if enabled)
@@ -382,151 +571,226 @@ if prompt:
                 with status_container:
                     # Show model selection process
                     st.write(f"🎯 **Model Selection**: Analyzing complexity...")
-                    complexity_score = 1 + WEIGHT_HARD * len(HARD_PATTERN.findall(prompt)) + WEIGHT_MEDIUM * len(MEDIUM_PATTERN.findall(prompt)) + WEIGHT_SMALL * prompt.count('?')
-                    st.write(f"📊 **Complexity Score**: {complexity_score}")
+                    st.write(f"📊 **Complexity Score**: {decision.score}")
+                    matched = decision.hard_matches + decision.medium_matches
+                    if matched:
+                        st.write(f"🔑 **Matched Keywords**: {', '.join(matched)}")
                     
                     # Show token estimation
-                    try:
-                        if st.session_state.messages:
-                            conversation_prompt = ""
-                            recent_history = st.session_state.messages[-MAX_CHAT_HISTORY:]
-                            for msg in recent_history:
-                                conversation_prompt += f"{msg['role']}: {msg['content']}\n"
-                            conversation_prompt += f"user: {prompt}\n"
-                            
-                            estimated_token = st.session_state.genai_client.models.count_tokens(
-                                model="gemini-2.5-flash-lite", 
-                                contents=conversation_prompt
-                            )
-                            token_count = estimated_token.total_tokens if hasattr(estimated_token, 'total_tokens') else int(estimated_token)
-                        else:
-                            token_count = len(prompt) // 4
+                    if verified_token_count is not None:
+                        st.write(f"🔢 **Token Count**: {verified_token_count} (API verified, local estimate ~{token_count})")
+                    else:
                         st.write(f"🔢 **Token Count**: ~{token_count}")
-                    except:
-                        token_count = len(prompt) // 4
-                        st.write(f"🔢 **Token Count**: ~{token_count} (estimated)")
                     
                     st.write(f"🤖 **Selected Model**: {selected_model}")
+                    if decision.routed_model:
+                        st.write(f"⬇️ **Downgraded**: {decision.downgrade_reason}, using {selected_model}")
+                    
+                    # Show how the context was compacted for this tier
+                    if context_view.summary:
+                        st.write(f"🗜️ **Context**: Summary of {context_view.start} earlier message(s) + {len(st.session_state.messages) - context_view.start} recent message(s), ~{context_view.tokens} tokens (saved ~{context_view.saved_tokens})")
                     
                     # Show context preservation info if model switched
-                    if model_switched and len(st.session_state.messages) > 1:
-                        st.write(f"⚡ **Context Preservation**: Switching from {st.session_state.current_model} to {selected_model}")
-                        st.write("📝 **Status**: Injecting conversation history for seamless transition...")
+                    if model_switched:
+                        st.write(f"⚡ **Context Preservation**: Switching from {previous_model} to {selected_model}")
+                        if synced_turns:
+                            st.write(f"📝 **Status**: Syncing {synced_turns} missed message(s) into the {selected_model} session...")
+                        else:
+                            st.write(f"📝 **Status**: {selected_model} session is already up to date")
                     
-                    # Show model parameters
-                    if selected_model == "gemini-2.5-pro":
-                        st.write(f"⚙️ **Parameters**: Temperature=0.2, Top-p=0.8, Top-k=20 (focused & consistent)")
-                    elif selected_model == "gemini-2.5-flash":
-                        st.write(f"⚙️ **Parameters**: Temperature=0.7, Top-p=0.9, Top-k=40 (balanced)")
-                    else:
-                        st.write(f"⚙️ **Parameters**: Temperature=1.0, Top-p=0.95, Top-k=64 (creative & varied)")
+                    # Show model parameters and the tools attached for this prompt
+                    st.write(f"⚙️ **Parameters**: {decision.parameters_summary}")
+                    st.write(f"🧰 **Tools**: {decision.tools_summary}")
                     
-                    st.write("🧠 **Generating response**...")
+                    if cached_reply is not None:
+                        st.write("💾 **Cache**: Same question found in the response cache, reusing the stored answer")
+                    else:
+                        st.write("🧠 **Generating response**...")
             else:
                 # Simple spinner when thinking display is disabled
                 response_placeholder = st.empty()
-                complexity_score = 1 + WEIGHT_HARD * len(HARD_PATTERN.findall(prompt)) + WEIGHT_MEDIUM * len(MEDIUM_PATTERN.findall(prompt)) + WEIGHT_SMALL * prompt.count('?')
-                
-                # Calculate token count
-                try:
-                    if st.session_state.messages:
-                        conversation_prompt = ""
-                        recent_history = st.session_state.messages[-MAX_CHAT_HISTORY:]
-                        for msg in recent_history:
-                            conversation_prompt += f"{msg['role']}: {msg['content']}\n"
-                        conversation_prompt += f"user: {prompt}\n"
-                        
-                        estimated_token = st.session_state.genai_client.models.count_tokens(
-                            model="gemini-2.5-flash-lite", 
-                            contents=conversation_prompt
-                        )
-                        token_count = estimated_token.total_tokens if hasattr(estimated_token, 'total_tokens') else int(estimated_token)
-                    else:
-                        token_count = len(prompt) // 4
-                except:
-                    token_count = len(prompt) // 4
                 
                 with st.spinner(f"Thinking... (using {selected_model})"):
                     pass  # Just show the spinner
             
-            # Generate the actual response
-            if model_switched and len(st.session_state.messages) > 1:
-                # Send message with conversation context for model switches
-                response = send_message_with_context(chat_session, prompt, st.session_state.messages)
-            else:
-                # Normal send_message for same model or first message
-                response = chat_session.send_message(prompt)
-            # Extract and process the response with better handling for different response types
-            if hasattr(response, "text"):
-                assistant_reply = response.text
+            generation_started = time.perf_counter()
+            first_token_time = None
+            cached_tokens = prompt_tokens = 0
+            shared_reply = False
+            routed_model = selected_model
+            if cached_reply is not None:
+                # Cached replies are stored as their separate parts
+                assistant_message = Message.from_parts_json(cached_reply)
+                generation_time = time.perf_counter() - generation_started
             else:
-                # Handle responses with multiple parts (text, code, etc.)
-                assistant_reply = ""
-                if hasattr(response, 'candidates') and response.candidates:
-                    candidate = response.candidates[0]
-                    if hasattr(candidate, 'content') and candidate.content:
-                        if hasattr(candidate.content, 'parts') and candidate.content.parts:
-                            content_parts = []
-                            for part in candidate.content.parts:
-                                # Always include text parts
-                                if hasattr(part, 'text') and part.text:
-                                    content_parts.append(part.text)
-                                
-                                # Include executable code if present and relevant
-                                if hasattr(part, 'executable_code') and part.executable_code:
-                                    if hasattr(candidate, 'finish_reason') and candidate.finish_reason == "STOP":
-                                        content_parts.append(f"\n```\n{part.executable_code.code}\n```\n")
-                                
-                                # Include code execution results if present
-                                if hasattr(part, 'code_execution_result') and part.code_execution_result:
-                                    if hasattr(part.code_execution_result, 'output') and part.code_execution_result.output:
-                                        if hasattr(candidate, 'finish_reason') and candidate.finish_reason == "STOP":
-                                            content_parts.append(f"\n**Output:**\n```\n{part.code_execution_result.output}\n```\n")
-                            
-                            assistant_reply = "".join(content_parts)
-                        else:
-                            # Fallback to string conversion
-                            assistant_reply = str(candidate.content)
-                    else:
-                        assistant_reply = str(candidate)
+                # Generate the actual response; requests queue for the tier's rate limits first.
+                # A hedge may go to another tier, so the key is built for whichever model is asked
+                history = st.session_state.messages[:-1]
+                context_manager, ledger = st.session_state.context_manager, st.session_state.token_ledger
+                def make_flight_key(model_name):
+                    # Keyed by what the tier is sent: its summary of older turns and the turns after it
+                    view = context_manager.view(model_name, ledger)
+                    config = build_generation_config(model_name, decision.tool_profile)
+                    return generation_key(model_name, config, prompt, history[view.start:], view.summary)
+                send, lane_stats = make_scheduled_send(decision.token_count, make_flight_key if share_requests else None)
+                if sla_mode:
+                    # Runs in the background; a cheaper tier may answer instead if this one is slow
+                    hedged_request, selected_model = start_hedged_request(prompt, routed_model, chat_session, trace, send, decision.tool_profile)
+                    response_stream = hedged_request.chunks(selected_model)
+                    hedged = len(hedged_request.models) > 1
+                    if selected_model != routed_model:
+                        # The hedge won: its chat holds this exchange, and the cache entry belongs to it
+                        st.session_state.chat = hedged_request.chat(selected_model)
+                        st.session_state.current_model = selected_model
+                        cache_key = response_cache_key(prompt, selected_model, decision.tool_profile)
+                    trace.tag(model=selected_model, hedged=hedged, routed_model=routed_model)
+                    if show_thinking and hedged:
+                        with status_container:
+                            st.write(f"🛡️ **Hedge**: {routed_model} had no first token after {latency_budget * hedge_fraction:.1f}s, also asked {hedged_request.models[-1]} → {selected_model} answered first")
+                elif stream_responses:
+                    response_stream = send(selected_model, chat_session, prompt, True)
+                
+                # Sorts the reply's parts (text, code, output, citations) in one pass
+                parser = ReplyParser()
+                if stream_responses:
+                    def on_first_token():
+                        if show_thinking:
+                            status_container.update(label="✍️ Writing response...", expanded=False)
+                    
+                    # Chunks are parsed and drawn as they arrive, so the whole stream is one span
+                    first_token_time = stream_response(response_stream, response_placeholder, parser, on_first_token, started=generation_started)
+                    generation_time = time.perf_counter() - generation_started
                 else:
-                    # Final fallback
-                    assistant_reply = str(response)
-            
-            if not assistant_reply or assistant_reply.strip() == "":
-                assistant_reply = "I apologize, but I couldn't generate a proper response. Please try again."
-
-            # Process code blocks (keeping the enhanced processing from main.py)
-            assistant_reply = wrap_code_blocks(assistant_reply)
-            
-            # Add citations if available
-            try:
-                citations = add_citations(response)
-                if citations:
-                    assistant_reply += citations
-            except:
-                # Skip citations if there's an error processing them
-                pass
+                    # The pooled session already holds the conversation context
+                    response = next(response_stream) if sla_mode else send(selected_model, chat_session, prompt, False)
+                    generation_time = time.perf_counter() - generation_started
+                    with trace.span("response_parsing"):
+                        parser.feed(response)
+                
+                # Time to a usable first token on the answering tier (the whole reply without streaming)
+                if sla_mode:
+                    first_token_latency = hedged_request.first_token_latency(selected_model)
+                else:
+                    first_token_latency = first_token_time if stream_responses else generation_time
+                if first_token_latency is not None:
+                    trace.add("first_token", first_token_latency)
+                # Only the answering tier's queueing: a losing hedge lane waited in parallel
+                queue_stats = lane_stats(selected_model)
+                queue_wait = queue_stats["waited"]
+                trace.add("queue_wait", queue_wait)
+                trace.add("send_message", max(0.0, generation_time - queue_wait))
+                trace.tag(retries=queue_stats["retries"])
+                if show_thinking and (queue_wait >= 0.1 or queue_stats["retries"]):
+                    with status_container:
+                        st.write(f"🚦 **Queue**: Waited {queue_wait:.1f}s for {selected_model}'s rate limits ({queue_stats['retries']} retries)")
+                
+                # The answer came from another session's identical request: this chat never saw the exchange
+                shared_reply = queue_stats["shared"]
+                trace.tag(coalesced=shared_reply)
+                if show_thinking and shared_reply:
+                    with status_container:
+                        st.write(f"🔗 **Shared Request**: Another session was already asking {selected_model} the same thing, so this turn joined its request")
+                
+                # Input tokens served from the context cache (explicit, or the API's implicit caching)
+                prompt_tokens = getattr(parser.usage, "prompt_token_count", None) or 0
+                cached_tokens = getattr(parser.usage, "cached_content_token_count", None) or 0
+                trace.tag(prompt_tokens=prompt_tokens, cached_tokens=cached_tokens)
+                if show_thinking and cached_tokens:
+                    with status_container:
+                        st.write(f"💽 **Context Cache**: {cached_tokens} of {prompt_tokens} input tokens came from the cache (~{estimated_savings(selected_model, cached_tokens):.2f}s of prompt processing saved)")
+                
+                # Empty replies get a fallback text
+                with trace.span("response_parsing"):
+                    assistant_message = Message.from_reply(parser)
+                
+                # Only store real answers; error fallbacks shouldn't be replayed. Search results
+                # and code runs go stale sooner, so answers built on them expire sooner too.
+                if parser.ok and not exploring:
+                    used_tools = bool(assistant_message.citations or assistant_message.code)
+                    get_response_cache().put(cache_key, selected_model, assistant_message.parts_json(),
+                                             RESPONSE_CACHE_TOOL_TTL if used_tools else None)
             
             # Update status to show completion (if thinking display is enabled)
             if show_thinking:
                 status_container.update(label="✅ Response generated!", state="complete")
             
             # Display the final response
+            rendering_started = time.perf_counter()
             with response_placeholder.container():
-                st.markdown(assistant_reply)
+                st.markdown(assistant_message.content)
                 
                 # Show final model info
-                model_info = f"Model: {selected_model} | Complexity Score: {complexity_score} | Tokens: ~{token_count}"
+                if verified_token_count is not None:
+                    token_count = verified_token_count
+                model_info = f"Model: {selected_model}"
+                if first_token_time is not None:
+                    model_info += f" (first token {first_token_time:.2f}s, total {generation_time:.2f}s)"
+                else:
+                    model_info += f" ({generation_time:.2f}s)"
+                if cached_reply is not None:
+                    model_info += " | 💾 Cached response"
+                model_info += f" | Complexity Score: {decision.score} | Tokens: ~{token_count}"
+                if context_view.saved_tokens:
+                    model_info += f" | 🗜️ Context: ~{context_view.tokens} tokens (saved ~{context_view.saved_tokens})"
                 if model_switched:
                     model_info += " | ⚡ Model switched with context preserved"
+                if exploring:
+                    model_info += f" | 🧪 Cheaper tier tried for routing tuning (routed to {explored.routed_model})"
+                if cached_reply is None and decision.tool_profile != DEFAULT_TOOL_PROFILE:
+                    model_info += f" | 🧰 Tools: {decision.tool_profile}"
+                if cached_reply is None and queue_wait >= 0.1:
+                    model_info += f" | 🚦 Queued {queue_wait:.1f}s"
+                if shared_reply:
+                    model_info += " | 🔗 Shared with an identical in-flight request"
+                if cached_tokens:
+                    model_info += f" | 💽 {cached_tokens}/{prompt_tokens} input tokens cached (~{estimated_savings(selected_model, cached_tokens):.2f}s saved)"
+                if selected_model != routed_model:
+                    model_info += f" | 🛡️ Hedged: answered by {selected_model} instead of {routed_model}"
                 st.caption(model_info)
+                # Let the user rate this answer (the widget moves to the next answer once there is one)
+                st.session_state.rated_turn = {"index": len(st.session_state.messages), "turn_id": trace.turn_id, "model": selected_model}
+                show_feedback(st.session_state.rated_turn)
+            trace.add("rendering", time.perf_counter() - rendering_started)
+            
+            # Keep the model and timings with the message so they can be inspected later
+            assistant_message.model = selected_model
+            assistant_message.first_token_time = first_token_time
+            assistant_message.generation_time = generation_time
+            assistant_message.context_tokens = context_view.tokens
+            assistant_message.cached = cached_reply is not None
 
     except Exception as e:
         # If any error occurs, create an error message to display to the user.
-        assistant_reply = f"An error occurred: {e}"
+        assistant_message = Message("assistant", f"An error occurred: {e}", failed=True)
+        # Flag the failed turn so it isn't replayed into other model sessions
+        st.session_state.messages[-1].failed = True
+        if is_cache_error(e) and st.session_state.chat_pool.prefix_cache is not None:
+            # The tier's context cache is gone; rebuild its chat without it next turn
+            st.session_state.chat_pool.prefix_cache.discard(st.session_state.genai_client, st.session_state.current_model)
+            st.session_state.chat_pool.discard(st.session_state.current_model)
+        trace.tag(failed=True)
+        # Don't offer a rating for an error message
+        if st.session_state.get("rated_turn", {}).get("index") == len(st.session_state.messages):
+            st.session_state.pop("rated_turn")
         with st.chat_message("assistant"):
-            st.markdown(assistant_reply)
+            st.markdown(assistant_message.content)
+    
+    # Aggregate this turn's spans with every other session's (sidebar, .metrics/)
+    get_metrics_recorder().record(trace)
 
     # 4. Add the assistant's response to the message history list.
-    st.session_state.messages.append({"role": "assistant", "content": assistant_reply})
\ No newline at end of file
+    st.session_state.messages.append(assistant_message)
+    if not assistant_message.failed and not assistant_message.cached and not shared_reply:
+        # The chat recorded this exchange itself, so it's up to date with the history
+        st.session_state.chat_pool.mark_synced(selected_model, len(st.session_state.messages), decision.tool_profile)
+
+# --- 7. Memory Budgets ---
+
+# Measure this session and keep it (and the whole process) within the memory budgets.
+# Messages older than both what's on screen and every tier's verbatim context are
+# only needed for scrolling back, so they may move to disk; they're read back lazily.
+# Revealed pages count as on screen, so they're read back once rather than on every rerun.
+keep_from = min(hidden_messages, max(0, len(st.session_state.messages) - HISTORY_WINDOW_MESSAGES))
+for model_name in MODEL_LADDER:
+    keep_from = min(keep_from, st.session_state.context_manager.view(model_name, st.session_state.token_ledger).start)
+get_memory_manager().enforce(st.session_state.session_memory, keep_from)
\ No newline at end of file